@@ -4,20 +4,42 @@ RAG Memory - Vector-based memory for OpenClaw
 Implements Retrieval Augmented Generation using local vector storage
 """
 
+import io
 import json
 import os
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
 import sys
 import sqlite3
+import tempfile
+import threading
+import traceback
+import functools
 import hashlib
+import itertools
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+import heapq
 import math
+import random
 import re
+import time
+import struct
+from array import array
+from collections import OrderedDict, deque
 from pathlib import Path
-from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple
 from dataclasses import dataclass, asdict
 
-# Try to import numpy, fall back to pure Python
+# Try to import numpy, fall back to pure Python (RAG_MEMORY_NO_NUMPY forces the fallback)
 try:
+    if os.environ.get("RAG_MEMORY_NO_NUMPY"):
+        raise ImportError("numpy disabled by RAG_MEMORY_NO_NUMPY")
     import numpy as np
     HAS_NUMPY = True
 except ImportError:
@@ -31,8 +53,87 @@ DEFAULT_CONFIG = {
     "embedding_dim": 384,
     "storage_path": os.path.expanduser("~/.openclaw/data/rag-memory/"),
     "search_threshold": 0.01,  # Lowered for hash-based embeddings
+    "vector_sidecar": True,  # Mirror embeddings into mmap-able vectors.f32 (vectors.q8 when quantized)
+    "quantizer": "none",  # none | int8 rows in the vector sidecar, re-ranked at full precision
+    "quantizer_rerank": 4,  # Quantized candidates re-ranked exactly per requested result
+    "shard_by": "none",  # none | content_type | month | content_type+month partitions of the vector sidecar
+    "shard_workers": 4,  # Threads scanning shards concurrently
+    "resident_index": False,  # Keep a full in-memory matrix instead of scanning the sidecar
+    "scan_block_rows": 65536,
+    "search_mode": "exact",  # exact | ann | sparse | hybrid
+    "ann_tables": 8,
+    "ann_bits": 12,
+    "ann_probes": 2,
+    "token_cache_size": 65536,  # Distinct words whose hash features are memoized
+    "ingest_batch_size": 500,  # Chunks per ingest transaction
+    "ingest_workers": 1,  # Processes that read/chunk/embed files in add_directory
+    "stream_threshold_bytes": 4 * 1024 * 1024,  # Larger files are chunked while reading
+    "socket_path": None,  # Daemon socket (default: <storage_path>/rag-memory.sock)
+    "query_cache_size": 256,  # Cached search results (0 disables the cache)
+    "query_cache_persist": False,  # Share cached results between processes via vectors.db
+    "indexed_metadata_keys": [],  # Metadata keys given JSON1 expression indexes for --where
+    "hybrid_candidates": 200,  # BM25 candidates re-ranked by cosine in hybrid mode
+    "hybrid_alpha": 0.7,  # Weight of cosine vs normalized BM25 in the fused hybrid score
+    "metrics": True,  # Stage timers and counters, aggregated in <storage_path>/metrics.json
+    "dedup_mode": "off",  # off | skip | merge near-duplicate chunks at ingest
+    "dedup_threshold": 0.95,  # SimHash similarity (1 - differing bits / 64) counted as a near-duplicate
+    "dedup_bands": 4,  # SimHash lookup bands; every match within dedup_bands - 1 bits is found
+    "busy_timeout_ms": 30000,  # How long a connection waits on another process's write lock
+    "retention": {},  # content_type -> age (e.g. {"daily": "90d"}) past which chunks are deleted
 }
 
+# Columns of the chunks table; text lives in documents, addressed by byte offsets
+CHUNK_COLUMNS = """
+    id TEXT PRIMARY KEY,
+    embedding_vector BLOB NOT NULL,
+    metadata TEXT,
+    created_at TEXT,
+    token_count INTEGER,
+    content_type TEXT,
+    source_file TEXT,
+    vec_row INTEGER,
+    simhash INTEGER,
+    shard TEXT NOT NULL DEFAULT '',
+    doc_id INTEGER,
+    start_offset INTEGER,
+    end_offset INTEGER
+"""
+
+_WORD = re.compile(r'\S+')  # What str.split() with no arguments splits out
+
+# Connection settings for ingest sessions
+INGEST_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # 64 MiB
+    "PRAGMA temp_store=MEMORY",
+)
+
+# On-disk schema version and embedding encoding, recorded in store_meta
+SCHEMA_VERSION = 3
+EMBEDDING_FORMAT = "f32le"  # packed little-endian float32
+DOCUMENT_BLOCK_BYTES = 16384  # Uncompressed bytes per compressed document block
+MIGRATION_BATCH_SIZE = 500
+STREAM_BLOCK_CHARS = 1 << 20
+FILTER_SCAN_RATIO = 16  # Score filtered rows from SQL when they are under 1/16 of the sidecar
+QUANTIZED_SLICE_ROWS = 512  # int8 rows widened to float32 at a time, small enough to stay in cache
+SIMHASH_SHINGLE = 3  # Words per shingle hashed into a chunk's SimHash
+COLLAPSE_OVERFETCH = 3  # Hits scored per requested result when collapsing near-duplicates
+METRICS_WINDOW = 512  # Recent durations per command kept for latency quantiles
+METRICS_FLUSH_SECONDS = 10  # Longest a long-running process holds aggregates before writing them
+BUSY_RETRIES = 5  # Attempts at taking the write lock once busy_timeout has run out
+BUSY_BACKOFF_SECONDS = 0.05  # First pause between those attempts, doubled after each
+COMPACT_STEP_PAGES = 1024  # Free pages released per incremental_vacuum transaction
+COMPACT_MERGE_PAGES = 256  # FTS5 pages merged per transaction while compacting
+COMPACT_CHECKPOINT_MS = 1000  # Longest compact waits on readers to truncate the WAL
+SIDECAR_OPEN_RETRIES = 20  # Attempts at mapping a sidecar pair while a rebuild swaps its files
+SIDECAR_RETRY_SECONDS = 0.005  # Pause between those attempts
+
+# CLI commands the thin client forwards to a running daemon
+DAEMON_COMMANDS = ("search", "retrieve", "ingest", "stats", "metrics")
+# CLI commands timed into metrics and accepting --profile
+PROFILED_COMMANDS = ("ingest", "search", "retrieve")
+
 @dataclass
 class Chunk:
     id: str
@@ -42,327 +143,3957 @@ class Chunk:
     created_at: str
     token_count: int
 
-class RAGMemory:
-    """RAG Memory implementation with vector embeddings"""
+def _top_k_blocks(blocks: Iterable[Tuple[int, Any, Any]], queries, top_k: int,
+                  threshold: float, score: Optional[Callable[[Any, Any], Any]] = None
+                  ) -> List[List[Tuple[int, float]]]:
+    """Per-query top_k (row, score) pairs over blocks of rows (NumPy only)
     
-    def __init__(self, config_path: Optional[str] = None):
-        self.config = self._load_config(config_path)
-        self.storage_path = Path(self.config["storage_path"])
-        self.storage_path.mkdir(parents=True, exist_ok=True)
-        self.db_path = self.storage_path / "vectors.db"
-        self._init_db()
+    blocks yields (first_row, vectors, valid) with valid a boolean row mask
+    or None. Each block is scored for every query at once as a (B, dim) x
+    (dim, Q) product, or by score(vectors, queries) when given. Results are
+    best first, ties broken by row.
+    """
+    count = queries.shape[0]
+    best_scores = np.empty((0, count), dtype=np.float32)
+    best_rows = np.empty((0, count), dtype=np.int64)
     
-    def _load_config(self, config_path: Optional[str]) -> Dict[str, Any]:
-        if config_path and os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                return json.load(f)
+    for start, vectors, valid in blocks:
+        scores = vectors @ queries.T if score is None else score(vectors, queries)
+        scores[scores < threshold] = -np.inf
+        if valid is not None:
+            scores[~valid] = -np.inf
         
-        config_path = os.path.expanduser("~/.openclaw/data/rag-memory/config.json")
-        if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                return json.load(f)
+        if scores.shape[0] > top_k:
+            keep = np.argpartition(-scores, top_k - 1, axis=0)[:top_k]
+            scores = np.take_along_axis(scores, keep, axis=0)
+            rows = keep + start
+        else:
+            rows = np.broadcast_to(np.arange(start, start + scores.shape[0])[:, None], scores.shape)
         
-        return DEFAULT_CONFIG.copy()
+        best_scores = np.concatenate([best_scores, scores])
+        best_rows = np.concatenate([best_rows, rows])
+        if best_scores.shape[0] > top_k:
+            keep = np.argpartition(-best_scores, top_k - 1, axis=0)[:top_k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=0)
+            best_rows = np.take_along_axis(best_rows, keep, axis=0)
     
-    def _init_db(self):
-        """Initialize SQLite database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    results = []
+    for q in range(count):
+        live = np.isfinite(best_scores[:, q])
+        scores, rows = best_scores[live, q], best_rows[live, q]
+        order = np.lexsort((rows, -scores))
+        results.append([(int(rows[i]), float(scores[i])) for i in order])
+    return results
+
+def _hamming64(a: int, b: int) -> int:
+    """Bits that differ between two SimHashes (stored as signed 64-bit integers)"""
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count('1')
+
+def _simhash_bands(value: int, bands: int) -> List[Tuple[int, int]]:
+    """(band, value) lookup keys: the SimHash cut into `bands` equal bit ranges"""
+    width = 64 // bands
+    mask = (1 << width) - 1
+    value &= 0xFFFFFFFFFFFFFFFF
+    return [(band, (value >> (band * width)) & mask) for band in range(bands)]
+
+class VectorIndex:
+    """Resident matrix of pre-normalized embeddings with parallel id/type arrays"""
+    
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.type_codes: Dict[str, int] = {}
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chunks (
-                id TEXT PRIMARY KEY,
-                text TEXT NOT NULL,
-                embedding_vector BLOB NOT NULL,
-                metadata TEXT,
-                created_at TEXT,
-                token_count INTEGER,
-                content_type TEXT,
-                source_file TEXT
+        if HAS_NUMPY:
+            # Row buffers grow geometrically; only the first len(ids) rows are live
+            self._matrix = np.empty((0, dim), dtype=np.float32)
+            self._types = np.empty(0, dtype=np.int32)
+            self._capacity = 0
+        else:
+            self._rows: List[List[float]] = []
+            self._types: List[int] = []
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def _normalize(self, vector):
+        """Scale a vector to unit length (zero vectors are left as-is)"""
+        if HAS_NUMPY:
+            vec = np.asarray(vector, dtype=np.float32)
+            norm = float(np.linalg.norm(vec))
+            return vec / norm if norm > 0 else vec
+        
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm > 0 else list(vector)
+    
+    def _type_code(self, content_type: str) -> int:
+        if content_type not in self.type_codes:
+            self.type_codes[content_type] = len(self.type_codes)
+        return self.type_codes[content_type]
+    
+    def load(self, rows: List[Tuple[str, str, Any]]) -> None:
+        """Bulk-load (id, content_type, embedding) rows"""
+        self.ids = [row[0] for row in rows]
+        self.positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        codes = [self._type_code(row[1] or "general") for row in rows]
+        
+        if HAS_NUMPY:
+            matrix = np.zeros((len(rows), self.dim), dtype=np.float32)
+            for i, row in enumerate(rows):
+                matrix[i] = row[2]
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self._matrix = matrix / norms
+            self._types = np.asarray(codes, dtype=np.int32)
+            self._capacity = len(rows)
+        else:
+            self._rows = [self._normalize(row[2]) for row in rows]
+            self._types = codes
+    
+    def add(self, chunk_id: str, content_type: str, vector) -> None:
+        """Insert a row, or overwrite it in place if the id is already indexed"""
+        row = self._normalize(vector)
+        code = self._type_code(content_type or "general")
+        
+        if chunk_id in self.positions:
+            pos = self.positions[chunk_id]
+            if HAS_NUMPY:
+                self._matrix[pos] = row
+            else:
+                self._rows[pos] = row
+            self._types[pos] = code
+            return
+        
+        pos = len(self.ids)
+        self.positions[chunk_id] = pos
+        self.ids.append(chunk_id)
+        
+        if HAS_NUMPY:
+            if pos >= self._capacity:
+                self._grow(max(64, self._capacity * 2))
+            self._matrix[pos] = row
+            self._types[pos] = code
+        else:
+            self._rows.append(row)
+            self._types.append(code)
+    
+    def remove(self, chunk_ids: Sequence[str]) -> None:
+        """Drop rows, moving the last row into each freed slot"""
+        for chunk_id in chunk_ids:
+            pos = self.positions.pop(chunk_id, None)
+            if pos is None:
+                continue
+            
+            last = len(self.ids) - 1
+            if pos != last:
+                moved = self.ids[last]
+                self.ids[pos] = moved
+                self.positions[moved] = pos
+                if HAS_NUMPY:
+                    self._matrix[pos] = self._matrix[last]
+                else:
+                    self._rows[pos] = self._rows[last]
+                self._types[pos] = self._types[last]
+            
+            self.ids.pop()
+            if not HAS_NUMPY:
+                self._rows.pop()
+                self._types.pop()
+    
+    def _grow(self, capacity: int) -> None:
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        types = np.zeros(capacity, dtype=np.int32)
+        size = len(self.ids) - 1
+        matrix[:size] = self._matrix[:size]
+        types[:size] = self._types[:size]
+        self._matrix, self._types, self._capacity = matrix, types, capacity
+    
+    def search(self, query, top_k: int, threshold: float,
+               content_type: Optional[str] = None,
+               allowed_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Return up to top_k (id, similarity) pairs, best first
+        
+        allowed_ids, when given, restricts scoring to those chunks.
+        """
+        if top_k <= 0 or not self.ids:
+            return []
+        
+        code = None
+        if content_type:
+            code = self.type_codes.get(content_type)
+            if code is None:
+                return []
+        
+        allowed = None
+        if allowed_ids is not None:
+            allowed = [self.positions[chunk_id] for chunk_id in allowed_ids if chunk_id in self.positions]
+            if not allowed:
+                return []
+        
+        query = self._normalize(query)
+        
+        if not HAS_NUMPY:
+            positions = sorted(allowed) if allowed is not None else range(len(self._rows))
+            scored = (
+                (sum(a * b for a, b in zip(self._rows[pos], query)), pos)
+                for pos in positions
+                if code is None or self._types[pos] == code
             )
-        ''')
+            best = heapq.nlargest(top_k, (item for item in scored if item[0] >= threshold),
+                                  key=lambda item: item[0])
+            return [(self.ids[pos], score) for score, pos in best]
         
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_content_type ON chunks(content_type)
-        ''')
+        size = len(self.ids)
+        scores = self._matrix[:size] @ query
+        mask = scores >= threshold
+        if code is not None:
+            mask &= self._types[:size] == code
+        if allowed is not None:
+            permitted = np.zeros(size, dtype=bool)
+            permitted[allowed] = True
+            mask &= permitted
         
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_created_at ON chunks(created_at)
-        ''')
+        candidates = np.flatnonzero(mask)
+        if candidates.size > top_k:
+            keep = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = np.sort(candidates[keep])
         
-        conn.commit()
-        conn.close()
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.ids[pos], float(scores[pos])) for pos in order]
     
-    def _generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding vector for text using hash-based method"""
-        # Simple but effective hash-based embedding
-        # Works offline, deterministic, fast
-        words = text.lower().split()
-        dim = self.config["embedding_dim"]
-        embedding = [0.0] * dim
+    def search_many(self, queries: Sequence[Any], top_k: int, threshold: float,
+                    content_type: Optional[str] = None,
+                    allowed_ids: Optional[Iterable[str]] = None,
+                    block_rows: int = 65536) -> List[List[Tuple[str, float]]]:
+        """search() for several queries in one pass over the matrix"""
+        if not HAS_NUMPY:
+            return [self.search(query, top_k, threshold, content_type, allowed_ids) for query in queries]
         
-        for word in words:
-            # Hash word to get deterministic pseudo-random values
-            word_hash = hashlib.md5(word.encode()).hexdigest()
-            
-            # Use hash to determine indices and values
-            for i in range(0, len(word_hash), 8):
-                if i + 8 > len(word_hash):
-                    break
-                    
-                idx = int(word_hash[i:i+4], 16) % dim
-                val = int(word_hash[i+4:i+8], 16) / 0xFFFFFFFF
-                
-                embedding[idx] += val * (1 - 2 * ((ord(word_hash[i]) & 1) == 0))
+        if allowed_ids is not None:
+            allowed_ids = list(allowed_ids)
+        if top_k <= 0 or not self.ids:
+            return [[] for _ in queries]
         
-        # Normalize
-        norm = math.sqrt(sum(x*x for x in embedding))
-        if norm > 0:
-            embedding = [x / norm for x in embedding]
+        size = len(self.ids)
+        valid = None
+        if content_type:
+            code = self.type_codes.get(content_type)
+            if code is None:
+                return [[] for _ in queries]
+            valid = self._types[:size] == code
+        if allowed_ids is not None:
+            permitted = np.zeros(size, dtype=bool)
+            permitted[[self.positions[chunk_id] for chunk_id in allowed_ids if chunk_id in self.positions]] = True
+            valid = permitted if valid is None else valid & permitted
+        
+        matrix = np.asarray(queries, dtype=np.float32).reshape(len(queries), self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
         
-        return embedding
+        blocks = ((start, self._matrix[start:min(size, start + block_rows)],
+                   None if valid is None else valid[start:start + block_rows])
+                  for start in range(0, size, block_rows))
+        return [[(self.ids[row], score) for row, score in hits]
+                for hits in _top_k_blocks(blocks, matrix, top_k, threshold)]
+
+class VectorSidecar:
+    """Append-only memory-mapped vectors with a row -> chunk-id map
     
-    def _cosine_similarity(self, a: List[float], b: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
+    vectors.f32 is a 24-byte header followed by one little-endian float32 row
+    per chunk, and vectors.ids is a 16-byte header followed by the matching
+    16-byte chunk ids. Both headers carry the generation of the rebuild that
+    wrote the pair: a rebuild swaps the files with two renames, so a reader
+    that maps a vectors file and an ids file of different generations retries
+    instead of pairing new ids with old rows. Deleted
+    rows are tombstoned by zeroing their id and dropped on compaction. The
+    committed row count lives in store_meta, so rows appended by a writer that
+    died before its SQLite commit are truncated on the next open.
+    
+    With the int8 quantizer the rows live in vectors.q8 instead: a float32
+    scale followed by one int8 code per dimension, so that code * scale
+    approximates the stored value. The header records the row format, and a
+    file in another format is rebuilt from the chunks table on open.
+    
+    A named shard keeps its files under shards/<name>/ and its counts under
+    store_meta keys suffixed with ":<name>", and holds only the chunks whose
+    shard column carries that name.
+    """
+    
+    MAGIC = b"RAGVEC02"
+    HEADER_SIZE = 24
+    IDS_MAGIC = b"RAGIDS01"
+    IDS_HEADER_SIZE = 16
+    ID_SIZE = 16
+    # quantizer -> (file name, format code in the header)
+    FORMATS = {"none": ("vectors.f32", 0), "int8": ("vectors.q8", 1)}
+    
+    def __init__(self, storage_path: Path, dim: int, quantizer: str = "none", shard: str = ""):
+        if quantizer not in self.FORMATS:
+            raise ValueError(f"Unknown quantizer: {quantizer}")
+        self.dim = dim
+        self.quantizer = quantizer
+        self.shard = shard
+        self.row_bytes = dim + 4 if quantizer == "int8" else dim * 4
+        name, self.format_code = self.FORMATS[quantizer]
+        self.directory = storage_path / "shards" / shard if shard else storage_path
+        self.vectors_path = self.directory / name
+        self.ids_path = self.directory / "vectors.ids"
+        suffix = f":{shard}" if shard else ""
+        self._rows_key = "sidecar_rows" + suffix
+        self._live_key = "sidecar_live" + suffix
+    
+    def _header(self, generation: int) -> bytes:
+        return self.MAGIC + struct.pack('<IIQ', self.dim, self.format_code, generation)
+    
+    def _ids_header(self, generation: int) -> bytes:
+        return self.IDS_MAGIC + struct.pack('<Q', generation)
+    
+    def _generation(self, fv, fi) -> Optional[int]:
+        """Generation shared by open (vectors, ids) files, or None if they don't match"""
+        vectors_header = fv.read(self.HEADER_SIZE)
+        ids_header = fi.read(self.IDS_HEADER_SIZE)
+        if len(vectors_header) != self.HEADER_SIZE or len(ids_header) != self.IDS_HEADER_SIZE:
+            return None
+        generation = struct.unpack('<Q', ids_header[len(self.IDS_MAGIC):])[0]
+        if vectors_header != self._header(generation) or ids_header != self._ids_header(generation):
+            return None
+        return generation
+    
+    def _open_pair(self):
+        """Open (vectors, ids) of one generation, or None if either file is missing
+        
+        A rebuild between its two renames leaves the pair mismatched for a
+        moment, so a mismatch is retried before it is reported.
+        """
+        for attempt in range(SIDECAR_OPEN_RETRIES):
+            try:
+                fv = open(self.vectors_path, 'rb')
+            except OSError:
+                return None
+            try:
+                fi = open(self.ids_path, 'rb')
+            except OSError:
+                fv.close()
+                return None
+            if self._generation(fv, fi) is not None:
+                return fv, fi
+            fv.close()
+            fi.close()
+            time.sleep(SIDECAR_RETRY_SECONDS)
+        raise RuntimeError(f"{self.vectors_path} and {self.ids_path} are from different rebuilds; "
+                           "reopen the store to repair them")
+    
+    @property
+    def compression_ratio(self) -> float:
+        """float32 bytes per vector over the bytes a sidecar row takes"""
+        return self.dim * 4 / self.row_bytes
+    
+    def encode(self, blobs: Sequence[bytes]) -> bytes:
+        """Sidecar rows for packed float32 embeddings
+        
+        int8 codes are round(value / scale) with scale = max|value| / 127,
+        computed in double precision with and without NumPy so that both
+        write identical rows.
+        """
+        if self.quantizer == "none":
+            return b''.join(blobs)
+        
         if HAS_NUMPY:
-            a_arr = np.array(a)
-            b_arr = np.array(b)
-            return float(np.dot(a_arr, b_arr) / (np.linalg.norm(a_arr) * np.linalg.norm(b_arr) + 1e-8))
-        else:
-            # Pure Python implementation
-            dot = sum(x * y for x, y in zip(a, b))
-            norm_a = math.sqrt(sum(x * x for x in a))
-            norm_b = math.sqrt(sum(y * y for y in b))
-            return dot / (norm_a * norm_b + 1e-8)
+            vectors = np.frombuffer(b''.join(blobs), dtype='<f4').reshape(-1, self.dim).astype(np.float64)
+            peaks = np.abs(vectors).max(axis=1) if len(vectors) else np.zeros(0)
+            scales = np.where(peaks > 0, peaks / 127.0, 1.0)
+            rows = np.empty(len(vectors), dtype=[('scale', '<f4'), ('codes', 'i1', (self.dim,))])
+            rows['scale'] = scales
+            rows['codes'] = np.rint(vectors / scales[:, None])
+            return rows.tobytes()
+        
+        out = bytearray()
+        for blob in blobs:
+            values = array('f')
+            values.frombytes(blob)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            peak = max((abs(x) for x in values), default=0.0)
+            scale = peak / 127.0 if peak > 0 else 1.0
+            out += struct.pack('<f', scale)
+            out += array('b', [round(x / scale) for x in values]).tobytes()
+        return bytes(out)
     
-    def _estimate_token_count(self, text: str) -> int:
-        """Estimate token count (rough approximation: ~4 chars per token)"""
-        return len(text) // 4
+    def _pack_id(self, chunk_id: str) -> bytes:
+        return chunk_id.encode()[:self.ID_SIZE].ljust(self.ID_SIZE, b'\0')
     
-    def _chunk_text(self, text: str, chunk_size: int, overlap: int, 
-                    metadata: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        words = text.split()
+    def _disk_rows(self) -> Optional[Tuple[int, int]]:
+        """Rows present in (vectors.f32, vectors.ids), or None if unusable"""
+        try:
+            with open(self.vectors_path, 'rb') as fv, open(self.ids_path, 'rb') as fi:
+                if self._generation(fv, fi) is None:
+                    return None
+                vec_bytes = os.fstat(fv.fileno()).st_size - self.HEADER_SIZE
+                id_bytes = os.fstat(fi.fileno()).st_size - self.IDS_HEADER_SIZE
+        except OSError:
+            return None
+        return vec_bytes // self.row_bytes, id_bytes // self.ID_SIZE
+    
+    def counts(self, cursor) -> Tuple[int, int]:
+        """Committed (rows, live rows) according to store_meta"""
+        rows = RAGMemory._get_meta(cursor, self._rows_key)
+        live = RAGMemory._get_meta(cursor, self._live_key)
+        return int(rows or 0), int(live or 0)
+    
+    def needs_repair(self, cursor, chunk_count: int) -> bool:
+        """Check the files and meta counts against the chunks table"""
+        if RAGMemory._get_meta(cursor, self._rows_key) is None:
+            return True
+        disk = self._disk_rows()
+        rows, live = self.counts(cursor)
+        return disk is None or disk != (rows, rows) or live != chunk_count
+    
+    def repair(self, cursor, chunk_count: int) -> None:
+        """Truncate an uncommitted tail, or rebuild if rows are missing
         
-        if not words:
-            return chunks
+        Must be called inside a write transaction so no other writer is
+        mid-append.
+        """
+        disk = self._disk_rows()
+        rows, live = self.counts(cursor)
         
-        # Simple word-based chunking
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk_words = words[i:i + chunk_size]
-            chunk_text = ' '.join(chunk_words)
-            
-            chunk_meta = metadata.copy()
-            chunk_meta["chunk_index"] = len(chunks)
-            chunk_meta["start_position"] = i
-            chunk_meta["end_position"] = i + len(chunk_words)
-            
-            chunks.append((chunk_text, chunk_meta))
-            
-            if i + chunk_size >= len(words):
-                break
+        if (RAGMemory._get_meta(cursor, self._rows_key) is not None and disk is not None
+                and disk[0] >= rows and disk[1] >= rows and live == chunk_count):
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(self.HEADER_SIZE + rows * self.row_bytes)
+            with open(self.ids_path, 'r+b') as f:
+                f.truncate(self.IDS_HEADER_SIZE + rows * self.ID_SIZE)
+            return
         
-        return chunks
+        self.rebuild(cursor)
     
-    def add_chunk(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> str:
-        """Add a single text chunk to the vector store"""
-        if metadata is None:
-            metadata = {}
+    def rebuild(self, cursor) -> int:
+        """Rewrite both files from the chunks table, dropping tombstones"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_vectors = self.vectors_path.with_name(self.vectors_path.name + ".tmp")
+        tmp_ids = self.ids_path.with_name(self.ids_path.name + ".tmp")
+        reader = cursor.connection.cursor()
+        reader.execute("SELECT id, embedding_vector FROM chunks WHERE shard = ? ORDER BY rowid", (self.shard,))
         
-        # Generate unique ID
-        chunk_id = hashlib.sha256(text.encode()).hexdigest()[:16]
+        assignments = []
+        generation = time.time_ns()
+        with open(tmp_vectors, 'wb') as fv, open(tmp_ids, 'wb') as fi:
+            fv.write(self._header(generation))
+            fi.write(self._ids_header(generation))
+            while True:
+                batch = reader.fetchmany(MIGRATION_BATCH_SIZE)
+                if not batch:
+                    break
+                for chunk_id, blob in batch:
+                    if len(blob) != self.dim * 4:
+                        raise ValueError(f"Chunk {chunk_id} has {len(blob) // 4} dims, expected {self.dim}")
+                    fi.write(self._pack_id(chunk_id))
+                    assignments.append((len(assignments), chunk_id))
+                fv.write(self.encode([blob for _, blob in batch]))
+            for f in (fv, fi):
+                f.flush()
+                os.fsync(f.fileno())
         
-        # Generate embedding
-        embedding = self._generate_embedding(text)
+        os.replace(tmp_ids, self.ids_path)
+        os.replace(tmp_vectors, self.vectors_path)
+        # Rows in another format no longer line up with the rewritten ids
+        for name, _ in self.FORMATS.values():
+            stale = self.vectors_path.with_name(name)
+            if stale != self.vectors_path and stale.exists():
+                stale.unlink()
         
-        # Count tokens
-        token_count = self._estimate_token_count(text)
+        cursor.executemany("UPDATE chunks SET vec_row = ? WHERE id = ?", assignments)
+        RAGMemory._set_meta(cursor, self._rows_key, len(assignments))
+        RAGMemory._set_meta(cursor, self._live_key, len(assignments))
+        return len(assignments)
+    
+    def append(self, cursor, rows: List[Tuple[str, bytes]]) -> List[int]:
+        """Append (chunk_id, float32 blob) rows; returns their row numbers
         
-        # Set metadata defaults
-        metadata.setdefault("content_type", "general")
-        metadata.setdefault("created_at", datetime.now().isoformat())
+        The data is fsynced before store_meta is updated, and the caller's
+        commit is what makes the rows visible.
+        """
+        if RAGMemory._get_meta(cursor, self._rows_key) is None:
+            self.clear(cursor)
+        start, live = self.counts(cursor)
         
-        # Store in database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with open(self.vectors_path, 'r+b') as fv, open(self.ids_path, 'r+b') as fi:
+            fv.seek(self.HEADER_SIZE + start * self.row_bytes)
+            fi.seek(self.IDS_HEADER_SIZE + start * self.ID_SIZE)
+            fv.write(self.encode([blob for _, blob in rows]))
+            for chunk_id, _ in rows:
+                fi.write(self._pack_id(chunk_id))
+            for f in (fv, fi):
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+        
+        RAGMemory._set_meta(cursor, self._rows_key, start + len(rows))
+        RAGMemory._set_meta(cursor, self._live_key, live + len(rows))
+        return list(range(start, start + len(rows)))
+    
+    def tombstone(self, cursor, row_numbers: List[int]) -> None:
+        """Count rows as deleted; call erase() once the transaction commits"""
+        if row_numbers:
+            rows, live = self.counts(cursor)
+            RAGMemory._set_meta(cursor, self._live_key, live - len(row_numbers))
+    
+    def erase(self, row_numbers: List[int]) -> None:
+        """Zero the ids of tombstoned rows
+        
+        Runs after the commit: if we die first, the rows still carry ids of
+        chunks that no longer exist, which search drops when hydrating.
+        """
+        if not row_numbers:
+            return
+        with open(self.ids_path, 'r+b') as fi:
+            for row in row_numbers:
+                fi.seek(self.IDS_HEADER_SIZE + row * self.ID_SIZE)
+                fi.write(b'\0' * self.ID_SIZE)
+            fi.flush()
+            os.fsync(fi.fileno())
+    
+    def clear(self, cursor) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        generation = time.time_ns()
+        with open(self.vectors_path, 'wb') as f:
+            f.write(self._header(generation))
+        with open(self.ids_path, 'wb') as f:
+            f.write(self._ids_header(generation))
+        RAGMemory._set_meta(cursor, self._rows_key, 0)
+        RAGMemory._set_meta(cursor, self._live_key, 0)
+    
+    def set_read_only(self, read_only: bool) -> None:
+        """Drop (or restore the owner's) write permission on both files"""
+        for path in (self.vectors_path, self.ids_path):
+            if path.exists():
+                mode = path.stat().st_mode & 0o7777
+                os.chmod(path, mode & ~0o222 if read_only else mode | 0o200)
+    
+    def scan(self, rows: int, query, top_k: int, threshold: float,
+             allowed_ids: Optional[List[str]] = None,
+             block_rows: int = 65536, compacted: bool = False) -> List[Tuple[str, float]]:
+        """Score the first `rows` committed rows block by block (NumPy only)
+        
+        Quantized rows are scored from their codes, so the scores are
+        approximate and callers re-rank the winners at full precision.
+        """
+        return self.scan_many(rows, [query], top_k, threshold, allowed_ids, block_rows, compacted)[0]
+    
+    def scan_many(self, rows: int, queries: Sequence[Any], top_k: int, threshold: float,
+                  allowed_ids: Optional[List[str]] = None,
+                  block_rows: int = 65536, compacted: bool = False) -> List[List[Tuple[str, float]]]:
+        """scan() for several queries, reading each block of vectors once
+        
+        compacted promises there are no tombstones, so blocks are scored
+        without reading their ids unless allowed_ids needs them.
+        """
+        pair = self._open_pair() if rows > 0 and top_k > 0 else None
+        if pair is None:
+            return [[] for _ in queries]
+        
+        # Map the files whose generations were checked, not whatever the paths name by now
+        with pair[0] as fv, pair[1] as fi:
+            # A compaction committed after the caller's snapshot may have shortened the files
+            rows = min(rows, (os.fstat(fv.fileno()).st_size - self.HEADER_SIZE) // self.row_bytes,
+                       (os.fstat(fi.fileno()).st_size - self.IDS_HEADER_SIZE) // self.ID_SIZE)
+            if rows <= 0:
+                return [[] for _ in queries]
+            if self.quantizer == "int8":
+                vectors = np.memmap(fv, mode='r', offset=self.HEADER_SIZE, shape=(rows,),
+                                    dtype=[('scale', '<f4'), ('codes', 'i1', (self.dim,))])
+            else:
+                vectors = np.memmap(fv, dtype='<f4', mode='r', offset=self.HEADER_SIZE, shape=(rows, self.dim))
+            ids = np.memmap(fi, dtype=f'S{self.ID_SIZE}', mode='r', offset=self.IDS_HEADER_SIZE, shape=(rows,))
+        allowed = None
+        if allowed_ids is not None:
+            allowed = np.array([self._pack_id(chunk_id) for chunk_id in allowed_ids],
+                               dtype=f'S{self.ID_SIZE}')
+        
+        matrix = np.asarray(queries, dtype=np.float32).reshape(len(queries), self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+        
+        def blocks():
+            for start in range(0, rows, block_rows):
+                stop = min(rows, start + block_rows)
+                valid = None
+                if not compacted or allowed is not None:
+                    block_ids = ids[start:stop]
+                    valid = block_ids != b''
+                    if allowed is not None:
+                        valid &= np.isin(block_ids, allowed)
+                yield start, vectors[start:stop], valid
+        
+        scorer = self._score_codes if self.quantizer == "int8" else None
+        return [[(ids[row].decode(), score) for row, score in hits]
+                for hits in _top_k_blocks(blocks(), matrix, top_k, threshold, scorer)]
+    
+    def _score_codes(self, block, queries):
+        """(B, Q) approximate scores for a block of int8 rows
         
+        Codes are widened to float32 one cache-sized slice at a time, so the
+        product runs in BLAS without materializing a float32 copy of the block.
+        """
+        scores = np.empty((len(block), queries.shape[0]), dtype=np.float32)
+        widened = np.empty((min(len(block), QUANTIZED_SLICE_ROWS), self.dim), dtype=np.float32)
+        for start in range(0, len(block), QUANTIZED_SLICE_ROWS):
+            codes = block['codes'][start:start + QUANTIZED_SLICE_ROWS]
+            np.copyto(widened[:len(codes)], codes, casting='unsafe')
+            np.matmul(widened[:len(codes)], queries.T, out=scores[start:start + len(codes)])
+        scores *= block['scale'][:, None]
+        return scores
+
+class ShardedSidecar:
+    """Vector sidecar partitioned into shards by content type and/or month
+    
+    Each shard is a VectorSidecar holding the rows of the chunks whose shard
+    column names it; with shard_by "none" the only shard is "" and keeps the
+    unsharded layout at the top of the storage directory. The shards table
+    records each shard's content type (when sharding by type) and the
+    created_at range of its rows, so a search scans only the shards its
+    content type and since/until filters can match. Several shards are
+    scanned at once on a thread pool (NumPy releases the GIL in the scoring
+    products) and their best-first hit lists merged with a heap.
+    
+    Freezing a shard compacts it, records its exact created_at range and
+    makes its files read-only; scans then skip its tombstone check. Writing
+    to a frozen shard thaws it first.
+    """
+    
+    KEYS = ("none", "content_type", "month", "content_type+month")
+    
+    def __init__(self, storage_path: Path, dim: int, quantizer: str = "none",
+                 shard_by: str = "none", workers: int = 4):
+        if shard_by not in self.KEYS:
+            raise ValueError(f"Unknown shard_by: {shard_by}")
+        self.storage_path = storage_path
+        self.dim = dim
+        self.quantizer = quantizer
+        self.shard_by = shard_by
+        self.workers = max(1, workers)
+        self._parts = set(shard_by.split("+")) - {"none"}
+        self._shards: Dict[str, VectorSidecar] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self.row_bytes = self.shard("").row_bytes
+        self.compression_ratio = self.shard("").compression_ratio
+    
+    @staticmethod
+    def _safe_name(value: str) -> str:
+        """value if it is usable as a directory name, else a cleaned-up form plus a hash"""
+        if re.fullmatch(r'[A-Za-z0-9_-]+', value):
+            return value
+        return re.sub(r'[^A-Za-z0-9_-]', '_', value)[:32] + "-" + hashlib.sha256(value.encode()).hexdigest()[:8]
+    
+    def key(self, content_type: Optional[str], created_at: Optional[str]) -> str:
+        """Name of the shard a chunk belongs in"""
+        parts = []
+        if "content_type" in self._parts:
+            parts.append(self._safe_name(content_type or "general"))
+        if "month" in self._parts:
+            parts.append(self._safe_name((created_at or "")[:7] or "undated"))
+        return ".".join(parts)
+    
+    def shard(self, name: str) -> VectorSidecar:
+        if name not in self._shards:
+            self._shards[name] = VectorSidecar(self.storage_path, self.dim, self.quantizer, name)
+        return self._shards[name]
+    
+    def names(self, cursor) -> List[str]:
+        cursor.execute("SELECT name FROM shards ORDER BY name")
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _chunk_counts(self, cursor) -> Dict[str, int]:
+        cursor.execute("SELECT shard, COUNT(*) FROM chunks GROUP BY shard")
+        return dict(cursor.fetchall())
+    
+    def counts(self, cursor) -> Tuple[int, int]:
+        """Committed (rows, live rows) over all shards"""
+        totals = [self.shard(name).counts(cursor) for name in self.names(cursor)]
+        return sum(rows for rows, _ in totals), sum(live for _, live in totals)
+    
+    def _register(self, cursor, name: str, content_type: Optional[str],
+                  first: Optional[str], last: Optional[str]) -> None:
+        """Add a shard to the shards table, or widen its created_at range"""
         cursor.execute('''
-            INSERT OR REPLACE INTO chunks
-            (id, text, embedding_vector, metadata, created_at, token_count, content_type, source_file)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            chunk_id,
-            text,
-            json.dumps(embedding),
-            json.dumps(metadata),
-            metadata["created_at"],
-            token_count,
-            metadata.get("content_type", "general"),
-            metadata.get("source_file", "")
-        ))
+            INSERT INTO shards (name, content_type, first_created, last_created) VALUES (?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                first_created = COALESCE(min(first_created, excluded.first_created),
+                                         first_created, excluded.first_created),
+                last_created = COALESCE(max(last_created, excluded.last_created),
+                                        last_created, excluded.last_created)
+        ''', (name, content_type if "content_type" in self._parts else None, first, last))
+    
+    def _register_stored(self, cursor, name: str) -> None:
+        """_register() a shard from the chunks already routed to it"""
+        cursor.execute("SELECT MIN(content_type), MIN(created_at), MAX(created_at) FROM chunks WHERE shard = ?",
+                       (name,))
+        self._register(cursor, name, *cursor.fetchone())
+    
+    def needs_repair(self, cursor) -> bool:
+        """Check shard_by and every shard against the chunks table"""
+        if RAGMemory._get_meta(cursor, "shard_by", "none") != self.shard_by:
+            return True
+        counts = self._chunk_counts(cursor)
+        names = self.names(cursor)
+        return (not set(counts) <= set(names)
+                or any(self.shard(name).needs_repair(cursor, counts.get(name, 0)) for name in names))
+    
+    def repair(self, cursor) -> None:
+        """Re-route every chunk if shard_by changed, else repair shards one by one
         
-        conn.commit()
-        conn.close()
+        Must be called inside a write transaction.
+        """
+        if RAGMemory._get_meta(cursor, "shard_by", "none") != self.shard_by:
+            self.rebuild(cursor)
+            return
         
-        return chunk_id
+        counts = self._chunk_counts(cursor)
+        for name in sorted(set(counts) | set(self.names(cursor))):
+            self._register_stored(cursor, name)
+            shard = self.shard(name)
+            if shard.needs_repair(cursor, counts.get(name, 0)):
+                self._thaw(cursor, name)
+                shard.repair(cursor, counts.get(name, 0))
     
-    def add_text(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> List[str]:
-        """Add text, automatically chunking if needed"""
-        if metadata is None:
-            metadata = {}
+    def rebuild(self, cursor) -> int:
+        """Route every chunk to its shard and rewrite all shards, dropping tombstones"""
+        cursor.execute("SELECT name FROM shards WHERE frozen = 1")
+        frozen = {row[0] for row in cursor.fetchall()}
         
-        chunk_size = self.config["chunk_size"]
-        overlap = self.config["chunk_overlap"]
+        reader = cursor.connection.cursor()
+        reader.execute("SELECT rowid, shard, content_type, created_at FROM chunks")
+        moves = []
+        while True:
+            batch = reader.fetchmany(MIGRATION_BATCH_SIZE)
+            if not batch:
+                break
+            for rowid, shard, content_type, created_at in batch:
+                name = self.key(content_type, created_at)
+                if name != shard:
+                    moves.append((name, rowid))
+        cursor.executemany("UPDATE chunks SET shard = ? WHERE rowid = ?", moves)
         
-        # Estimate tokens and decide if chunking needed
-        token_count = self._estimate_token_count(text)
+        cursor.execute("DELETE FROM shards")
+        cursor.execute("DELETE FROM store_meta WHERE key GLOB 'sidecar_rows*' OR key GLOB 'sidecar_live*'")
+        names = sorted(self._chunk_counts(cursor))
+        rows = 0
+        for name in names:
+            self._register_stored(cursor, name)
+            rows += self.shard(name).rebuild(cursor)
+        self._remove_stale(names)
         
-        if token_count <= chunk_size:
-            chunk_id = self.add_chunk(text, metadata)
-            return [chunk_id]
+        for name in frozen.intersection(names):
+            self._freeze_compacted(cursor, name)
+        RAGMemory._set_meta(cursor, "shard_by", self.shard_by)
+        return rows
+    
+    def _remove_stale(self, names: Iterable[str]) -> None:
+        """Delete the files of shards other than names"""
+        keep = set(names)
+        if "" not in keep:
+            root = self.shard("")
+            for name, _ in VectorSidecar.FORMATS.values():
+                root.vectors_path.with_name(name).unlink(missing_ok=True)
+            root.ids_path.unlink(missing_ok=True)
+        shards_dir = self.storage_path / "shards"
+        if shards_dir.is_dir():
+            for path in shards_dir.iterdir():
+                if path.name not in keep:
+                    shutil.rmtree(path)
+    
+    def append(self, cursor, rows: List[Tuple[str, str, str, bytes]]) -> List[Tuple[str, int]]:
+        """Append (chunk_id, content_type, created_at, float32 blob) rows to
+        their shards; returns the (shard, row number) of each"""
+        groups: Dict[str, List[int]] = {}
+        for i, (_, content_type, created_at, _) in enumerate(rows):
+            groups.setdefault(self.key(content_type, created_at), []).append(i)
         
-        # Chunk the text
-        chunks = self._chunk_text(text, chunk_size, overlap, metadata)
-        chunk_ids = []
+        refs: List[Tuple[str, int]] = [("", 0)] * len(rows)
+        for name, members in groups.items():
+            created = [rows[i][2] for i in members]
+            self._register(cursor, name, rows[members[0]][1], min(created), max(created))
+            self._thaw(cursor, name)
+            numbers = self.shard(name).append(cursor, [(rows[i][0], rows[i][3]) for i in members])
+            for i, number in zip(members, numbers):
+                refs[i] = (name, number)
+        return refs
+    
+    @staticmethod
+    def _group(refs: Iterable[Tuple[str, int]]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for name, row in refs:
+            groups.setdefault(name, []).append(row)
+        return groups
+    
+    def tombstone(self, cursor, refs: List[Tuple[str, int]]) -> None:
+        """Count (shard, row) pairs as deleted; call erase() once the transaction commits"""
+        for name, rows in self._group(refs).items():
+            self._thaw(cursor, name)
+            self.shard(name).tombstone(cursor, rows)
+    
+    def erase(self, refs: List[Tuple[str, int]]) -> None:
+        for name, rows in self._group(refs).items():
+            self.shard(name).erase(rows)
+    
+    def clear(self, cursor) -> None:
+        cursor.execute("DELETE FROM shards")
+        cursor.execute("DELETE FROM store_meta WHERE key GLOB 'sidecar_rows*' OR key GLOB 'sidecar_live*'")
+        self._remove_stale([])
+    
+    def _thaw(self, cursor, name: str) -> None:
+        cursor.execute("UPDATE shards SET frozen = 0 WHERE name = ? AND frozen = 1", (name,))
+        if cursor.rowcount:
+            self.shard(name).set_read_only(False)
+    
+    def thaw(self, cursor, name: str) -> None:
+        """Make a frozen shard writable again"""
+        self._thaw(cursor, name)
+    
+    def freeze(self, cursor, name: str) -> None:
+        """Compact a shard, record its exact created_at range and make it read-only"""
+        shard = self.shard(name)
+        rows, live = shard.counts(cursor)
+        if rows != live:
+            self._thaw(cursor, name)
+            shard.rebuild(cursor)
+        self._freeze_compacted(cursor, name)
+    
+    def _freeze_compacted(self, cursor, name: str) -> None:
+        self._narrow(cursor, name)
+        cursor.execute("UPDATE shards SET frozen = 1 WHERE name = ?", (name,))
+        self.shard(name).set_read_only(True)
+    
+    def _narrow(self, cursor, name: str) -> None:
+        """Set a shard's recorded created_at range to that of its chunks"""
+        cursor.execute('''
+            UPDATE shards SET
+                first_created = (SELECT MIN(created_at) FROM chunks WHERE shard = ?),
+                last_created = (SELECT MAX(created_at) FROM chunks WHERE shard = ?)
+            WHERE name = ?
+        ''', (name, name, name))
+    
+    def compact(self, cursor, name: str) -> int:
+        """Rewrite a shard without its tombstones, or drop it once no chunk is left in it
+        
+        Also narrows the shard's created_at range to the chunks still in it,
+        so that searches prune it again. Returns the rows dropped.
+        """
+        shard = self.shard(name)
+        rows, live = shard.counts(cursor)
+        if name and not live:
+            cursor.execute("DELETE FROM shards WHERE name = ?", (name,))
+            cursor.execute("DELETE FROM store_meta WHERE key IN (?, ?)", (shard._rows_key, shard._live_key))
+            shutil.rmtree(shard.directory, ignore_errors=True)
+            return rows
+        self._thaw(cursor, name)
+        shard.rebuild(cursor)
+        self._narrow(cursor, name)
+        return rows - live
+    
+    def tombstone_bytes(self, cursor) -> int:
+        """Disk space held by tombstoned rows, freed by compact()"""
+        rows, live = self.counts(cursor)
+        return (rows - live) * (self.row_bytes + VectorSidecar.ID_SIZE)
+    
+    def report(self, cursor) -> List[Dict[str, Any]]:
+        """One entry per shard: content type, created_at range, rows, frozen, size"""
+        cursor.execute("SELECT name, content_type, first_created, last_created, frozen FROM shards ORDER BY name")
+        shards = []
+        for name, content_type, first, last, frozen in cursor.fetchall():
+            shard = self.shard(name)
+            rows, live = shard.counts(cursor)
+            shards.append({
+                "name": name,
+                "content_type": content_type,
+                "first_created": first,
+                "last_created": last,
+                "rows": rows,
+                "live": live,
+                "frozen": bool(frozen),
+                "size_bytes": sum(p.stat().st_size for p in (shard.vectors_path, shard.ids_path) if p.exists())
+            })
+        return shards
+    
+    def plan(self, cursor, content_type: Optional[str],
+             filters: Optional[Dict[str, Any]] = None) -> Tuple[List[Tuple[VectorSidecar, int, bool]], bool]:
+        """Shards a search has to scan, as (shard, committed rows, frozen)
         
-        for chunk_text, chunk_meta in chunks:
-            chunk_id = self.add_chunk(chunk_text, chunk_meta)
-            chunk_ids.append(chunk_id)
+        Shards of another content type or whose created_at range misses the
+        since/until filters are pruned. The flag tells whether every row of
+        the shards left matches content_type and since/until, so that no
+        per-row check is needed.
+        """
+        filters = filters or {}
+        conditions = []
+        params: List[Any] = []
+        covered = []
+        covered_params: List[Any] = []
+        if content_type:
+            conditions.append("(content_type IS NULL OR content_type = ?)")
+            params.append(content_type)
+            covered.append("content_type = ?")
+            covered_params.append(content_type)
+        for name, upper in (("since", False), ("until", True)):
+            if filters.get(name):
+                op, bound = RAGMemory._time_bound(filters[name], upper)
+                # Pruned when the range lies outside the bound, covered when it lies within
+                near, far = ("first_created", "last_created") if upper else ("last_created", "first_created")
+                conditions.append(f"{near} {op} ?")
+                params.append(bound)
+                covered.append(f"{far} {op} ?")
+                covered_params.append(bound)
         
-        return chunk_ids
+        cursor.execute(f"SELECT name, frozen, {' AND '.join(covered) or '1'} FROM shards "
+                       f"WHERE {' AND '.join(conditions) or '1'} ORDER BY name", covered_params + params)
+        selected = cursor.fetchall()
+        cursor.execute("SELECT key, value FROM store_meta WHERE key GLOB 'sidecar_rows*'")
+        rows = dict(cursor.fetchall())
+        plan = [(self.shard(name), int(rows.get(self.shard(name)._rows_key) or 0), bool(frozen))
+                for name, frozen, _ in selected]
+        return [entry for entry in plan if entry[1]], all(whole for _, _, whole in selected)
     
-    def add_file(self, file_path: str) -> List[str]:
-        """Add file contents to the vector store"""
-        path = Path(file_path)
+    def scan_many(self, plan: List[Tuple[VectorSidecar, int, bool]], queries: Sequence[Any], top_k: int,
+                  threshold: float, allowed_ids: Optional[List[str]] = None,
+                  block_rows: int = 65536) -> List[List[Tuple[str, float]]]:
+        """Scan the planned shards, in parallel when there are several, and
+        merge their best-first hits into one top_k list per query"""
+        def scan(entry):
+            shard, rows, frozen = entry
+            return shard.scan_many(rows, queries, top_k, threshold, allowed_ids, block_rows, compacted=frozen)
         
-        if not path.exists():
-            raise FileNotFoundError(f"File not found: {file_path}")
+        if len(plan) > 1 and self.workers > 1:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rag-memory-shard")
+            results = list(self._pool.map(scan, plan))
+        else:
+            results = [scan(entry) for entry in plan]
         
-        # Read file content
-        if path.suffix == '.json':
-            with open(path, 'r') as f:
-                content = json.dumps(json.load(f), indent=2)
+        return [list(itertools.islice(heapq.merge(*(hits[q] for hits in results), key=lambda hit: -hit[1]), top_k))
+                for q in range(len(queries))]
+
+class LSHIndex:
+    """Multi-table random-hyperplane LSH over the stored embeddings
+    
+    Each table hashes a vector to `bits` sign bits of random projections.
+    Bucket membership is persisted in the ann_buckets table; the hyperplanes
+    are regenerated from the seed recorded in store_meta, using Python's
+    random module so NumPy and pure-Python installs agree.
+    """
+    
+    def __init__(self, dim: int, tables: int, bits: int, seed: int):
+        self.dim = dim
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+        
+        rng = random.Random(seed)
+        planes = [[rng.gauss(0.0, 1.0) for _ in range(dim)] for _ in range(tables * bits)]
+        if HAS_NUMPY:
+            self.planes = np.asarray(planes, dtype=np.float32)
+            self._weights = 1 << np.arange(bits, dtype=np.int64)
         else:
-            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+            self.planes = planes
+    
+    def _project(self, vector) -> List[float]:
+        if HAS_NUMPY:
+            return (self.planes @ np.asarray(vector, dtype=np.float32)).tolist()
+        return [sum(p * v for p, v in zip(plane, vector)) for plane in self.planes]
+    
+    def keys(self, vector) -> List[int]:
+        """Bucket key of a vector in every table"""
+        proj = self._project(vector)
+        keys = []
+        for t in range(self.tables):
+            key = 0
+            for b, value in enumerate(proj[t * self.bits:(t + 1) * self.bits]):
+                if value > 0:
+                    key |= 1 << b
+            keys.append(key)
+        return keys
+    
+    def keys_many(self, vectors: List[Any]) -> List[List[int]]:
+        """Bucket keys for a batch of vectors"""
+        if not HAS_NUMPY or not vectors:
+            return [self.keys(vector) for vector in vectors]
         
-        # Determine content type
-        content_type = "general"
-        if path.suffix in ['.md']:
-            content_type = "markdown"
-        elif path.suffix in ['.py', '.js', '.ts', '.sh', '.bash']:
-            content_type = "code"
-        elif path.suffix == '.json':
-            content_type = "json"
+        proj = np.asarray(vectors, dtype=np.float32) @ self.planes.T
+        bits = (proj > 0).reshape(len(vectors), self.tables, self.bits)
+        return (bits.astype(np.int64) @ self._weights).tolist()
+    
+    def probe(self, vector, probes: int, tables: Optional[int] = None) -> List[Tuple[int, List[int]]]:
+        """Per-table bucket keys to visit: the home bucket plus up to `probes`
+        neighbours, flipping the bits whose hyperplanes are closest to the query
+        """
+        proj = self._project(vector)
+        result = []
+        for t in range(min(tables or self.tables, self.tables)):
+            values = proj[t * self.bits:(t + 1) * self.bits]
+            key = sum(1 << b for b, value in enumerate(values) if value > 0)
+            nearest = sorted(range(self.bits), key=lambda b: abs(values[b]))[:probes]
+            result.append((t, [key] + [key ^ (1 << b) for b in nearest]))
+        return result
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+def _retry_busy(operation: Callable[[], Any], retries: int = BUSY_RETRIES) -> Any:
+    """Run operation, retrying with jittered backoff while SQLite reports the database busy"""
+    for attempt in range(retries):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if attempt == retries - 1 or not _is_busy(e):
+                raise
+            time.sleep(BUSY_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+class ConnectionPool:
+    """Per-thread read connections and a serialized writer for vectors.db
+    
+    The database runs in WAL mode, so readers never block on a writer or
+    the other way round. Each thread reuses one query_only connection, and
+    snapshot() holds a read transaction on it so that every query made
+    inside sees the same committed state. Writers in this process queue on
+    one lock per database file instead of contending for SQLite's; writers
+    in other processes are waited out by busy_timeout, then retried.
+    """
+    
+    _write_locks: Dict[str, threading.RLock] = {}
+    _locks_guard = threading.Lock()
+    
+    def __init__(self, db_path: Path, busy_timeout_ms: int):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        with self._locks_guard:
+            self.write_lock = self._write_locks.setdefault(os.path.realpath(db_path), threading.RLock())
+    
+    def connect(self, write: bool = False) -> sqlite3.Connection:
+        """A new connection; a writing one opens its transactions with BEGIN IMMEDIATE
+        
+        Taking the write lock up front means a transaction that reads before
+        it writes cannot find its snapshot stale when it first writes.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000,
+                               isolation_level="IMMEDIATE" if write else "")
+        return conn
+    
+    def reader(self) -> sqlite3.Connection:
+        """This thread's read connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+    
+    @contextmanager
+    def snapshot(self):
+        """Yield a cursor on this thread's reader inside one read transaction
+        
+        Nested snapshots share the outermost transaction.
+        """
+        conn = self.reader()
+        if self._local.depth == 0:
+            conn.execute("BEGIN")
+        self._local.depth += 1
+        try:
+            yield conn.cursor()
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.commit()
+    
+    @staticmethod
+    def begin(conn: sqlite3.Connection) -> None:
+        """Open a write transaction on conn now unless one is open"""
+        if not conn.in_transaction:
+            _retry_busy(lambda: conn.execute("BEGIN IMMEDIATE"))
+    
+    @contextmanager
+    def writer(self):
+        """Yield a connection holding the write lock, committing on success"""
+        with self.write_lock:
+            conn = self.connect(write=True)
+            try:
+                self.begin(conn)
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+    
+    @contextmanager
+    def maintenance(self):
+        """Yield an autocommit connection holding the write lock
+        
+        For statements that manage their own transaction: VACUUM,
+        incremental_vacuum and WAL checkpoints.
+        """
+        with self.write_lock:
+            conn = self.connect(write=True)
+            conn.isolation_level = None
+            try:
+                yield conn
+            finally:
+                conn.close()
+    
+    def close(self) -> None:
+        """Close this thread's read connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class QueryCache:
+    """Bounded LRU of search results, valid for a single store generation
+    
+    Results are kept JSON-encoded so every hit hands out a fresh copy. With
+    persist, entries also live in the query_cache table, letting separate CLI
+    processes share them; hit/miss counters are then kept in store_meta.
+    Lookups only read the table. Hit times and counts are held in memory
+    and written along with the next stored entry, and that write is skipped
+    while another connection holds the write lock, so a search never waits
+    on a writer. The in-memory entries are shared by all threads under one
+    lock.
+    """
+    
+    def __init__(self, pool: ConnectionPool, size: int, persist: bool = False):
+        self.pool = pool
+        self.size = size
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._generation: Optional[int] = None
+        self._used: Dict[str, float] = {}  # Persisted entries hit since the last flush -> when
+        self._unflushed = [0, 0]  # Hits and misses not yet added to store_meta
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(query: str, top_k: int, threshold: float, content_type: Optional[str],
+            mode: str, probes: Optional[int], filters: Optional[Dict[str, Any]] = None,
+            collapse: bool = False) -> str:
+        # Embeddings lowercase and split the text, so this normalization is exact
+        return json.dumps([' '.join(query.lower().split()), top_k, threshold, content_type, mode, probes,
+                           filters or {}, collapse], sort_keys=True)
+    
+    def _sync(self, generation: int) -> bool:
+        """Drop entries of an older generation; False when generation is the older one
+        
+        A thread that read the generation before another thread's write must
+        neither serve nor evict entries of the newer one.
+        """
+        if self._generation is not None and generation < self._generation:
+            return False
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+        return True
+    
+    def _remember(self, key: str, blob: str) -> None:
+        self._entries[key] = blob
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+    
+    def get(self, generation: int, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            blob = self._entries.get(key) if self._sync(generation) else None
+            if blob is not None:
+                self._entries.move_to_end(key)
+        
+        if blob is None and self.persist:
+            cursor = self.pool.reader().cursor()
+            cursor.execute("SELECT results FROM query_cache WHERE key = ? AND generation = ?",
+                           (key, generation))
+            row = cursor.fetchone()
+            if row:
+                blob = row[0]
+                with self._lock:
+                    if self._sync(generation):
+                        self._remember(key, blob)
+        
+        with self._lock:
+            if self.persist:
+                self._unflushed[blob is None] += 1
+                if blob is not None:
+                    self._used[key] = time.time()
+            if blob is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(blob)
+    
+    def put(self, generation: int, key: str, results: List[Dict[str, Any]]) -> None:
+        blob = json.dumps(results)
+        with self._lock:
+            if self._sync(generation):
+                self._remember(key, blob)
+        
+        if self.persist:
+            self.flush((key, generation, blob))
+    
+    def flush(self, entry: Optional[Tuple[str, int, str]] = None) -> bool:
+        """Write pending hit times and counts, plus a (key, generation, results) entry
+        
+        Gives up at once if another connection holds the write lock: the
+        entry is dropped and the rest stays pending for the next flush.
+        Returns whether the write happened.
+        """
+        with self._lock:
+            used, self._used = self._used, {}
+            hits, misses = self._unflushed
+            self._unflushed = [0, 0]
+        if not self.persist or not (entry or used or hits or misses):
+            return True
+        
+        conn = self.pool.connect(write=True)
+        try:
+            conn.execute("PRAGMA busy_timeout=0")
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            if entry is not None:
+                key, generation, blob = entry
+                cursor.execute("DELETE FROM query_cache WHERE generation != ?", (generation,))
+                cursor.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, generation, results, used_at) VALUES (?, ?, ?, ?)",
+                    (key, generation, blob, time.time())
+                )
+            cursor.executemany("UPDATE query_cache SET used_at = max(used_at, ?) WHERE key = ?",
+                               [(used_at, key) for key, used_at in used.items()])
+            cursor.execute('''
+                DELETE FROM query_cache WHERE key NOT IN
+                (SELECT key FROM query_cache ORDER BY used_at DESC LIMIT ?)
+            ''', (self.size,))
+            for meta, value in (("query_cache_hits", hits), ("query_cache_misses", misses)):
+                if value:
+                    cursor.execute(
+                        "INSERT INTO store_meta (key, value) VALUES (?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+                        (meta, value)
+                    )
+            conn.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            conn.rollback()
+            with self._lock:
+                for key, used_at in used.items():
+                    self._used[key] = max(used_at, self._used.get(key, 0.0))
+                self._unflushed[0] += hits
+                self._unflushed[1] += misses
+            return False
+        finally:
+            conn.close()
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self, cursor) -> Dict[str, Any]:
+        if not self.persist:
+            return {"entries": len(self._entries), "capacity": self.size,
+                    "hits": self.hits, "misses": self.misses, "persistent": False}
+        
+        cursor.execute("SELECT COUNT(*) FROM query_cache")
+        entries = cursor.fetchone()[0]
+        with self._lock:
+            hits, misses = self._unflushed
+        return {
+            "entries": entries,
+            "capacity": self.size,
+            "hits": int(RAGMemory._get_meta(cursor, "query_cache_hits", "0")) + hits,
+            "misses": int(RAGMemory._get_meta(cursor, "query_cache_misses", "0")) + misses,
+            "persistent": True
+        }
+
+class Metrics:
+    """Low-overhead stage timers and counters for the hot paths
+    
+    stage() times a named block and count() bumps a named counter. Both feed
+    the breakdown of the command started by begin() (what --profile prints)
+    and pending totals that flush() merges into metrics.json next to the
+    store, so aggregates outlive short-lived CLI processes. The file also
+    keeps the last METRICS_WINDOW durations of each command for quantiles.
+    Updates from concurrent threads are serialized by one lock.
+    """
+    
+    def __init__(self, path: Optional[Path], enabled: bool = True):
+        self.path = path
+        self.enabled = enabled and path is not None
+        self.command: Optional[str] = None
+        self.stages: Dict[str, List[float]] = {}  # stage -> [calls, seconds] for the current command
+        self.counters: Dict[str, int] = {}
+        self._started = time.perf_counter()
+        self._pending = self._empty()
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {"stages": {}, "counters": {}, "commands": {}}
+    
+    @contextmanager
+    def stage(self, name: str):
+        # Outside a command, a disabled instance records nothing
+        if not (self.enabled or self.command):
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                for stages in (self.stages, self._pending["stages"]) if self.enabled else (self.stages,):
+                    entry = stages.setdefault(name, [0, 0.0])
+                    entry[0] += 1
+                    entry[1] += elapsed
+    
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if self.enabled:
+                pending = self._pending["counters"]
+                pending[name] = pending.get(name, 0) + value
+    
+    def begin(self, command: str) -> None:
+        """Start a command; its stages and counters start from zero"""
+        with self._lock:
+            self.command = command
+            self.stages = {}
+            self.counters = {}
+            self._started = time.perf_counter()
+    
+    def end(self) -> Dict[str, Any]:
+        """Finish the current command and return its breakdown"""
+        with self._lock:
+            command, self.command = self.command, None
+            elapsed = time.perf_counter() - self._started
+            profile = {
+                "command": command,
+                "seconds": elapsed,
+                "stages": {name: {"calls": calls, "seconds": seconds}
+                           for name, (calls, seconds) in self.stages.items()},
+                "counters": dict(self.counters)
+            }
+            if self.enabled and command:
+                self._pending["commands"].setdefault(command, []).append(elapsed)
+        if self.enabled and command and time.monotonic() - self._flushed_at >= METRICS_FLUSH_SECONDS:
+            self.flush()
+        return profile
+    
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            try:
+                import fcntl
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            except ImportError:
+                pass
+            yield f
+    
+    @staticmethod
+    def _parse(text: str) -> Dict[str, Any]:
+        try:
+            saved = json.loads(text) if text.strip() else {}
+        except ValueError:
+            saved = {}
+        for section in ("stages", "counters", "commands"):
+            saved.setdefault(section, {})
+        return saved
+    
+    @staticmethod
+    def _merge(saved: Dict[str, Any], pending: Dict[str, Any]) -> Dict[str, Any]:
+        merged = json.loads(json.dumps(saved))
+        now = datetime.now().isoformat()
+        merged.setdefault("since", now)
+        merged["updated_at"] = now
+        for name, (calls, seconds) in pending["stages"].items():
+            entry = merged["stages"].setdefault(name, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+        for name, value in pending["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+        for name, durations in pending["commands"].items():
+            entry = merged["commands"].setdefault(name, {"count": 0, "seconds": 0.0, "recent": []})
+            entry["count"] += len(durations)
+            entry["seconds"] += sum(durations)
+            entry["recent"] = (entry["recent"] + [round(d * 1000, 3) for d in durations])[-METRICS_WINDOW:]
+        return merged
+    
+    def flush(self) -> None:
+        """Merge pending totals into metrics.json"""
+        with self._lock:
+            self._flushed_at = time.monotonic()
+            pending, self._pending = self._pending, self._empty()
+        if not self.enabled or not any(pending.values()):
+            return
+        with self._locked(exclusive=True) as f:
+            merged = self._merge(self._parse(f.read()), pending)
+            f.seek(0)
+            f.truncate()
+            json.dump(merged, f)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Rolling aggregates: saved totals plus anything not yet flushed"""
+        if not self.enabled:
+            return {}
+        saved = self._empty()
+        if self.path.exists():
+            with self._locked(exclusive=False) as f:
+                saved = self._parse(f.read())
+        with self._lock:
+            merged = self._merge(saved, self._pending)
+        
+        return {
+            "since": merged["since"],
+            "updated_at": merged["updated_at"],
+            "stages": {name: {"calls": entry["calls"], "seconds": round(entry["seconds"], 6),
+                              "avg_ms": round(entry["seconds"] * 1000 / max(1, entry["calls"]), 3)}
+                       for name, entry in sorted(merged["stages"].items())},
+            "counters": dict(sorted(merged["counters"].items())),
+            "commands": {name: dict({"count": entry["count"], "seconds": round(entry["seconds"], 6)},
+                                    **{f"{p}_ms": v for p, v in _percentiles(entry["recent"]).items()})
+                         for name, entry in sorted(merged["commands"].items())}
+        }
+    
+    def reset(self) -> None:
+        with self._lock:
+            self._pending = self._empty()
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
+    
+    @staticmethod
+    def prometheus(snapshot: Dict[str, Any]) -> str:
+        """Render a snapshot in the Prometheus text exposition format"""
+        lines = []
+        
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP rag_memory_{name} {help_text}")
+            lines.append(f"# TYPE rag_memory_{name} {kind}")
+        
+        family("stage_seconds_total", "counter", "Time spent in each hot-path stage")
+        for name, entry in snapshot.get("stages", {}).items():
+            lines.append(f'rag_memory_stage_seconds_total{{stage="{name}"}} {entry["seconds"]}')
+        family("stage_calls_total", "counter", "Times each hot-path stage ran")
+        for name, entry in snapshot.get("stages", {}).items():
+            lines.append(f'rag_memory_stage_calls_total{{stage="{name}"}} {entry["calls"]}')
+        for name, value in snapshot.get("counters", {}).items():
+            family(f"{name}_total", "counter", name.replace('_', ' ').capitalize())
+            lines.append(f"rag_memory_{name}_total {value}")
+        family("command_seconds", "summary", f"Command latency over the last {METRICS_WINDOW} calls")
+        for name, entry in snapshot.get("commands", {}).items():
+            for p, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                lines.append(f'rag_memory_command_seconds{{command="{name}",quantile="{quantile}"}} '
+                             f'{entry[p + "_ms"] / 1000}')
+            lines.append(f'rag_memory_command_seconds_sum{{command="{name}"}} {entry["seconds"]}')
+            lines.append(f'rag_memory_command_seconds_count{{command="{name}"}} {entry["count"]}')
+        return '\n'.join(lines) + '\n'
+
+class DocumentBuffer:
+    """Text of one document, appended chunk by chunk and compressed in blocks
+    
+    Chunks of a chunked text are its words joined by single spaces, and
+    consecutive chunks share chunk_overlap words. A chunk that starts with the
+    trailing words of the previous one only appends its new words, so the
+    overlap is stored once and every chunk is a (start, end) UTF-8 byte span
+    of the document. Anything else is appended whole after a space.
+    
+    Full blocks of DOCUMENT_BLOCK_BYTES are compressed once; the partial last
+    block is rewritten whenever the writer flushes, so committed spans always
+    point at stored bytes.
+    """
+    
+    def __init__(self, doc_id: int):
+        self.doc_id = doc_id
+        self.length = 0
+        self._buffer = bytearray()
+        self._block = 0  # number of the block being filled
+        self._full: List[Tuple[int, int, bytes]] = []
+        self._previous: Optional[Tuple[str, int]] = None  # last chunk's text and end word
+    
+    def append(self, text: str, start_word: Optional[int] = None,
+               end_word: Optional[int] = None) -> Tuple[int, int]:
+        """Add a chunk's text; returns its (start, end) byte span"""
+        tail = None
+        if self._previous is not None and start_word is not None:
+            previous, previous_end = self._previous
+            shared = previous_end - start_word
+            if shared > 0:
+                cut = -1
+                for _ in range(shared):
+                    cut = text.find(' ', cut + 1)
+                    if cut < 0:
+                        break
+                prefix = text if cut < 0 else text[:cut]
+                if previous.endswith(prefix) and (len(previous) == len(prefix)
+                                                  or previous[-len(prefix) - 1] == ' '):
+                    tail = '' if cut < 0 else text[cut:]
+                    start = self.length - len(prefix.encode())
+        
+        if tail is None:
+            if self.length:
+                self._write(b' ')
+            start = self.length
+            tail = text
+        
+        self._write(tail.encode())
+        self._previous = (text, end_word) if end_word is not None else None
+        return start, self.length
+    
+    def _write(self, data: bytes) -> None:
+        self._buffer += data
+        self.length += len(data)
+        while len(self._buffer) >= DOCUMENT_BLOCK_BYTES:
+            self._full.append((self.doc_id, self._block, zlib.compress(bytes(self._buffer[:DOCUMENT_BLOCK_BYTES]))))
+            del self._buffer[:DOCUMENT_BLOCK_BYTES]
+            self._block += 1
+    
+    def take_blocks(self) -> List[Tuple[int, int, bytes]]:
+        """(doc_id, block, body) rows not yet stored, including the partial block"""
+        blocks, self._full = self._full, []
+        if self._buffer:
+            blocks.append((self.doc_id, self._block, zlib.compress(bytes(self._buffer))))
+        return blocks
+
+class ChunkWriter:
+    """Batched chunk writer over a single ingest connection
+    
+    Chunks are buffered and written with executemany, committing every
+    batch_size chunks. Derived structures (vector sidecar, LSH buckets,
+    postings) are updated in the same transaction, and the resident index
+    and sidecar tombstones are patched after each commit.
+    
+    Chunk text is stored as a span of a compressed document: chunks added
+    inside document() share one, and any other chunk gets its own.
+    """
+    
+    def __init__(self, rag: "RAGMemory", batch_size: int):
+        self.rag = rag
+        self.batch_size = max(1, batch_size)
+        self.conn = rag._connections.connect(write=True)
+        for pragma in INGEST_PRAGMAS:
+            self.conn.execute(pragma)
+        self.cursor = self.conn.cursor()
+        self.pending: List[Tuple[str, str, Any, Dict[str, Any], Tuple[int, int, int]]] = []
+        self._document: Optional[DocumentBuffer] = None
+        self.uncommitted = 0
+        self.generation: Optional[int] = None
+        self._indexed: List[Tuple[str, str, Any]] = []
+        self._deleted: Tuple[List[str], List[Tuple[str, int]]] = ([], [])
+        self._simhashes: Dict[str, int] = {}
+        self._simhash_pending: Dict[Tuple[int, int], List[Tuple[str, int]]] = {}
+        self._simhash_bands: Optional[int] = None
+        self._near_duplicates = [0, 0]  # chunks dropped, bytes not written
+    
+    def add(self, text: str, metadata: Optional[Dict[str, Any]], embedding) -> str:
+        """Buffer one chunk with a precomputed embedding; returns its id
+        
+        With dedup_mode skip or merge, a chunk that is a near-duplicate of a
+        stored or buffered one is dropped and the kept chunk's id returned.
+        """
+        if metadata is None:
+            metadata = {}
+        
+        # Generate unique ID
+        chunk_id = hashlib.sha256(text.encode()).hexdigest()[:16]
+        
+        # Set metadata defaults
+        metadata.setdefault("content_type", "general")
+        metadata.setdefault("created_at", datetime.now().isoformat())
+        
+        # Open documents take every chunk so that later chunks can share its words
+        span = None
+        if self._document is not None:
+            span = (self._document.doc_id,) + self._document.append(
+                text, metadata.get("start_position"), metadata.get("end_position"))
+        
+        if self.rag.config["dedup_mode"] != "off":
+            kept_id = self._near_duplicate(chunk_id, text, metadata)
+            if kept_id is not None:
+                return kept_id
+        
+        if span is None:
+            document = self._new_document(metadata.get("source_file", ""))
+            span = (document.doc_id,) + document.append(text)
+            self._store_document(document)
+        
+        self.pending.append((chunk_id, text, embedding, metadata, span))
+        if self.uncommitted + len(self.pending) >= self.batch_size:
+            self.commit()
+        
+        return chunk_id
+    
+    def _near_duplicate(self, chunk_id: str, text: str, metadata: Dict[str, Any]) -> Optional[str]:
+        """Id of the chunk this one duplicates, or None to store it"""
+        rag = self.rag
+        cursor = self.cursor
+        if self._simhash_bands is None:
+            if rag._get_meta(cursor, "simhash_built") != "1":
+                rag._build_simhash(cursor)
+            self._simhash_bands = rag._simhash_band_count(cursor)
+        
+        # Re-adding a stored chunk is an ordinary update
+        cursor.execute("SELECT 1 FROM chunks WHERE id = ?", (chunk_id,))
+        if cursor.fetchone() or any(item[0] == chunk_id for item in self.pending):
+            return None
+        
+        value = rag._simhash(text)
+        match = rag._near_duplicate_of(cursor, value, self._simhash_bands, chunk_id, self._simhash_pending)
+        if match is None:
+            self._simhashes[chunk_id] = value
+            for key in _simhash_bands(value, self._simhash_bands):
+                self._simhash_pending.setdefault(key, []).append((chunk_id, value))
+            return None
+        
+        kept_id, similarity = match
+        if rag.config["dedup_mode"] == "merge":
+            self._record_duplicate(kept_id, metadata, similarity)
+        self._near_duplicates[0] += 1
+        self._near_duplicates[1] += rag._chunk_footprint(metadata)
+        rag.ingest_report["near_duplicates"] += 1
+        rag.metrics.count("near_duplicates")
+        return kept_id
+    
+    @contextmanager
+    def document(self, source_file: str = ""):
+        """Store the chunks added inside as spans of one compressed document
+        
+        Chunks are expected in source order, each carrying the
+        start_position/end_position word range _iter_chunks() gives it.
+        """
+        if self._document is not None:
+            yield
+            return
+        
+        document = self._new_document(source_file)
+        self._document = document
+        try:
+            yield
+        finally:
+            self._document = None
+        
+        if not any(item[4][0] == document.doc_id for item in self.pending):
+            # Written chunks point into it, or all were dropped as near-duplicates
+            self.rag._drop_orphan_documents(self.cursor, [document.doc_id])
+            self.cursor.execute("SELECT 1 FROM documents WHERE id = ?", (document.doc_id,))
+            if self.cursor.fetchone() is None:
+                return
+        self._store_document(document)
+    
+    def _new_document(self, source_file: str) -> DocumentBuffer:
+        self.cursor.execute(
+            "INSERT INTO documents (source_file, length, created_at) VALUES (?, 0, ?)",
+            (source_file, datetime.now().isoformat())
+        )
+        return DocumentBuffer(self.cursor.lastrowid)
+    
+    def _store_document(self, document: DocumentBuffer) -> None:
+        """Write a finished document's remaining blocks and final length"""
+        if not document.length:
+            self.cursor.execute("DELETE FROM documents WHERE id = ?", (document.doc_id,))
+            return
+        self.cursor.executemany("INSERT OR REPLACE INTO document_blocks (doc_id, block, body) VALUES (?, ?, ?)",
+                                document.take_blocks())
+        self.cursor.execute("UPDATE documents SET length = ? WHERE id = ?", (document.length, document.doc_id))
+    
+    def _record_duplicate(self, kept_id: str, metadata: Dict[str, Any], similarity: float) -> None:
+        """Note a dropped near-duplicate's source in the kept chunk's metadata"""
+        source = {"source_file": metadata.get("source_file", ""), "similarity": round(similarity, 4)}
+        if "chunk_index" in metadata:
+            source["chunk_index"] = metadata["chunk_index"]
+        
+        target = next((item[3] for item in self.pending if item[0] == kept_id), None)
+        stored = target is None
+        if stored:
+            self.cursor.execute("SELECT metadata FROM chunks WHERE id = ?", (kept_id,))
+            target = json.loads(self.cursor.fetchone()[0])
+        
+        duplicates = target.setdefault("duplicates", [])
+        if any(d["source_file"] == source["source_file"] and d.get("chunk_index") == source.get("chunk_index")
+               for d in duplicates):
+            return
+        duplicates.append(source)
+        if stored:
+            self.cursor.execute("UPDATE chunks SET metadata = ? WHERE id = ?", (json.dumps(target), kept_id))
+            self.generation = self.rag._bump_generation(self.cursor)
+    
+    def flush(self) -> None:
+        """Write buffered chunks into the current transaction"""
+        if not self.pending:
+            return
+        
+        with self.rag.metrics.stage("ingest.write"):
+            self._write()
+    
+    def _write(self) -> None:
+        rag = self.rag
+        cursor = self.cursor
+        # The reads below decide what to write, so they must not predate the write lock
+        ConnectionPool.begin(self.conn)
+        # Documents are replaced when a chunk moves, and superseded within the batch
+        documents = {item[4][0] for item in self.pending}
+        batch = list({item[0]: item for item in self.pending}.values())
+        self.pending = []
+        blobs = {chunk_id: rag._encode_embedding(embedding) for chunk_id, _, embedding, _, _ in batch}
+        ids = [chunk_id for chunk_id, *_ in batch]
+        
+        if self._document is not None:
+            # Spans in this batch may end in the partial block
+            cursor.executemany("INSERT OR REPLACE INTO document_blocks (doc_id, block, body) VALUES (?, ?, ?)",
+                               self._document.take_blocks())
+        
+        cursor.execute(f"SELECT id, doc_id FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids)
+        existing = dict(cursor.fetchall())
+        documents.update(doc_id for doc_id in existing.values() if doc_id is not None)
+        fresh = [chunk_id for chunk_id in ids if chunk_id not in existing] if rag._fts else []
+        
+        simhashes = {}
+        if rag._get_meta(cursor, "simhash_built") == "1":
+            simhashes = {chunk_id: self._simhashes[chunk_id] if chunk_id in self._simhashes else rag._simhash(text)
+                         for chunk_id, text, _, _, _ in batch}
+        
+        # Upsert so an existing row keeps its rowid and sidecar row
+        cursor.executemany('''
+            INSERT INTO chunks
+            (id, doc_id, start_offset, end_offset, embedding_vector, metadata, created_at, token_count,
+             content_type, source_file, simhash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                doc_id = excluded.doc_id,
+                start_offset = excluded.start_offset,
+                end_offset = excluded.end_offset,
+                embedding_vector = excluded.embedding_vector,
+                metadata = excluded.metadata,
+                created_at = excluded.created_at,
+                token_count = excluded.token_count,
+                content_type = excluded.content_type,
+                source_file = excluded.source_file,
+                simhash = COALESCE(excluded.simhash, simhash)
+        ''', [(
+            chunk_id,
+            *span,
+            blobs[chunk_id],
+            json.dumps(metadata),
+            metadata["created_at"],
+            rag._estimate_token_count(text),
+            metadata.get("content_type", "general"),
+            metadata.get("source_file", ""),
+            simhashes.get(chunk_id)
+        ) for chunk_id, text, _, metadata, span in batch])
+        
+        if self._document is not None:
+            documents.discard(self._document.doc_id)
+        rag._drop_orphan_documents(cursor, documents)
+        
+        if simhashes:
+            # Same id means same text, so existing band rows are already right
+            bands = rag._simhash_band_count(cursor)
+            cursor.executemany(
+                "INSERT OR IGNORE INTO simhash_bands (band, value, chunk_id) VALUES (?, ?, ?)",
+                [(band, key, chunk_id) for chunk_id, value in simhashes.items()
+                 for band, key in _simhash_bands(value, bands)]
+            )
+        self._simhashes = {}
+        self._simhash_pending = {}
+        
+        if fresh:
+            # The id is a hash of the text, so only new rows change the full-text index
+            texts = {chunk_id: text for chunk_id, text, *_ in batch}
+            cursor.executemany("INSERT INTO chunks_fts (rowid, text) SELECT rowid, ? FROM chunks WHERE id = ?",
+                               [(texts[chunk_id], chunk_id) for chunk_id in fresh])
+        
+        if rag._sidecar is not None:
+            cursor.execute(f"SELECT id, shard, vec_row FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids)
+            placed = {chunk_id: (shard, vec_row) for chunk_id, shard, vec_row in cursor.fetchall()}
+            routed = {chunk_id: (metadata.get("content_type", "general"), metadata["created_at"])
+                      for chunk_id, _, _, metadata, _ in batch}
+            # A chunk whose content type or month changed moves to its new shard
+            appended = [chunk_id for chunk_id in ids if placed[chunk_id][1] is None
+                        or placed[chunk_id][0] != rag._sidecar.key(*routed[chunk_id])]
+            moved = [placed[chunk_id] for chunk_id in appended if placed[chunk_id][1] is not None]
+            if moved:
+                rag._sidecar.tombstone(cursor, moved)
+                self._deleted[1].extend(moved)
+            if appended:
+                refs = rag._sidecar.append(cursor, [(chunk_id, *routed[chunk_id], blobs[chunk_id])
+                                                    for chunk_id in appended])
+                cursor.executemany("UPDATE chunks SET shard = ?, vec_row = ? WHERE id = ?",
+                                   [ref + (chunk_id,) for ref, chunk_id in zip(refs, appended)])
+        
+        lsh = rag._get_lsh(cursor)
+        if lsh is not None:
+            keys = lsh.keys_many([embedding for _, _, embedding, _, _ in batch])
+            cursor.executemany(
+                "INSERT OR IGNORE INTO ann_buckets (table_no, bucket, chunk_id) VALUES (?, ?, ?)",
+                [(t, key, chunk_id) for chunk_id, row in zip(ids, keys) for t, key in enumerate(row)]
+            )
+        
+        if rag._get_meta(cursor, "postings_built") == "1":
+            cursor.executemany("DELETE FROM postings WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            cursor.executemany(
+                "INSERT INTO postings (dim, chunk_id, weight) VALUES (?, ?, ?)",
+                [row for chunk_id in ids
+                 for row in rag._postings_rows(chunk_id, rag._decode_embedding(blobs[chunk_id]))]
+            )
+        
+        self.generation = rag._bump_generation(cursor)
+        self.uncommitted += len(batch)
+        rag.metrics.count("chunks_written", len(batch))
+        self._indexed.extend((chunk_id, metadata.get("content_type", "general"), embedding)
+                             for chunk_id, _, embedding, metadata, _ in batch)
+    
+    def delete(self, chunk_ids: Sequence[str]) -> None:
+        """Delete chunks (and their index entries) in the current transaction"""
+        self.flush()
+        ConnectionPool.begin(self.conn)
+        self._deleted[1].extend(self.rag._delete_chunks(self.cursor, chunk_ids))
+        self._deleted[0].extend(chunk_ids)
+        self.generation = self.rag._bump_generation(self.cursor)
+    
+    def commit(self) -> None:
+        """Flush, commit, then patch the in-process structures"""
+        self.flush()
+        dropped, saved = self._near_duplicates
+        if dropped:
+            self.rag._add_meta(self.cursor, "dedup_skipped", dropped)
+            self.rag._add_meta(self.cursor, "dedup_reclaimed_bytes", saved)
+            self._near_duplicates = [0, 0]
+        with self.rag.metrics.stage("ingest.commit"):
+            self.conn.commit()
+        self.uncommitted = 0
+        if self.generation is not None:
+            self.rag._generation = self.generation
+            self.generation = None
+        
+        removed, vec_rows = self._deleted
+        self._deleted = ([], [])
+        self.rag._after_delete(removed, vec_rows)
+        
+        with self.rag._index_lock:
+            if self.rag._index is not None:
+                for chunk_id, content_type, embedding in self._indexed:
+                    self.rag._index.add(chunk_id, content_type, embedding)
+        self._indexed = []
+    
+    def close(self) -> None:
+        self.conn.close()
+
+class RAGMemory:
+    """RAG Memory implementation with vector embeddings"""
+    
+    def __init__(self, config_path: Optional[str] = None):
+        self.config = self._load_config(config_path)
+        if self.config["dedup_mode"] not in ("off", "skip", "merge"):
+            raise ValueError(f"Unknown dedup_mode: {self.config['dedup_mode']}")
+        if self.config["quantizer"] not in VectorSidecar.FORMATS:
+            raise ValueError(f"Unknown quantizer: {self.config['quantizer']}")
+        if self.config["shard_by"] not in ShardedSidecar.KEYS:
+            raise ValueError(f"Unknown shard_by: {self.config['shard_by']}")
+        for age in self.config["retention"].values():
+            self._time_bound(age, upper=False)
+        self.storage_path = Path(self.config["storage_path"])
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.storage_path / "vectors.db"
+        self.socket_path = Path(os.path.expanduser(
+            self.config["socket_path"] or str(self.storage_path / "rag-memory.sock")
+        ))
+        self._index: Optional[VectorIndex] = None
+        self._sidecar: Optional[ShardedSidecar] = None
+        self._lsh: Optional[LSHIndex] = None
+        if self.config["vector_sidecar"]:
+            self._sidecar = ShardedSidecar(self.storage_path, self.config["embedding_dim"],
+                                           self.config["quantizer"], self.config["shard_by"],
+                                           self.config["shard_workers"])
+        self.ingest_report = self._new_ingest_report()
+        self._connections = ConnectionPool(self.db_path, self.config["busy_timeout_ms"])
+        self._local = threading.local()  # The ingest session open on each thread
+        self._index_lock = threading.RLock()
+        self._generation = 0
+        self._fts = False
+        self._query_cache: Optional[QueryCache] = None
+        if self.config["query_cache_size"] > 0:
+            self._query_cache = QueryCache(self._connections, self.config["query_cache_size"],
+                                           self.config["query_cache_persist"])
+        self._token_features = functools.lru_cache(maxsize=self.config["token_cache_size"])(
+            self._hash_token
+        )
+        self.metrics = Metrics(self.storage_path / "metrics.json", self.config["metrics"])
+        self._init_db()
+    
+    def _load_config(self, config_path: Optional[str]) -> Dict[str, Any]:
+        config = DEFAULT_CONFIG.copy()
+        
+        if not (config_path and os.path.exists(config_path)):
+            config_path = os.path.expanduser("~/.openclaw/data/rag-memory/config.json")
+        
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                config.update(json.load(f))
+        
+        return config
+    
+    def _init_db(self):
+        """Initialize SQLite database"""
+        conn = self._connections.connect(write=True)
+        cursor = conn.cursor()
+        # Only takes effect on a new file; lets compact() free pages a few at a time
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # Persistent: readers then never wait on a writer, nor it on them
+        _retry_busy(lambda: cursor.execute("PRAGMA journal_mode=WAL"))
+        
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS chunks ({CHUNK_COLUMNS})")
+        
+        cursor.execute("PRAGMA table_info(chunks)")
+        columns = [col[1] for col in cursor.fetchall()]
+        for column, kind in (("vec_row", "INTEGER"), ("simhash", "INTEGER"), ("shard", "TEXT NOT NULL DEFAULT ''"),
+                             ("doc_id", "INTEGER"), ("start_offset", "INTEGER"), ("end_offset", "INTEGER")):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE chunks ADD COLUMN {column} {kind}")
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                source_file TEXT,
+                length INTEGER,
+                created_at TEXT
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_blocks (
+                doc_id INTEGER NOT NULL,
+                block INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                PRIMARY KEY (doc_id, block)
+            )
+        ''')
+        
+        migrated_text = "text" in columns
+        if migrated_text:
+            self._migrate_documents(cursor)
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_content_type ON chunks(content_type)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_created_at ON chunks(created_at)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_source_file ON chunks(source_file)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_doc_id ON chunks(doc_id)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_shard ON chunks(shard)
+        ''')
+        
+        # Vector sidecar shards: pinned content type and the created_at range of their rows
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shards (
+                name TEXT PRIMARY KEY,
+                content_type TEXT,
+                first_created TEXT,
+                last_created TEXT,
+                frozen INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        for key in self.config["indexed_metadata_keys"]:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_meta_{key.replace('.', '_')} "
+                f"ON chunks({self._metadata_expr(key)})"
+            )
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ann_buckets (
+                table_no INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (table_no, bucket, chunk_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ann_chunk ON ann_buckets(chunk_id)
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS postings (
+                dim INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (dim, chunk_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings(chunk_id)
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS simhash_bands (
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (band, value, chunk_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_simhash_chunk ON simhash_bands(chunk_id)
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_manifest (
+                source_file TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                size INTEGER,
+                content_hash TEXT,
+                chunk_ids TEXT,
+                ingested_at TEXT
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS query_cache (
+                key TEXT PRIMARY KEY,
+                generation INTEGER,
+                results TEXT,
+                used_at REAL
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS store_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        
+        if self._get_meta(cursor, "embedding_format") != EMBEDDING_FORMAT:
+            self._migrate_embeddings(cursor)
+        elif migrated_text:
+            self._set_meta(cursor, "schema_version", SCHEMA_VERSION)
+        
+        if self._get_meta(cursor, "source_files_resolved") != "1":
+            if self._resolve_source_files(cursor):
+                self._bump_generation(cursor)
+            self._set_meta(cursor, "source_files_resolved", 1)
+        
+        self._fts = self._init_fts(cursor)
+        
+        conn.commit()
+        self._generation = int(self._get_meta(cursor, "generation", "0"))
+        
+        if self._sidecar is not None:
+            self._check_sidecar(conn)
+        
+        conn.close()
+    
+    def _resolve_source_files(self, cursor) -> int:
+        """Give file chunks the resolved path their manifest entry is keyed by
+        
+        Chunks used to keep the path as it was passed to ingest, so a source
+        filter spelled the other way missed them while delete() still forgot
+        the file. The relative path cannot be re-resolved without the old
+        working directory, so each chunk takes the manifest key that lists
+        it. Returns the number of chunks updated.
+        """
+        cursor.execute('''
+            SELECT c.id, c.source_file, m.source_file
+            FROM file_manifest m, json_each(m.chunk_ids) j JOIN chunks c ON c.id = j.value
+        ''')
+        owners: Dict[str, Tuple[str, List[str]]] = {}
+        for chunk_id, source_file, key in cursor.fetchall():
+            owners.setdefault(chunk_id, (source_file or "", []))[1].append(key)
+        
+        updates = []
+        for chunk_id, (source_file, keys) in owners.items():
+            if source_file in keys:
+                continue
+            # A chunk several files produce goes to the one its old path names
+            suffix = os.sep + str(Path(source_file))
+            key = next((key for key in sorted(keys) if source_file and key.endswith(suffix)), min(keys))
+            updates.append((key, key, chunk_id))
+        cursor.executemany('''
+            UPDATE chunks SET source_file = ?, metadata = json_set(COALESCE(metadata, '{}'), '$.source_file', ?)
+            WHERE id = ?
+        ''', updates)
+        return len(updates)
+    
+    def _init_fts(self, cursor) -> bool:
+        """Create the FTS5 index over chunk text; False if FTS5 is unavailable
+        
+        chunks_fts is a contentless table keyed by chunks.rowid, so the text
+        is only stored in documents and writers pass it in when they index or
+        delete a row. A store that predates it is indexed once.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'")
+        if cursor.fetchone():
+            return True
+        
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE chunks_fts USING fts5(text, content='')")
+        except sqlite3.OperationalError:
+            return False
+        
+        for batch in self._iter_chunk_texts(cursor):
+            cursor.executemany("INSERT INTO chunks_fts (rowid, text) VALUES (?, ?)",
+                               [(rowid, text) for rowid, _, text in batch])
+        return True
+    
+    def _check_sidecar(self, conn) -> None:
+        """Verify the sidecar shards against vectors.db, repairing them if needed"""
+        cursor = conn.cursor()
+        if not self._sidecar.needs_repair(cursor):
+            return
+        
+        # Re-check under the write lock so we never cut off a live append
+        ConnectionPool.begin(conn)
+        if self._sidecar.needs_repair(cursor):
+            self._sidecar.repair(cursor)
+        conn.commit()
+    
+    def _bump_generation(self, cursor) -> int:
+        """Advance the store generation inside the caller's write transaction
+        
+        Every change to the chunks table bumps it, so long-lived processes
+        can tell when another process has written to the store.
+        """
+        generation = int(self._get_meta(cursor, "generation", "0")) + 1
+        self._set_meta(cursor, "generation", generation)
+        return generation
+    
+    def _sync_generation(self) -> int:
+        """Drop cached index state if another process changed the store
+        
+        Returns the generation this thread's snapshot sees, which can trail
+        self._generation while another thread of ours is writing.
+        """
+        with self._connections.snapshot() as cursor:
+            generation = int(self._get_meta(cursor, "generation", "0"))
+        
+        with self._index_lock:
+            if generation > self._generation:
+                self._index = None
+                self._lsh = None
+                self._generation = generation
+        return generation
+    
+    @staticmethod
+    def _get_meta(cursor, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Read a value from the store_meta table"""
+        cursor.execute("SELECT value FROM store_meta WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+    
+    @staticmethod
+    def _add_meta(cursor, key: str, amount: int) -> None:
+        """Add to an integer in the store_meta table"""
+        cursor.execute(
+            "INSERT INTO store_meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+            (key, str(amount))
+        )
+    
+    @staticmethod
+    def _set_meta(cursor, key: str, value: Any) -> None:
+        """Write a value to the store_meta table"""
+        cursor.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+            (key, str(value))
+        )
+    
+    def _migrate_embeddings(self, cursor) -> int:
+        """Rewrite legacy JSON-encoded embeddings as packed float32 (one-shot)"""
+        migrated = 0
+        
+        while True:
+            cursor.execute('''
+                SELECT id, embedding_vector FROM chunks
+                WHERE typeof(embedding_vector) = 'text'
+                LIMIT ?
+            ''', (MIGRATION_BATCH_SIZE,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            cursor.executemany(
+                "UPDATE chunks SET embedding_vector = ? WHERE id = ?",
+                [(self._encode_embedding(json.loads(emb)), chunk_id) for chunk_id, emb in rows]
+            )
+            migrated += len(rows)
+        
+        self._set_meta(cursor, "embedding_format", EMBEDDING_FORMAT)
+        self._set_meta(cursor, "schema_version", SCHEMA_VERSION)
+        
+        if migrated:
+            print(f"Migrated {migrated} embedding(s) to {EMBEDDING_FORMAT}", file=sys.stderr)
+        
+        return migrated
+    
+    def _migrate_documents(self, cursor) -> Optional[int]:
+        """Move chunk text out of the chunks table into documents (one-shot)
+        
+        Each source file's chunks are replayed in order through a
+        DocumentBuffer, so the words consecutive chunks share are stored
+        once, and the text column is dropped. The old external-content
+        full-text index goes with it and is rebuilt as contentless.
+        Returns the number of documents written.
+        """
+        cursor.execute("DROP TABLE IF EXISTS chunks_fts")
+        cursor.execute("SELECT DISTINCT source_file FROM chunks")
+        sources = [row[0] for row in cursor.fetchall()]
+        documents = chunks = 0
+        
+        for source in sources:
+            cursor.execute('''
+                SELECT id, text, metadata FROM chunks WHERE source_file IS ?
+                ORDER BY CAST(json_extract(metadata, '$.chunk_index') AS INTEGER), rowid
+            ''', (source,))
+            rows = cursor.fetchall()
+            spans = []
+            document = None
+            for chunk_id, text, metadata_json in rows:
+                metadata = json.loads(metadata_json or "{}")
+                if document is None or not metadata.get("start_position"):
+                    if document is not None:
+                        self._store_migrated(cursor, document)
+                    cursor.execute("INSERT INTO documents (source_file, length, created_at) VALUES (?, 0, ?)",
+                                   (source, datetime.now().isoformat()))
+                    document = DocumentBuffer(cursor.lastrowid)
+                    documents += 1
+                start, end = document.append(text, metadata.get("start_position"), metadata.get("end_position"))
+                spans.append((document.doc_id, start, end, chunk_id))
+            if document is not None:
+                self._store_migrated(cursor, document)
+            cursor.executemany("UPDATE chunks SET doc_id = ?, start_offset = ?, end_offset = ? WHERE id = ?", spans)
+            chunks += len(rows)
+        
+        try:
+            cursor.execute("ALTER TABLE chunks DROP COLUMN text")
+        except sqlite3.OperationalError:
+            # SQLite before 3.35 cannot drop a column: copy the rows, keeping their rowids
+            cursor.execute("PRAGMA table_info(chunks)")
+            kept = ', '.join(col[1] for col in cursor.fetchall() if col[1] != "text")
+            cursor.execute(f"CREATE TABLE chunks_migrated ({CHUNK_COLUMNS})")
+            cursor.execute(f"INSERT INTO chunks_migrated (rowid, {kept}) SELECT rowid, {kept} FROM chunks")
+            cursor.execute("DROP TABLE chunks")
+            cursor.execute("ALTER TABLE chunks_migrated RENAME TO chunks")
+        
+        if chunks:
+            print(f"Moved the text of {chunks} chunk(s) into {documents} compressed document(s)", file=sys.stderr)
+        return documents
+    
+    @staticmethod
+    def _store_migrated(cursor, document: DocumentBuffer) -> None:
+        cursor.executemany("INSERT OR REPLACE INTO document_blocks (doc_id, block, body) VALUES (?, ?, ?)",
+                           document.take_blocks())
+        cursor.execute("UPDATE documents SET length = ? WHERE id = ?", (document.length, document.doc_id))
+    
+    def _materialize(self, cursor, spans: Dict[Any, Tuple[int, int, int]]) -> Dict[Any, str]:
+        """Text of each (doc_id, start, end) byte span, keyed like spans
+        
+        Every block the spans touch is read and decompressed once, and each
+        span is decoded straight from a memoryview over its block(s).
+        """
+        wanted = sorted({(doc_id, block) for doc_id, start, end in spans.values() if end > start
+                         for block in range(start // DOCUMENT_BLOCK_BYTES, (end - 1) // DOCUMENT_BLOCK_BYTES + 1)})
+        blocks = {}
+        # Two parameters per block; stay under SQLite's historical 999-variable limit
+        step = MIGRATION_BATCH_SIZE // 2
+        for i in range(0, len(wanted), step):
+            batch = wanted[i:i + step]
+            cursor.execute(
+                f"SELECT doc_id, block, body FROM document_blocks "
+                f"WHERE (doc_id, block) IN (VALUES {','.join(['(?, ?)'] * len(batch))})",
+                [part for key in batch for part in key]
+            )
+            blocks.update(((doc_id, block), zlib.decompress(body)) for doc_id, block, body in cursor.fetchall())
+        self.metrics.count("bytes_decoded", sum(len(buffer) for buffer in blocks.values()))
+        
+        texts = {}
+        for key, (doc_id, start, end) in spans.items():
+            if end <= start:
+                texts[key] = ''
+                continue
+            first, last = start // DOCUMENT_BLOCK_BYTES, (end - 1) // DOCUMENT_BLOCK_BYTES
+            if first == last:
+                buffer = blocks[(doc_id, first)]
+            else:
+                buffer = b''.join(blocks[(doc_id, block)] for block in range(first, last + 1))
+            base = first * DOCUMENT_BLOCK_BYTES
+            texts[key] = str(memoryview(buffer)[start - base:end - base], 'utf-8')
+        return texts
+    
+    def _iter_chunk_texts(self, cursor) -> Iterator[List[Tuple[int, str, str]]]:
+        """Batches of (rowid, id, text) for every chunk
+        
+        Pages by rowid on a separate cursor, so the caller may write to
+        chunks between batches.
+        """
+        reader = cursor.connection.cursor()
+        last = 0
+        while True:
+            reader.execute(
+                "SELECT rowid, id, doc_id, start_offset, end_offset FROM chunks "
+                "WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, MIGRATION_BATCH_SIZE)
+            )
+            rows = reader.fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            texts = self._materialize(reader, {chunk_id: span for _, chunk_id, *span in rows})
+            yield [(rowid, chunk_id, texts[chunk_id]) for rowid, chunk_id, *_ in rows]
+    
+    @staticmethod
+    def _drop_orphan_documents(cursor, doc_ids: Iterable[int]) -> None:
+        """Delete the given documents if no chunk points into them any more"""
+        orphans = []
+        for doc_id in doc_ids:
+            cursor.execute("SELECT 1 FROM chunks WHERE doc_id = ? LIMIT 1", (doc_id,))
+            if cursor.fetchone() is None:
+                orphans.append((doc_id,))
+        cursor.executemany("DELETE FROM document_blocks WHERE doc_id = ?", orphans)
+        cursor.executemany("DELETE FROM documents WHERE id = ?", orphans)
+    
+    def _encode_embedding(self, embedding) -> bytes:
+        """Pack an embedding as little-endian float32 bytes"""
+        if HAS_NUMPY:
+            return np.asarray(embedding, dtype='<f4').tobytes()
+        
+        packed = array('f', embedding)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return packed.tobytes()
+    
+    def _decode_embedding(self, blob: bytes):
+        """Unpack float32 bytes; zero-copy view over the blob with NumPy"""
+        if HAS_NUMPY:
+            return np.frombuffer(blob, dtype='<f4')
+        
+        packed = array('f')
+        packed.frombytes(blob)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return packed
+    
+    def _generate_embedding(self, text: str) -> List[float]:
+        """Generate embedding vector for text using hash-based method"""
+        embedding = self.embed_many([text])[0]
+        return embedding.tolist() if HAS_NUMPY else embedding
+    
+    def _hash_token(self, word: str) -> Tuple[Tuple[int, ...], Tuple[float, ...]]:
+        """Indices and signed values a word adds to an embedding"""
+        # Simple but effective hash-based embedding
+        # Works offline, deterministic, fast
+        dim = self.config["embedding_dim"]
+        word_hash = hashlib.md5(word.encode()).hexdigest()
+        indices = []
+        values = []
+        
+        # Use hash to determine indices and values
+        for i in range(0, len(word_hash), 8):
+            if i + 8 > len(word_hash):
+                break
+            
+            indices.append(int(word_hash[i:i+4], 16) % dim)
+            val = int(word_hash[i+4:i+8], 16) / 0xFFFFFFFF
+            values.append(val * (1 - 2 * ((ord(word_hash[i]) & 1) == 0)))
+        
+        return tuple(indices), tuple(values)
+    
+    def embed_many(self, texts: Sequence[str]):
+        """Embed a batch of texts
+        
+        Each distinct word is hashed once through the bounded token cache, and
+        with NumPy the whole batch is accumulated by a single bincount. Values
+        are summed in word order and normalized with a sequential sum, so the
+        vectors are bit-identical to embedding each text on its own. Returns
+        an (n, dim) float64 array with NumPy, otherwise a list of lists.
+        """
+        dim = self.config["embedding_dim"]
+        
+        if not HAS_NUMPY:
+            embeddings = []
+            for text in texts:
+                embedding = [0.0] * dim
+                for word in text.lower().split():
+                    indices, values = self._token_features(word)
+                    for idx, val in zip(indices, values):
+                        embedding[idx] += val
+                
+                # Normalize
+                norm = math.sqrt(sum(x*x for x in embedding))
+                if norm > 0:
+                    embedding = [x / norm for x in embedding]
+                embeddings.append(embedding)
+            return embeddings
+        
+        vocab: Dict[str, int] = {}
+        token_ids: List[int] = []
+        token_rows: List[int] = []
+        for row, text in enumerate(texts):
+            words = text.lower().split()
+            token_ids.extend(vocab.setdefault(word, len(vocab)) for word in words)
+            token_rows.extend([row] * len(words))
+        
+        embeddings = np.zeros((len(texts), dim), dtype=np.float64)
+        if not token_ids:
+            return embeddings
+        
+        features = [self._token_features(word) for word in vocab]
+        width = max(len(indices) for indices, _ in features)
+        feature_idx = np.zeros((len(features), width), dtype=np.int64)
+        feature_val = np.zeros((len(features), width), dtype=np.float64)
+        for i, (indices, values) in enumerate(features):
+            feature_idx[i, :len(indices)] = indices
+            feature_val[i, :len(values)] = values
+        
+        tokens = np.asarray(token_ids, dtype=np.int64)
+        flat = (np.asarray(token_rows, dtype=np.int64) * dim)[:, np.newaxis] + feature_idx[tokens]
+        embeddings = np.bincount(flat.ravel(), weights=feature_val[tokens].ravel(),
+                                 minlength=len(texts) * dim).reshape(len(texts), dim)
+        
+        # cumsum adds left to right like the scalar loop; a pairwise sum would not
+        norms = np.sqrt(np.cumsum(embeddings * embeddings, axis=1)[:, -1])
+        nonzero = norms > 0
+        embeddings[nonzero] /= norms[nonzero, np.newaxis]
+        return embeddings
+    
+    def _cosine_similarity(self, a: Sequence[float], b: Sequence[float]) -> float:
+        """Calculate cosine similarity between two vectors"""
+        if HAS_NUMPY:
+            a_arr = np.asarray(a)
+            b_arr = np.asarray(b)
+            return float(np.dot(a_arr, b_arr) / (np.linalg.norm(a_arr) * np.linalg.norm(b_arr) + 1e-8))
+        else:
+            # Pure Python implementation
+            dot = sum(x * y for x, y in zip(a, b))
+            norm_a = math.sqrt(sum(x * x for x in a))
+            norm_b = math.sqrt(sum(y * y for y in b))
+            return dot / (norm_a * norm_b + 1e-8)
+    
+    def _estimate_token_count(self, text: str) -> int:
+        """Estimate token count (rough approximation: ~4 chars per token)"""
+        return len(text) // 4
+    
+    def _chunk_text(self, text: str, chunk_size: int, overlap: int, 
+                    metadata: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Split text into overlapping chunks"""
+        return list(self._iter_chunks(text.split(), chunk_size, overlap, metadata))
+    
+    def _iter_chunks(self, words: Iterable[str], chunk_size: int, overlap: int,
+                     metadata: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield overlapping chunks from a word stream
+        
+        Chunk i covers words [i * step, i * step + chunk_size) with
+        step = chunk_size - overlap, and the last chunk ends at the final
+        word. Only the current window of words is held in memory.
+        """
+        step = chunk_size - overlap
+        if step <= 0:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        
+        window = deque()
+        start = 0
+        index = 0
+        skip = 0
+        fresh = False  # window holds words not yet emitted in a chunk
+        
+        def emit():
+            chunk_meta = metadata.copy()
+            chunk_meta["chunk_index"] = index
+            chunk_meta["start_position"] = start
+            chunk_meta["end_position"] = start + len(window)
+            return ' '.join(window), chunk_meta
+        
+        for word in words:
+            if skip:
+                skip -= 1
+                continue
+            
+            window.append(word)
+            fresh = True
+            
+            if len(window) == chunk_size:
+                yield emit()
+                index += 1
+                fresh = False
+                
+                # Slide to the next chunk start
+                for _ in range(min(step, chunk_size)):
+                    window.popleft()
+                skip = max(0, step - chunk_size)
+                start += step
+        
+        if fresh:
+            yield emit()
+    
+    def add_chunk(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Add a single text chunk to the vector store"""
+        with self.metrics.stage("ingest.embed"):
+            embedding = self._generate_embedding(text)
+        with self._ingest_session() as writer:
+            return writer.add(text, metadata, embedding)
+    
+    @contextmanager
+    def _ingest_session(self):
+        """Yield the active ChunkWriter, opening one if none is active
+        
+        Nested calls (add_directory -> add_file -> add_text -> add_chunk)
+        share the outermost writer, which commits when it exits. Sessions
+        in other threads wait for it: a store has one writer at a time.
+        """
+        writer = getattr(self._local, "writer", None)
+        if writer is not None:
+            yield writer
+            return
+        
+        with self._connections.write_lock:
+            writer = ChunkWriter(self, self.config["ingest_batch_size"])
+            self._local.writer = writer
+            try:
+                yield writer
+                writer.commit()
+            except BaseException:
+                writer.conn.rollback()
+                raise
+            finally:
+                self._local.writer = None
+                writer.close()
+    
+    def _split_text(self, text: str, metadata: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Chunk text if it exceeds chunk_size, else keep it whole"""
+        chunk_size = self.config["chunk_size"]
+        overlap = self.config["chunk_overlap"]
+        
+        # Estimate tokens and decide if chunking needed
+        token_count = self._estimate_token_count(text)
+        
+        if token_count <= chunk_size:
+            return [(text, metadata)]
+        
+        return self._chunk_text(text, chunk_size, overlap, metadata)
+    
+    def add_text(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Add text, automatically chunking if needed"""
+        if metadata is None:
+            metadata = {}
+        
+        with self.metrics.stage("ingest.chunk"):
+            chunks = self._split_text(text, metadata)
+        with self.metrics.stage("ingest.embed"):
+            embeddings = self.embed_many([chunk_text for chunk_text, _ in chunks])
+        chunk_ids = []
+        
+        with self._ingest_session() as writer, writer.document(metadata.get("source_file", "")):
+            for (chunk_text, chunk_meta), embedding in zip(chunks, embeddings):
+                chunk_id = writer.add(chunk_text, chunk_meta, embedding)
+                chunk_ids.append(chunk_id)
+        
+        return chunk_ids
+    
+    @staticmethod
+    def _new_ingest_report() -> Dict[str, int]:
+        return {"added": 0, "updated": 0, "skipped": 0, "removed": 0, "near_duplicates": 0}
+    
+    def _read_file(self, path: Path) -> str:
+        """Read file content, pretty-printing JSON"""
+        if path.suffix == '.json':
+            with open(path, 'r') as f:
+                content = json.dumps(json.load(f), indent=2)
+        else:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+        
+        self.metrics.count("files_read")
+        self.metrics.count("bytes_read", path.stat().st_size)
+        return content
+    
+    def _file_metadata(self, path: Path) -> Dict[str, Any]:
+        """Chunk metadata derived from a file's path"""
+        # Determine content type
+        content_type = "general"
+        if path.suffix in ['.md']:
+            content_type = "markdown"
+        elif path.suffix in ['.py', '.js', '.ts', '.sh', '.bash']:
+            content_type = "code"
+        elif path.suffix == '.json':
+            content_type = "json"
+        
+        # Determine metadata
+        # Resolved like the manifest key, so source filters and delete() see one spelling
+        metadata = {
+            "source_file": str(path.resolve()),
+            "file_name": path.name,
+            "content_type": content_type
+        }
+        
+        # Check if it's a daily memory file
+        if 'memory' in str(path) and re.search(r'\d{4}-\d{2}-\d{2}', path.name):
+            metadata["content_type"] = "daily"
+        
+        return metadata
+    
+    def add_file(self, file_path: str) -> List[str]:
+        """Add file contents to the vector store
+        
+        Files are tracked in file_manifest by resolved path. A file whose
+        mtime and size are unchanged is skipped without being read; a changed
+        file is re-ingested and the chunks it no longer produces are removed.
+        Outcomes are counted in self.ingest_report.
+        """
+        path = Path(file_path)
+        
+        if not path.exists():
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        key = str(path.resolve())
+        stat = path.stat()
+        
+        with self._ingest_session() as writer:
+            entry = self._get_manifest(writer.cursor, key)
+            
+            if self._manifest_unchanged(entry, stat):
+                self.ingest_report["skipped"] += 1
+                return entry["chunk_ids"]
+            
+            if stat.st_size > self.config["stream_threshold_bytes"]:
+                return self._stream_file(writer, path, key, stat, entry)
+            
+            prepared = self._prepare_file(path, entry["content_hash"] if entry else None)
+            return self._store_prepared(writer, key, stat, entry, prepared)
+    
+    def _iter_file_blocks(self, path: Path) -> Iterator[str]:
+        """Yield file content in blocks; JSON is pretty-printed incrementally"""
+        self.metrics.count("files_read")
+        self.metrics.count("bytes_read", path.stat().st_size)
+        if path.suffix == '.json':
+            with open(path, 'r') as f:
+                yield from _iter_json_pretty(f)
+            return
+        
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for block in iter(lambda: f.read(STREAM_BLOCK_CHARS), ''):
+                yield block
+    
+    def _stream_file(self, writer: ChunkWriter, path: Path, key: str, stat: os.stat_result,
+                     entry: Optional[Dict[str, Any]]) -> List[str]:
+        """Ingest a large file in bounded memory
+        
+        Produces the same chunks as reading the whole file: words are split
+        across block boundaries exactly like str.split(), and chunks are
+        embedded and written in ingest_batch_size groups as they are read.
+        """
+        if entry is not None:
+            hasher = hashlib.sha256()
+            for block in self._iter_file_blocks(path):
+                hasher.update(block.encode())
+            if hasher.hexdigest() == entry["content_hash"]:
+                prepared = {"content_hash": entry["content_hash"], "chunks": None, "embeddings": None}
+                return self._store_prepared(writer, key, stat, entry, prepared)
+        
+        hasher = hashlib.sha256()
+        
+        def hashed_blocks():
+            for block in self._iter_file_blocks(path):
+                hasher.update(block.encode())
+                yield block
+        
+        blocks = hashed_blocks()
+        metadata = self._file_metadata(path)
+        
+        # add_text keeps texts with len(text) // 4 <= chunk_size whole
+        limit = 4 * self.config["chunk_size"] + 4
+        head = []
+        head_len = 0
+        with self.metrics.stage("ingest.read"):
+            for block in blocks:
+                head.append(block)
+                head_len += len(block)
+                if head_len >= limit:
+                    break
+        
+        if head_len < limit:
+            chunks = iter(self._split_text(''.join(head), metadata))
+        else:
+            chunks = self._iter_chunks(_iter_words(itertools.chain(head, blocks)),
+                                       self.config["chunk_size"], self.config["chunk_overlap"], metadata)
+        head = None
+        
+        chunk_ids = []
+        batch_size = self.config["ingest_batch_size"]
+        with writer.document(key):
+            while True:
+                with self.metrics.stage("ingest.read"):
+                    batch = list(itertools.islice(chunks, batch_size))
+                if not batch:
+                    break
+                with self.metrics.stage("ingest.embed"):
+                    embeddings = self.embed_many([chunk_text for chunk_text, _ in batch])
+                chunk_ids.extend(writer.add(chunk_text, chunk_meta, embedding)
+                                 for (chunk_text, chunk_meta), embedding in zip(batch, embeddings))
+        
+        prepared = {"content_hash": hasher.hexdigest(), "chunk_ids": chunk_ids}
+        return self._store_prepared(writer, key, stat, entry, prepared)
+    
+    def _manifest_unchanged(self, entry: Optional[Dict[str, Any]], stat: os.stat_result) -> bool:
+        return entry is not None and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size)
+    
+    def _prepare_file(self, path: Path, known_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Read, chunk and embed a file without touching the store
+        
+        If the content hash equals known_hash, chunking and embedding are
+        skipped and "chunks" is None.
+        """
+        with self.metrics.stage("ingest.read"):
+            content = self._read_file(path)
+            content_hash = hashlib.sha256(content.encode()).hexdigest()
+        if content_hash == known_hash:
+            return {"content_hash": content_hash, "chunks": None, "embeddings": None}
+        
+        with self.metrics.stage("ingest.chunk"):
+            chunks = self._split_text(content, self._file_metadata(path))
+        with self.metrics.stage("ingest.embed"):
+            embeddings = self.embed_many([chunk_text for chunk_text, _ in chunks])
+        return {"content_hash": content_hash, "chunks": chunks, "embeddings": embeddings}
+    
+    def _store_prepared(self, writer: ChunkWriter, key: str, stat: os.stat_result,
+                        entry: Optional[Dict[str, Any]], prepared: Dict[str, Any]) -> List[str]:
+        """Write a prepared file's chunks and update its manifest entry"""
+        content_hash = prepared["content_hash"]
+        
+        if prepared.get("chunk_ids") is not None:
+            # Streamed files arrive already written
+            chunk_ids = prepared["chunk_ids"]
+        elif prepared["chunks"] is None:
+            self._record_manifest(writer, key, stat, content_hash, entry["chunk_ids"])
+            self.ingest_report["skipped"] += 1
+            return entry["chunk_ids"]
+        else:
+            with writer.document(key):
+                chunk_ids = [writer.add(chunk_text, chunk_meta, embedding)
+                             for (chunk_text, chunk_meta), embedding in zip(prepared["chunks"], prepared["embeddings"])]
+        
+        stale = set(entry["chunk_ids"]) - set(chunk_ids) if entry is not None else set()
+        self._record_manifest(writer, key, stat, content_hash, chunk_ids, stale)
+        self.ingest_report["updated" if entry is not None else "added"] += 1
+        
+        return chunk_ids
+    
+    @classmethod
+    def _detached(cls, config: Dict[str, Any]) -> "RAGMemory":
+        """An instance that can chunk and embed but has no storage attached"""
+        rag = cls.__new__(cls)
+        rag.config = config
+        rag._token_features = functools.lru_cache(maxsize=config["token_cache_size"])(rag._hash_token)
+        rag.metrics = Metrics(None)
+        return rag
+    
+    def _get_manifest(self, cursor, key: str) -> Optional[Dict[str, Any]]:
+        cursor.execute(
+            "SELECT mtime_ns, size, content_hash, chunk_ids FROM file_manifest WHERE source_file = ?", (key,)
+        )
+        row = cursor.fetchone()
+        
+        if row is None:
+            return None
+        return {"mtime_ns": row[0], "size": row[1], "content_hash": row[2], "chunk_ids": json.loads(row[3])}
+    
+    def _record_manifest(self, writer: ChunkWriter, key: str, stat: os.stat_result, content_hash: str,
+                         chunk_ids: List[str], stale: Optional[set] = None) -> None:
+        """Upsert a manifest entry and drop chunks the file no longer produces"""
+        writer.flush()
+        cursor = writer.cursor
+        cursor.execute('''
+            INSERT OR REPLACE INTO file_manifest
+            (source_file, mtime_ns, size, content_hash, chunk_ids, ingested_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (key, stat.st_mtime_ns, stat.st_size, content_hash, json.dumps(chunk_ids),
+              datetime.now().isoformat()))
+        
+        if stale:
+            writer.delete(self._unshared_chunks(cursor, [key], stale))
+    
+    def _unshared_chunks(self, cursor, keys: Sequence[str], chunk_ids: set) -> List[str]:
+        """Chunk ids not also produced by a manifest entry other than keys"""
+        chunk_ids = sorted(chunk_ids)
+        keys = json.dumps(list(keys))
+        shared = set()
+        for start in range(0, len(chunk_ids), MIGRATION_BATCH_SIZE):
+            batch = chunk_ids[start:start + MIGRATION_BATCH_SIZE]
+            cursor.execute(f'''
+                SELECT DISTINCT j.value FROM file_manifest m, json_each(m.chunk_ids) j
+                WHERE m.source_file NOT IN (SELECT value FROM json_each(?))
+                AND j.value IN ({','.join('?' * len(batch))})
+            ''', [keys] + batch)
+            shared.update(row[0] for row in cursor.fetchall())
+        return [chunk_id for chunk_id in chunk_ids if chunk_id not in shared]
+    
+    def _delete_chunks(self, cursor, chunk_ids: Sequence[str]) -> List[Tuple[str, int]]:
+        """Delete chunks and their derived index entries inside the caller's
+        transaction; returns (shard, row) sidecar rows to pass to _after_delete()"""
+        chunk_ids = list(chunk_ids)
+        vec_rows = []
+        documents = set()
+        
+        for start in range(0, len(chunk_ids), MIGRATION_BATCH_SIZE):
+            batch = chunk_ids[start:start + MIGRATION_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(
+                f"SELECT rowid, shard, vec_row, doc_id, start_offset, end_offset FROM chunks "
+                f"WHERE id IN ({placeholders})", batch
+            )
+            rows = cursor.fetchall()
+            vec_rows.extend((row[1], row[2]) for row in rows if row[2] is not None)
+            documents.update(row[3] for row in rows if row[3] is not None)
+            if self._fts:
+                # A contentless index deletes by the text it indexed
+                texts = self._materialize(cursor, {row[0]: tuple(row[3:]) for row in rows})
+                cursor.executemany("INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', ?, ?)",
+                                   list(texts.items()))
+            cursor.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", batch)
+            cursor.execute(f"DELETE FROM ann_buckets WHERE chunk_id IN ({placeholders})", batch)
+            cursor.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            cursor.execute(f"DELETE FROM simhash_bands WHERE chunk_id IN ({placeholders})", batch)
+        
+        self._drop_orphan_documents(cursor, documents)
+        if self._sidecar is not None:
+            self._sidecar.tombstone(cursor, vec_rows)
+        
+        return vec_rows
+    
+    def _after_delete(self, chunk_ids: Sequence[str], vec_rows: List[Tuple[str, int]]) -> None:
+        """Post-commit half of _delete_chunks"""
+        if self._sidecar is not None:
+            self._sidecar.erase(vec_rows)
+        with self._index_lock:
+            if self._index is not None:
+                self._index.remove(chunk_ids)
+    
+    def _purge_missing(self, dir_path: Path) -> int:
+        """Remove manifest entries (and their chunks) for deleted files under a directory"""
+        prefix = str(dir_path.resolve()).rstrip(os.sep) + os.sep
+        
+        with self._ingest_session() as writer:
+            cursor = writer.cursor
+            cursor.execute(
+                "SELECT source_file, chunk_ids FROM file_manifest WHERE substr(source_file, 1, ?) = ?",
+                (len(prefix), prefix)
+            )
+            missing = [(key, json.loads(ids)) for key, ids in cursor.fetchall() if not os.path.exists(key)]
+            
+            for key, chunk_ids in missing:
+                cursor.execute("DELETE FROM file_manifest WHERE source_file = ?", (key,))
+                writer.delete(self._unshared_chunks(cursor, [key], set(chunk_ids)))
+        
+        return len(missing)
+    
+    def add_directory(self, dir_path: str, pattern: str = "*.md",
+                      workers: Optional[int] = None) -> List[str]:
+        """Add all files in a directory matching pattern
+        
+        Unchanged files are skipped, changed files replaced, and files that
+        disappeared since the last ingest are purged; see self.ingest_report.
+        With workers > 1, files are read, chunked and embedded by a process
+        pool while this process remains the single writer.
+        """
+        if workers is None:
+            workers = self.config["ingest_workers"]
+        
+        path = Path(dir_path)
+        
+        if not path.exists():
+            path = self.storage_path.parent.parent / dir_path
+        
+        if not path.exists():
+            raise FileNotFoundError(f"Directory not found: {dir_path}")
+        
+        self.ingest_report = self._new_ingest_report()
+        all_chunk_ids = []
+        
+        with self._ingest_session():
+            if workers > 1:
+                all_chunk_ids = self._add_files_parallel(path.rglob(pattern), workers)
+            else:
+                for file_path in path.rglob(pattern):
+                    try:
+                        chunk_ids = self.add_file(str(file_path))
+                        all_chunk_ids.extend(chunk_ids)
+                    except Exception as e:
+                        print(f"Error processing {file_path}: {e}", file=sys.stderr)
+            
+            with self.metrics.stage("ingest.purge"):
+                self.ingest_report["removed"] += self._purge_missing(path)
+        
+        return all_chunk_ids
+    
+    def _add_files_parallel(self, files, workers: int) -> List[str]:
+        """Pipeline ingest: a process pool prepares files, this process writes
+        
+        At most 2 * workers files are in flight, which bounds the prepared
+        results waiting for the writer. Embeddings come back as packed
+        float32 so results stay compact.
+        """
+        all_chunk_ids = []
+        in_flight = {}
+        max_in_flight = 2 * workers
+        files = iter(files)
+        
+        with self._ingest_session() as writer, ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_pipeline_worker, initargs=(self.config,)) as pool:
+            
+            def submit_next() -> bool:
+                for file_path in files:
+                    try:
+                        key = str(file_path.resolve())
+                        stat = file_path.stat()
+                        entry = self._get_manifest(writer.cursor, key)
+                    except Exception as e:
+                        print(f"Error processing {file_path}: {e}", file=sys.stderr)
+                        continue
+                    
+                    if self._manifest_unchanged(entry, stat):
+                        self.ingest_report["skipped"] += 1
+                        all_chunk_ids.extend(entry["chunk_ids"])
+                        continue
+                    
+                    if stat.st_size > self.config["stream_threshold_bytes"]:
+                        # Large files stream through the writer instead of a worker
+                        try:
+                            all_chunk_ids.extend(self._stream_file(writer, file_path, key, stat, entry))
+                        except Exception as e:
+                            print(f"Error processing {file_path}: {e}", file=sys.stderr)
+                        continue
+                    
+                    future = pool.submit(_pipeline_prepare, str(file_path),
+                                         entry["content_hash"] if entry else None)
+                    in_flight[future] = (file_path, key, stat, entry)
+                    return True
+                return False
+            
+            while len(in_flight) < max_in_flight and submit_next():
+                pass
+            
+            while in_flight:
+                with self.metrics.stage("ingest.wait"):
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path, key, stat, entry = in_flight.pop(future)
+                    try:
+                        prepared = future.result()
+                        self.metrics.count("files_read")
+                        self.metrics.count("bytes_read", stat.st_size)
+                        if prepared["chunks"] is not None:
+                            prepared["embeddings"] = self._unpack_embeddings(prepared["embeddings"])
+                        all_chunk_ids.extend(self._store_prepared(writer, key, stat, entry, prepared))
+                    except Exception as e:
+                        print(f"Error processing {file_path}: {e}", file=sys.stderr)
+                    submit_next()
+        
+        return all_chunk_ids
+    
+    def _unpack_embeddings(self, blob: bytes):
+        """Split a packed float32 batch back into per-chunk vectors"""
+        dim = self.config["embedding_dim"]
+        flat = self._decode_embedding(blob)
+        if HAS_NUMPY:
+            return flat.reshape(-1, dim)
+        return [flat[i:i + dim] for i in range(0, len(flat), dim)]
+    
+    def search(self, query: str, top_k: int = 5, 
+               threshold: float = None,
+               content_type: Optional[str] = None,
+               mode: Optional[str] = None,
+               probes: Optional[int] = None,
+               filters: Optional[Dict[str, Any]] = None,
+               collapse: bool = False) -> List[Dict[str, Any]]:
+        """Search for similar chunks
+        
+        mode is "exact" (brute-force scan), "ann" (LSH candidates re-scored
+        exactly), "sparse" (inverted index over non-zero dimensions) or
+        "hybrid" (BM25 candidates re-ranked by fused cosine/BM25 score). ann
+        falls back to exact when no index has been built or the probed buckets
+        hold fewer than top_k chunks; hybrid when no chunk shares a word with
+        the query.
+        
+        filters narrows the candidates in SQL before any scoring; see
+        _filter_clause() for the supported keys. Scoring reads only ids and
+        embeddings, and text/metadata are loaded for the winners alone.
+        
+        collapse drops hits that are SimHash near-duplicates of a better hit
+        (within dedup_threshold), scoring extra candidates to refill top_k.
+        
+        Results are cached per store generation, so a repeated query is
+        answered without scoring until the next write.
+        """
+        return self.search_many([query], top_k, threshold, content_type, mode, probes, filters, collapse)[0]
+    
+    def search_many(self, queries: Sequence[str], top_k: int = 5,
+                    threshold: float = None,
+                    content_type: Optional[str] = None,
+                    mode: Optional[str] = None,
+                    probes: Optional[int] = None,
+                    filters: Optional[Dict[str, Any]] = None,
+                    collapse: bool = False) -> List[List[Dict[str, Any]]]:
+        """search() for a batch of queries sharing the same options
+        
+        Queries are embedded together, filters are resolved once, and in exact
+        mode the store is scored in a single pass for all of them (one
+        (Q, dim) x (dim, N) product per block with NumPy). Winners of every
+        query are hydrated with one lookup. Returns one result list per query.
+        """
+        if threshold is None:
+            threshold = self.config["search_threshold"]
+        mode = mode or self.config["search_mode"]
+        if mode not in ("exact", "ann", "sparse", "hybrid"):
+            raise ValueError(f"Unknown search mode: {mode}")
+        if collapse:
+            self._ensure_simhash()
+        if mode == "sparse" and threshold > 0:
+            self._ensure_postings()
+        
+        # One read transaction: filters, scores and hydrated rows all come from the same commit
+        with self._connections.snapshot():
+            results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+            cache_keys: List[Optional[str]] = [None] * len(queries)
+            if self._query_cache is not None:
+                with self.metrics.stage("search.cache"):
+                    generation = self._sync_generation()
+                    for i, query in enumerate(queries):
+                        cache_keys[i] = QueryCache.key(query, top_k, threshold, content_type, mode, probes, filters,
+                                                       collapse)
+                        results[i] = self._query_cache.get(generation, cache_keys[i])
+            
+            pending = [i for i, result in enumerate(results) if result is None]
+            if not pending:
+                return results
+            
+            # Generate query embeddings
+            with self.metrics.stage("search.embed"):
+                embeddings = self.embed_many([queries[i] for i in pending])
+            hits: List[Optional[List[Tuple[str, float]]]] = [None] * len(pending)
+            
+            wanted = top_k
+            if collapse:
+                top_k *= COLLAPSE_OVERFETCH
+            
+            if mode == "hybrid":
+                # Filters become part of the full-text query itself
+                with self.metrics.stage("search.score"):
+                    for j, i in enumerate(pending):
+                        hits[j] = self._hybrid_hits(queries[i], embeddings[j], top_k, threshold,
+                                                    content_type, filters)
+            
+            if any(h is None for h in hits):
+                allowed_ids = None
+                if filters and not (mode == "exact" and self._shards_cover(content_type, filters)):
+                    with self.metrics.stage("search.filter"):
+                        allowed_ids = self._filtered_ids(content_type, filters)
+                
+                with self.metrics.stage("search.score"):
+                    self._score_pending(embeddings, hits, top_k, threshold, content_type, probes,
+                                        mode, allowed_ids, filters)
+            
+            if collapse:
+                with self.metrics.stage("search.collapse"):
+                    hits = self._collapse_hits(hits, wanted)
+            
+            for i, found in zip(pending, self._fetch_many(hits)):
+                results[i] = found
+                if cache_keys[i] is not None:
+                    self._query_cache.put(generation, cache_keys[i], found)
+            return results
+    
+    def _score_pending(self, embeddings: Sequence[Any], hits: List[Optional[List[Tuple[str, float]]]],
+                       top_k: int, threshold: float, content_type: Optional[str], probes: Optional[int],
+                       mode: str, allowed_ids: Optional[List[str]],
+                       filters: Optional[Dict[str, Any]] = None) -> None:
+        """Fill the unset entries of hits, batching whatever ends up exact"""
+        for j in range(len(hits)):
+            if hits[j] is not None:
+                continue
+            if allowed_ids is not None and not allowed_ids:
+                hits[j] = []
+            elif mode == "ann":
+                hits[j] = self._ann_hits(embeddings[j], top_k, threshold, content_type, probes,
+                                         allowed_ids=allowed_ids)
+            elif mode == "sparse":
+                hits[j] = self._sparse_hits(embeddings[j], top_k, threshold, content_type, allowed_ids)
+        
+        exact = [j for j, h in enumerate(hits) if h is None]
+        if exact:
+            batch = self._exact_hits_many([embeddings[j] for j in exact], top_k, threshold,
+                                          content_type, allowed_ids, filters)
+            for j, found in zip(exact, batch):
+                hits[j] = found
+    
+    def _exact_hits(self, query_embedding, top_k: int, threshold: float,
+                    content_type: Optional[str] = None,
+                    allowed_ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """Brute-force scoring over every stored embedding (or the allowed ones)"""
+        return self._exact_hits_many([query_embedding], top_k, threshold, content_type, allowed_ids)[0]
+    
+    def _exact_hits_many(self, query_embeddings: Sequence[Any], top_k: int, threshold: float,
+                         content_type: Optional[str] = None,
+                         allowed_ids: Optional[List[str]] = None,
+                         filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[str, float]]]:
+        """_exact_hits() for several queries in one pass over the vectors
+        
+        filters, when given alongside allowed_ids, only prune sidecar shards.
+        """
+        use_sidecar = self._sidecar is not None and HAS_NUMPY and not self.config["resident_index"]
+        
+        if allowed_ids is not None and self._index is None:
+            # A selective filter is cheaper to score straight from SQL than the shards it leaves
+            conn = self._connections.reader()
+            cursor = conn.cursor()
+            scanned = 0
+            if use_sidecar:
+                plan, _ = self._sidecar.plan(cursor, content_type, filters)
+                scanned = sum(rows for _, rows, _ in plan)
+            if not use_sidecar or len(allowed_ids) * FILTER_SCAN_RATIO <= scanned:
+                index = self._candidate_index(cursor, allowed_ids)
+                return index.search_many(query_embeddings, top_k, threshold)
+        
+        if use_sidecar:
+            return self._scan_sidecar(query_embeddings, top_k, threshold, content_type, allowed_ids, filters)
+        # Commits patch the resident index in place, so scoring it excludes them
+        with self._index_lock:
+            index = self._get_index()
+            self.metrics.count("rows_scanned", len(index))
+            return index.search_many(query_embeddings, top_k, threshold, content_type, allowed_ids,
+                                     self.config["scan_block_rows"])
+    
+    @staticmethod
+    def _metadata_expr(key: str) -> str:
+        """SQL expression for a metadata key, as used by its expression index"""
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*', key):
+            raise ValueError(f"Unsupported metadata key: {key!r}")
+        return f"json_extract(metadata, '$.{key}')"
+    
+    @staticmethod
+    def _time_bound(value: str, upper: bool) -> Tuple[str, str]:
+        """Comparison operator and ISO timestamp for a since/until value
+        
+        Accepts ISO dates/timestamps or a relative age such as 7d, 12h, 30m.
+        A bare date used as an upper bound includes that whole day.
+        """
+        value = value.strip()
+        match = re.fullmatch(r'(\d+)([dhm])', value)
+        if match:
+            unit = {"d": "days", "h": "hours", "m": "minutes"}[match.group(2)]
+            moment = datetime.now() - timedelta(**{unit: int(match.group(1))})
+            return ("<=" if upper else ">="), moment.isoformat()
+        
+        moment = datetime.fromisoformat(value)
+        if upper and len(value) == 10:
+            return "<", (moment + timedelta(days=1)).isoformat()
+        return ("<=" if upper else ">="), moment.isoformat()
+    
+    @staticmethod
+    def _source_clause(source: str, glob: bool = False) -> Tuple[str, List[Any]]:
+        """SQL matching source_file to a file or directory path, or to a GLOB pattern
+        
+        A path matches itself and anything below it, never a sibling that
+        merely shares its prefix, and any * ? [ in it are literal. Either is
+        tried as given and resolved, since chunks keep the path their file
+        was ingested under and the manifest its resolved path.
+        """
+        conditions = []
+        params: List[Any] = []
+        for path in dict.fromkeys([str(Path(source)), str(Path(source).resolve())]):
+            if glob:
+                conditions.append("source_file GLOB ?")
+                params.append(path)
+                continue
+            below = re.sub(r'[*?[]', lambda m: f"[{m.group()}]", path.rstrip(os.sep)) + os.sep + "*"
+            conditions.append("source_file = ? OR source_file GLOB ?")
+            params.extend([path, below])
+        return "(" + " OR ".join(conditions) + ")", params
+    
+    def _filter_clause(self, content_type: Optional[str],
+                       filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        """WHERE clause over chunks for a content type plus search filters
+        
+        filters keys:
+            source: file or directory path (see _source_clause)
+            source_glob: GLOB pattern over source_file
+            since / until: created_at bounds (see _time_bound)
+            where: {metadata key: value} equality via json_extract
+        """
+        filters = filters or {}
+        conditions = []
+        params: List[Any] = []
+        
+        if content_type:
+            conditions.append("content_type = ?")
+            params.append(content_type)
+        
+        for key, glob in (("source", False), ("source_glob", True)):
+            if filters.get(key):
+                condition, source_params = self._source_clause(filters[key], glob)
+                conditions.append(condition)
+                params.extend(source_params)
+        
+        for name, upper in (("since", False), ("until", True)):
+            if filters.get(name):
+                op, bound = self._time_bound(filters[name], upper)
+                conditions.append(f"created_at {op} ?")
+                params.append(bound)
+        
+        for key, value in (filters.get("where") or {}).items():
+            conditions.append(f"{self._metadata_expr(key)} = ?")
+            params.append(value)
+        
+        return " AND ".join(conditions) or "1", params
+    
+    def _shards_cover(self, content_type: Optional[str], filters: Dict[str, Any]) -> bool:
+        """True when the sidecar shards settle content_type and filters alone
+        
+        That takes since/until as the only filters and every shard they leave
+        lying wholly inside them; exact search then scans those shards without
+        resolving the filters to chunk ids.
+        """
+        if (self._sidecar is None or not HAS_NUMPY or self.config["resident_index"]
+                or {key for key, value in filters.items() if value} - {"since", "until"}):
+            return False
+        
+        conn = self._connections.reader()
+        _, covered = self._sidecar.plan(conn.cursor(), content_type, filters)
+        return covered
+    
+    def _filtered_ids(self, content_type: Optional[str], filters: Dict[str, Any]) -> List[str]:
+        """Ids of the chunks passing content_type and filters"""
+        clause, params = self._filter_clause(content_type, filters)
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id FROM chunks WHERE {clause}", params)
+        ids = [row[0] for row in cursor.fetchall()]
+        return ids
+    
+    def _postings_rows(self, chunk_id: str, vector) -> List[Tuple[int, str, float]]:
+        """(dim, chunk_id, weight) rows for the non-zero entries of a vector"""
+        if HAS_NUMPY:
+            vector = np.asarray(vector)
+            return [(int(d), chunk_id, float(vector[d])) for d in np.flatnonzero(vector)]
+        return [(d, chunk_id, float(w)) for d, w in enumerate(vector) if w != 0.0]
+    
+    def build_sparse_index(self) -> int:
+        """(Re)build the postings table from the stored embeddings"""
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            indexed = self._build_postings(cursor)
+        return indexed
+    
+    def _ensure_postings(self) -> None:
+        """Build the postings table on first use; add_chunk keeps it current afterwards"""
+        if self._get_meta(self._connections.reader().cursor(), "postings_built") == "1":
+            return
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            # Another writer may have built it while we waited for the lock
+            if self._get_meta(cursor, "postings_built") != "1":
+                self._build_postings(cursor)
+    
+    def _build_postings(self, cursor) -> int:
+        cursor.execute("DELETE FROM postings")
+        
+        reader = cursor.connection.cursor()
+        reader.execute("SELECT id, embedding_vector FROM chunks")
+        indexed = 0
+        while True:
+            batch = reader.fetchmany(MIGRATION_BATCH_SIZE)
+            if not batch:
+                break
+            cursor.executemany(
+                "INSERT INTO postings (dim, chunk_id, weight) VALUES (?, ?, ?)",
+                [row for chunk_id, blob in batch
+                 for row in self._postings_rows(chunk_id, self._decode_embedding(blob))]
+            )
+            indexed += len(batch)
+        
+        self._set_meta(cursor, "postings_built", 1)
+        return indexed
+    
+    def _sparse_hits(self, query_embedding, top_k: int, threshold: float,
+                     content_type: Optional[str] = None,
+                     allowed_ids: Optional[List[str]] = None) -> Optional[List[Tuple[str, float]]]:
+        """Accumulate exact dot products from the postings of the query's non-zero dims
+        
+        Stored embeddings are unit length, so this is the same cosine score
+        the dense scan computes. Chunks sharing no dimension with the query
+        score 0 and are never visited, so a non-positive threshold falls back
+        to the dense path. The postings table is built on first use (see
+        _ensure_postings) and kept up to date by add_chunk afterwards.
+        """
+        if threshold <= 0 or top_k <= 0:
+            return None
+        
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        if self._get_meta(cursor, "postings_built") != "1":
+            # search_many builds it before taking its snapshot; without it, scan densely
+            return None
+        
+        norm = math.sqrt(sum(float(x) * float(x) for x in query_embedding))
+        weights = {d: float(w) / norm for d, w in enumerate(query_embedding) if w != 0.0} if norm > 0 else {}
+        
+        scores: Dict[str, float] = {}
+        dims = list(weights)
+        scanned = 0
+        for start in range(0, len(dims), MIGRATION_BATCH_SIZE):
+            batch = dims[start:start + MIGRATION_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            if content_type:
+                cursor.execute(
+                    f"SELECT p.dim, p.chunk_id, p.weight FROM postings p JOIN chunks c ON c.id = p.chunk_id "
+                    f"WHERE p.dim IN ({placeholders}) AND c.content_type = ?",
+                    batch + [content_type]
+                )
+            else:
+                cursor.execute(
+                    f"SELECT dim, chunk_id, weight FROM postings WHERE dim IN ({placeholders})", batch
+                )
+            postings = cursor.fetchall()
+            scanned += len(postings)
+            for dim, chunk_id, weight in postings:
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weight * weights[dim]
+        self.metrics.count("rows_scanned", scanned)
+        
+        allowed = set(allowed_ids) if allowed_ids is not None else None
+        best = heapq.nlargest(top_k, ((score, chunk_id) for chunk_id, score in scores.items()
+                                      if score >= threshold and (allowed is None or chunk_id in allowed)),
+                              key=lambda item: item[0])
+        return [(chunk_id, score) for score, chunk_id in best]
+    
+    @staticmethod
+    def _fts_query(query: str) -> Optional[str]:
+        """FTS5 MATCH expression ORing the query's words, or None if it has none"""
+        terms = list(dict.fromkeys(re.findall(r'\w+', query.lower())))
+        if not terms:
+            return None
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+    
+    def _hybrid_hits(self, query: str, query_embedding, top_k: int, threshold: float,
+                     content_type: Optional[str] = None,
+                     filters: Optional[Dict[str, Any]] = None) -> Optional[List[Tuple[str, float, float]]]:
+        """BM25 candidate set re-ranked by cosine; None means fall back
+        
+        At most hybrid_candidates chunks sharing a word with the query are
+        scored, so cost follows the matching postings rather than the corpus.
+        Hits are (chunk_id, cosine, fused score), ranked by the fused score
+        hybrid_alpha * cosine + (1 - hybrid_alpha) * BM25 normalized to
+        (0, 1] over the candidates; threshold applies to the cosine.
+        """
+        match = self._fts_query(query)
+        if not self._fts or match is None or top_k <= 0:
+            return None
+        
+        clause, params = self._filter_clause(content_type, filters)
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT c.id, -bm25(chunks_fts) FROM chunks_fts
+            JOIN chunks c ON c.rowid = chunks_fts.rowid
+            WHERE chunks_fts MATCH ? AND {clause}
+            ORDER BY bm25(chunks_fts) LIMIT ?
+        ''', [match] + params + [self.config["hybrid_candidates"]])
+        lexical = dict(cursor.fetchall())
+        if not lexical:
+            return None
+        
+        cosine = self._score_candidates(cursor, query_embedding, list(lexical), len(lexical), threshold)
+        
+        alpha = self.config["hybrid_alpha"]
+        top_lexical = max(lexical.values()) or 1.0
+        fused = [(alpha * score + (1 - alpha) * lexical[chunk_id] / top_lexical, chunk_id, score)
+                 for chunk_id, score in cosine]
+        best = heapq.nlargest(top_k, fused, key=lambda item: item[0])
+        return [(chunk_id, score, fused_score) for fused_score, chunk_id, score in best]
+    
+    def _get_lsh(self, cursor) -> Optional[LSHIndex]:
+        """The ANN index described in store_meta, or None if it was never built"""
+        if self._get_meta(cursor, "ann_built") != "1":
+            return None
+        
+        params = tuple(int(self._get_meta(cursor, key)) for key in ("ann_tables", "ann_bits", "ann_seed"))
+        if self._lsh is None or (self._lsh.tables, self._lsh.bits, self._lsh.seed) != params:
+            self._lsh = LSHIndex(self.config["embedding_dim"], *params)
+        return self._lsh
+    
+    def build_ann_index(self, tables: Optional[int] = None, bits: Optional[int] = None,
+                        seed: int = 0) -> int:
+        """(Re)build the LSH index over all stored embeddings"""
+        tables = tables or self.config["ann_tables"]
+        bits = bits or self.config["ann_bits"]
+        if not 0 < bits <= 62:
+            raise ValueError("ann bits must be between 1 and 62")
+        
+        lsh = LSHIndex(self.config["embedding_dim"], tables, bits, seed)
+        
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM ann_buckets")
+            
+            reader = conn.cursor()
+            reader.execute("SELECT id, embedding_vector FROM chunks")
+            indexed = 0
+            while True:
+                batch = reader.fetchmany(MIGRATION_BATCH_SIZE)
+                if not batch:
+                    break
+                keys = lsh.keys_many([self._decode_embedding(blob) for _, blob in batch])
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO ann_buckets (table_no, bucket, chunk_id) VALUES (?, ?, ?)",
+                    [(t, key, chunk_id) for (chunk_id, _), row in zip(batch, keys) for t, key in enumerate(row)]
+                )
+                indexed += len(batch)
+            
+            self._set_meta(cursor, "ann_tables", tables)
+            self._set_meta(cursor, "ann_bits", bits)
+            self._set_meta(cursor, "ann_seed", seed)
+            self._set_meta(cursor, "ann_built", 1)
+        
+        self._lsh = lsh
+        return indexed
+    
+    def _ann_candidates(self, cursor, lsh: LSHIndex, query_embedding, probes: int,
+                        tables: Optional[int] = None) -> List[str]:
+        """Chunk ids sharing a probed bucket with the query"""
+        candidates = set()
+        for table_no, keys in lsh.probe(query_embedding, probes, tables):
+            placeholders = ','.join('?' * len(keys))
+            cursor.execute(
+                f"SELECT chunk_id FROM ann_buckets WHERE table_no = ? AND bucket IN ({placeholders})",
+                [table_no] + keys
+            )
+            candidates.update(row[0] for row in cursor.fetchall())
+        return sorted(candidates)
+    
+    def _ann_hits(self, query_embedding, top_k: int, threshold: float,
+                  content_type: Optional[str] = None, probes: Optional[int] = None,
+                  tables: Optional[int] = None,
+                  allowed_ids: Optional[List[str]] = None) -> Optional[List[Tuple[str, float]]]:
+        """LSH candidate generation plus exact re-scoring; None means fall back"""
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        
+        lsh = self._get_lsh(cursor)
+        if lsh is None:
+            return None
+        
+        if probes is None:
+            probes = self.config["ann_probes"]
+        candidates = self._ann_candidates(cursor, lsh, query_embedding, probes, tables)
+        if allowed_ids is not None:
+            allowed = set(allowed_ids)
+            candidates = [chunk_id for chunk_id in candidates if chunk_id in allowed]
+        if len(candidates) < top_k:
+            return None
+        
+        hits = self._score_candidates(cursor, query_embedding, candidates, top_k, threshold, content_type)
+        return hits
+    
+    def _score_candidates(self, cursor, query_embedding, chunk_ids: List[str], top_k: int,
+                          threshold: float, content_type: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Exact cosine scores for a candidate subset, best first"""
+        return self._candidate_index(cursor, chunk_ids, content_type).search(query_embedding, top_k, threshold)
+    
+    def _candidate_index(self, cursor, chunk_ids: List[str],
+                         content_type: Optional[str] = None) -> VectorIndex:
+        """A temporary VectorIndex over just the given chunks"""
+        index = VectorIndex(self.config["embedding_dim"])
+        rows = []
+        for start in range(0, len(chunk_ids), MIGRATION_BATCH_SIZE):
+            batch = chunk_ids[start:start + MIGRATION_BATCH_SIZE]
+            sql = (f"SELECT id, content_type, embedding_vector FROM chunks "
+                   f"WHERE id IN ({','.join('?' * len(batch))})")
+            params = list(batch)
+            if content_type:
+                sql += " AND content_type = ?"
+                params.append(content_type)
+            cursor.execute(sql, params)
+            rows.extend((chunk_id, ct, self._decode_embedding(blob)) for chunk_id, ct, blob in cursor.fetchall())
+        
+        self.metrics.count("rows_scanned", len(rows))
+        self.metrics.count("bytes_decoded", len(rows) * self.config["embedding_dim"] * 4)
+        index.load(rows)
+        return index
+    
+    def ann_recall_report(self, queries: int = 50, top_k: int = 10,
+                          probe_settings: Sequence[int] = (0, 1, 2, 4),
+                          seed: int = 0) -> List[Dict[str, Any]]:
+        """Recall@k of the ANN index against exact search for sampled queries
+        
+        Queries are the opening words of randomly chosen stored chunks. Each
+        row covers one (tables, probes) setting, using the first `tables`
+        tables of the built index.
+        """
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        lsh = self._get_lsh(cursor)
+        if lsh is None:
+            raise RuntimeError("ANN index not built; run `rag-memory ann build` first")
+        
+        cursor.execute("SELECT doc_id, start_offset, end_offset FROM chunks ORDER BY rowid")
+        spans = cursor.fetchall()
+        rng = random.Random(seed)
+        picked = self._materialize(cursor, dict(enumerate(rng.sample(spans, min(queries, len(spans))))))
+        sample = [self._first_words(picked[i], 8) for i in range(len(picked))]
+        threshold = self.config["search_threshold"]
+        
+        embedded = []
+        for text in sample:
+            embedding = self._generate_embedding(text)
+            exact = {chunk_id for chunk_id, _ in self._exact_hits(embedding, top_k, threshold)}
+            embedded.append((embedding, exact))
+        
+        table_settings = sorted({max(1, lsh.tables // 4), max(1, lsh.tables // 2), lsh.tables})
+        report = []
+        for tables in table_settings:
+            for probes in probe_settings:
+                recall = candidates = elapsed = 0.0
+                for embedding, exact in embedded:
+                    started = time.perf_counter()
+                    ids = self._ann_candidates(cursor, lsh, embedding, probes, tables)
+                    hits = self._score_candidates(cursor, embedding, ids, top_k, threshold)
+                    elapsed += time.perf_counter() - started
+                    candidates += len(ids)
+                    recall += len(exact & {chunk_id for chunk_id, _ in hits}) / len(exact) if exact else 1.0
+                n = max(1, len(embedded))
+                report.append({
+                    "tables": tables,
+                    "probes": probes,
+                    "recall": recall / n,
+                    "avg_candidates": candidates / n,
+                    "avg_ms": elapsed * 1000 / n
+                })
+        
+        return report
+    
+    def _simhash(self, text: str) -> int:
+        """64-bit SimHash of text, as a signed integer so SQLite can store it
+        
+        Every SIMHASH_SHINGLE-word shingle of the lowercased text is hashed
+        with blake2b and a bit is set when most shingle hashes set it, so
+        texts sharing most of their shingles differ in few bits.
+        """
+        words = text.lower().split()
+        span = min(SIMHASH_SHINGLE, max(1, len(words)))
+        hashes = [int.from_bytes(hashlib.blake2b(' '.join(words[i:i + span]).encode(), digest_size=8).digest(),
+                                 'little')
+                  for i in range(max(1, len(words) - span + 1))]
+        
+        if HAS_NUMPY:
+            bits = (np.array(hashes, dtype=np.uint64)[:, np.newaxis] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+            counts = bits.sum(axis=0).tolist()
+        else:
+            counts = [sum((h >> bit) & 1 for h in hashes) for bit in range(64)]
+        
+        value = sum(1 << bit for bit, count in enumerate(counts) if 2 * count > len(hashes))
+        return value - (1 << 64) if value >= 1 << 63 else value
+    
+    def _dedup_max_distance(self) -> int:
+        """Largest SimHash bit distance that still counts as a near-duplicate"""
+        return int((1 - self.config["dedup_threshold"]) * 64 + 1e-9)
+    
+    def _simhash_band_count(self, cursor) -> int:
+        return int(self._get_meta(cursor, "simhash_bands", str(self.config["dedup_bands"])))
+    
+    def _build_simhash(self, cursor) -> int:
+        cursor.execute("DELETE FROM simhash_bands")
+        bands = self.config["dedup_bands"]
+        if not 0 < bands <= 64:
+            raise ValueError("dedup_bands must be between 1 and 64")
+        
+        indexed = 0
+        for batch in self._iter_chunk_texts(cursor):
+            values = [(self._simhash(text), chunk_id) for _, chunk_id, text in batch]
+            cursor.executemany("UPDATE chunks SET simhash = ? WHERE id = ?", values)
+            cursor.executemany(
+                "INSERT OR IGNORE INTO simhash_bands (band, value, chunk_id) VALUES (?, ?, ?)",
+                [(band, key, chunk_id) for value, chunk_id in values for band, key in _simhash_bands(value, bands)]
+            )
+            indexed += len(batch)
+        
+        self._set_meta(cursor, "simhash_bands", bands)
+        self._set_meta(cursor, "simhash_built", 1)
+        return indexed
+    
+    def build_dedup_index(self) -> int:
+        """(Re)compute SimHashes and the banded lookup table for all chunks"""
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            indexed = self._build_simhash(cursor)
+        return indexed
+    
+    def _ensure_simhash(self) -> None:
+        """Build the SimHash index on first use; add_chunk keeps it current afterwards"""
+        conn = self._connections.reader()
+        built = self._get_meta(conn.cursor(), "simhash_built") == "1"
+        if not built:
+            self.build_dedup_index()
+    
+    def _near_duplicate_of(self, cursor, value: int, bands: int, exclude_id: str,
+                           pending: Dict[Tuple[int, int], List[Tuple[str, int]]]) -> Optional[Tuple[str, float]]:
+        """Closest stored (or pending) chunk within the dedup distance, with its similarity
+        
+        Candidates share at least one band with value, which by pigeonhole
+        includes every chunk within bands - 1 differing bits.
+        """
+        keys = _simhash_bands(value, bands)
+        candidates = {}
+        for key in keys:
+            candidates.update(pending.get(key, ()))
+        cursor.execute(
+            "SELECT s.chunk_id, c.simhash FROM simhash_bands s JOIN chunks c ON c.id = s.chunk_id WHERE "
+            + " OR ".join("(s.band = ? AND s.value = ?)" for _ in keys),
+            [part for key in keys for part in key]
+        )
+        candidates.update(cursor.fetchall())
+        candidates.pop(exclude_id, None)
+        
+        best = min(((_hamming64(value, other), chunk_id) for chunk_id, other in candidates.items()
+                    if other is not None), default=None)
+        if best is None or best[0] > self._dedup_max_distance():
+            return None
+        return best[1], 1 - best[0] / 64
+    
+    def _vector_footprint(self) -> int:
+        """Bytes of one chunk's stored vector copies (table blob plus sidecar row)"""
+        vector_bytes = self.config["embedding_dim"] * 4
+        if self._sidecar is not None:
+            vector_bytes += self._sidecar.row_bytes + VectorSidecar.ID_SIZE
+        return vector_bytes
+    
+    def _chunk_footprint(self, metadata: Dict[str, Any]) -> int:
+        """Approximate bytes a chunk row occupies: metadata and its vectors
+        
+        Its text is a span of its source document, which is stored either way.
+        """
+        return len(json.dumps(metadata)) + self._vector_footprint()
+    
+    def _collapse_hits(self, hit_lists: List[List[Tuple[str, float]]],
+                       top_k: int) -> List[List[Tuple[str, float]]]:
+        """Drop hits that are near-duplicates of a better hit, keeping top_k"""
+        chunk_ids = list({hit[0] for hits in hit_lists for hit in hits})
+        hashes = {}
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        for start in range(0, len(chunk_ids), MIGRATION_BATCH_SIZE):
+            batch = chunk_ids[start:start + MIGRATION_BATCH_SIZE]
+            cursor.execute(f"SELECT id, simhash FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+            hashes.update(cursor.fetchall())
+        
+        limit = self._dedup_max_distance()
+        collapsed = []
+        for hits in hit_lists:
+            kept, kept_hashes = [], []
+            for hit in hits:
+                value = hashes.get(hit[0])
+                if value is not None and any(_hamming64(value, other) <= limit for other in kept_hashes):
+                    continue
+                kept.append(hit)
+                if value is not None:
+                    kept_hashes.append(value)
+                if len(kept) == top_k:
+                    break
+            collapsed.append(kept)
+        return collapsed
+    
+    def dedup_report(self) -> Dict[str, Any]:
+        """Space reclaimed by ingest-time deduplication, and near-duplicates still stored
+        
+        Stored chunks within the dedup distance of each other are grouped
+        into clusters; all but one chunk per cluster counts as reclaimable.
+        """
+        self._ensure_simhash()
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        bands = self._simhash_band_count(cursor)
+        limit = self._dedup_max_distance()
+        
+        cursor.execute('''
+            SELECT s.band, s.value, s.chunk_id, c.simhash FROM simhash_bands s
+            JOIN chunks c ON c.id = s.chunk_id
+            WHERE (s.band, s.value) IN
+                (SELECT band, value FROM simhash_bands GROUP BY band, value HAVING COUNT(*) > 1)
+            ORDER BY s.band, s.value
+        ''')
+        parent: Dict[str, str] = {}
         
-        # Determine metadata
-        metadata = {
-            "source_file": str(path),
-            "file_name": path.name,
-            "content_type": content_type
+        def find(chunk_id: str) -> str:
+            while parent.setdefault(chunk_id, chunk_id) != chunk_id:
+                parent[chunk_id] = parent[parent[chunk_id]]
+                chunk_id = parent[chunk_id]
+            return chunk_id
+        
+        for _, members in itertools.groupby(cursor.fetchall(), key=lambda row: (row[0], row[1])):
+            members = [(chunk_id, value) for _, _, chunk_id, value in members]
+            for i, (a, value_a) in enumerate(members):
+                for b, value_b in members[i + 1:]:
+                    if _hamming64(value_a, value_b) <= limit:
+                        parent[find(a)] = find(b)
+        
+        clusters: Dict[str, List[str]] = {}
+        for chunk_id in list(parent):
+            clusters.setdefault(find(chunk_id), []).append(chunk_id)
+        clusters = {root: ids for root, ids in clusters.items() if len(ids) > 1}
+        
+        reclaimable = duplicates = 0
+        vector_bytes = self._vector_footprint()
+        for ids in clusters.values():
+            placeholders = ','.join('?' * len(ids))
+            cursor.execute(
+                f"SELECT length(CAST(metadata AS BLOB)) FROM chunks "
+                f"WHERE id IN ({placeholders})", ids
+            )
+            sizes = sorted(row[0] + vector_bytes for row in cursor.fetchall())
+            reclaimable += sum(sizes[:-1])
+            duplicates += len(sizes) - 1
+        
+        cursor.execute("SELECT COUNT(*) FROM chunks")
+        total = cursor.fetchone()[0]
+        report = {
+            "mode": self.config["dedup_mode"],
+            "threshold": self.config["dedup_threshold"],
+            "max_distance": limit,
+            "bands": bands,
+            "chunks": total,
+            "skipped": int(self._get_meta(cursor, "dedup_skipped", "0")),
+            "reclaimed_bytes": int(self._get_meta(cursor, "dedup_reclaimed_bytes", "0")),
+            "stored_duplicates": duplicates,
+            "clusters": len(clusters),
+            "reclaimable_bytes": reclaimable
         }
+        return report
+    
+    def _scan_sidecar(self, query_embeddings: Sequence[Any], top_k: int, threshold: float,
+                      content_type: Optional[str] = None,
+                      allowed_ids: Optional[List[str]] = None,
+                      filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[str, float]]]:
+        """Stream the memory-mapped vectors instead of loading the table
         
-        # Check if it's a daily memory file
-        if 'memory' in str(path) and re.search(r'\d{4}-\d{2}-\d{2}', path.name):
-            metadata["content_type"] = "daily"
+        Only the shards content_type and filters can match are scanned (see
+        ShardedSidecar.plan), concurrently when there are several.
+        
+        Quantized rows only pick candidates: the best top_k * quantizer_rerank
+        by approximate score are re-scored from their full-precision
+        embeddings, and the threshold applies to those exact scores.
+        """
+        conn = self._connections.reader()
+        cursor = conn.cursor()
+        plan, covered = self._sidecar.plan(cursor, content_type, filters)
+        rows = sum(shard_rows for _, shard_rows, _ in plan)
+        
+        if allowed_ids is None and content_type and not covered:
+            cursor.execute("SELECT id FROM chunks WHERE content_type = ?", (content_type,))
+            allowed_ids = [row[0] for row in cursor.fetchall()]
         
-        return self.add_text(content, metadata)
+        self.metrics.count("shards_scanned", len(plan))
+        self.metrics.count("rows_scanned", rows)
+        self.metrics.count("bytes_decoded", rows * self._sidecar.row_bytes)
+        if self._sidecar.quantizer == "none":
+            return self._sidecar.scan_many(plan, query_embeddings, top_k, threshold, allowed_ids,
+                                           self.config["scan_block_rows"])
+        
+        approximate = self._sidecar.scan_many(plan, query_embeddings, top_k * self.config["quantizer_rerank"],
+                                              float("-inf"), allowed_ids, self.config["scan_block_rows"])
+        candidates = [[chunk_id for chunk_id, _ in hits] for hits in approximate]
+        index = self._candidate_index(cursor, sorted({chunk_id for ids in candidates for chunk_id in ids}))
+        self.metrics.count("rows_reranked", len(index))
+        return [index.search(query, top_k, threshold, allowed_ids=ids) if ids else []
+                for query, ids in zip(query_embeddings, candidates)]
     
-    def add_directory(self, dir_path: str, pattern: str = "*.md") -> List[str]:
-        """Add all files in a directory matching pattern"""
-        path = Path(dir_path)
+    def compact_vectors(self) -> int:
+        """Rewrite the vector sidecar without tombstoned rows"""
+        if self._sidecar is None:
+            return 0
         
-        if not path.exists():
-            path = self.storage_path.parent.parent / dir_path
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            rows = self._sidecar.rebuild(cursor)
+        return rows
+    
+    def shard_report(self) -> List[Dict[str, Any]]:
+        """Content type, created_at range, rows, size and frozen flag of every sidecar shard"""
+        if self._sidecar is None:
+            return []
         
-        if not path.exists():
-            raise FileNotFoundError(f"Directory not found: {dir_path}")
+        conn = self._connections.reader()
+        report = self._sidecar.report(conn.cursor())
+        return report
+    
+    def freeze_shards(self, names: Optional[Sequence[str]] = None,
+                      before: Optional[str] = None) -> List[str]:
+        """Freeze the named shards, or those whose newest chunk is older than before
         
-        all_chunk_ids = []
+        before takes the same values as the since/until filters. A frozen
+        shard is compacted and made read-only, and stays so until a write
+        touches it. Returns the names frozen.
+        """
+        if self._sidecar is None:
+            return []
         
-        for file_path in path.rglob(pattern):
-            try:
-                chunk_ids = self.add_file(str(file_path))
-                all_chunk_ids.extend(chunk_ids)
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}", file=sys.stderr)
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            conditions = ["frozen = 0"]
+            params: List[Any] = []
+            if names:
+                conditions.append(f"name IN ({','.join('?' * len(names))})")
+                params.extend(names)
+            if before:
+                _, bound = self._time_bound(before, upper=False)
+                conditions.append("last_created < ?")
+                params.append(bound)
+            cursor.execute(f"SELECT name FROM shards WHERE {' AND '.join(conditions)} ORDER BY name", params)
+            frozen = [row[0] for row in cursor.fetchall()]
+            for name in frozen:
+                self._sidecar.freeze(cursor, name)
+        return frozen
+    
+    def thaw_shards(self, names: Optional[Sequence[str]] = None) -> List[str]:
+        """Make frozen shards (all of them by default) writable again; returns the names thawed"""
+        if self._sidecar is None:
+            return []
         
-        return all_chunk_ids
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM shards WHERE frozen = 1 ORDER BY name")
+            thawed = [name for (name,) in cursor.fetchall() if not names or name in names]
+            for name in thawed:
+                self._sidecar.thaw(cursor, name)
+        return thawed
     
-    def search(self, query: str, top_k: int = 5, 
-               threshold: float = None,
-               content_type: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Search for similar chunks"""
-        if threshold is None:
-            threshold = self.config["search_threshold"]
+    def _get_index(self) -> VectorIndex:
+        """Return the resident index, loading it from the database if needed
         
-        # Generate query embedding
-        query_embedding = self._generate_embedding(query)
+        Callers hold _index_lock. The rows are read on a fresh connection,
+        not the caller's snapshot: a commit either lands before that read or
+        patches the index once the lock is free.
+        """
+        if self._index is None:
+            conn = self._connections.connect()
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, content_type, embedding_vector FROM chunks")
+            rows = [(chunk_id, ct, self._decode_embedding(blob))
+                    for chunk_id, ct, blob in cursor.fetchall()]
+            conn.close()
+            self.metrics.count("bytes_decoded", len(rows) * self.config["embedding_dim"] * 4)
+            
+            index = VectorIndex(self.config["embedding_dim"])
+            index.load(rows)
+            self._index = index
         
-        # Search database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return self._index
+    
+    def _fetch_results(self, hits: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+        """Load text and metadata for scored ids, preserving their order"""
+        return self._fetch_many([hits])[0]
+    
+    def _fetch_many(self, hit_lists: List[List[Tuple[str, float]]]) -> List[List[Dict[str, Any]]]:
+        """_fetch_results() for several hit lists, loading each chunk once
         
-        # Build query
-        sql = "SELECT id, text, embedding_vector, metadata, created_at, content_type FROM chunks"
-        params = []
+        A hit may carry a third element, the fused hybrid score, which is
+        returned as "score" next to the cosine "similarity".
+        """
+        chunk_ids = list({hit[0] for hits in hit_lists for hit in hits})
+        rows = {}
         
-        if content_type:
-            sql += " WHERE content_type = ?"
-            params.append(content_type)
+        texts = {}
         
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        conn.close()
+        if chunk_ids:
+            # One read transaction, so a concurrent ingest cannot move a span between the two reads
+            with self.metrics.stage("search.fetch"), self._connections.snapshot() as cursor:
+                for start in range(0, len(chunk_ids), MIGRATION_BATCH_SIZE):
+                    batch = chunk_ids[start:start + MIGRATION_BATCH_SIZE]
+                    cursor.execute(
+                        f"SELECT id, doc_id, start_offset, end_offset, metadata, created_at, content_type FROM chunks "
+                        f"WHERE id IN ({','.join('?' * len(batch))})", batch
+                    )
+                    rows.update((row[0], row) for row in cursor.fetchall())
+                texts = self._materialize(cursor, {chunk_id: row[1:4] for chunk_id, row in rows.items()})
         
-        # Calculate similarities
         results = []
-        for row in rows:
-            chunk_id, text, emb_blob, metadata_json, created_at, ct = row
-            embedding = json.loads(emb_blob)
-            
-            similarity = self._cosine_similarity(query_embedding, embedding)
-            
-            if similarity >= threshold:
-                results.append({
-                    "id": chunk_id,
-                    "text": text,
-                    "metadata": json.loads(metadata_json),
-                    "similarity": similarity,
-                    "created_at": created_at,
-                    "content_type": ct
-                })
+        decoded = 0
+        with self.metrics.stage("search.decode"):
+            for hits in hit_lists:
+                hydrated = []
+                for chunk_id, similarity, *fused in hits:
+                    if chunk_id not in rows:
+                        continue
+                    *_, metadata_json, created_at, ct = rows[chunk_id]
+                    decoded += len(metadata_json)
+                    result = {
+                        "id": chunk_id,
+                        "text": texts[chunk_id],
+                        "metadata": json.loads(metadata_json),
+                        "similarity": similarity,
+                        "created_at": created_at,
+                        "content_type": ct
+                    }
+                    if fused:
+                        result["score"] = fused[0]
+                    hydrated.append(result)
+                results.append(hydrated)
+        self.metrics.count("bytes_decoded", decoded)
         
-        # Sort by similarity descending and return top_k
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        return results[:top_k]
+        return results
     
     def retrieve(self, query: str, max_tokens: int = 4000,
                  include_scores: bool = False,
-                 content_type: Optional[str] = None) -> str:
+                 content_type: Optional[str] = None,
+                 filters: Optional[Dict[str, Any]] = None,
+                 collapse: bool = False) -> str:
         """Retrieve context formatted for LLM consumption"""
-        results = self.search(query, top_k=20, content_type=content_type)
+        results = self.search(query, top_k=20, content_type=content_type, filters=filters, collapse=collapse)
         
         context_parts = []
         total_tokens = 0
         
-        for result in results:
-            text = result["text"]
-            tokens = self._estimate_token_count(text)
-            
-            if total_tokens + tokens > max_tokens:
-                # Truncate if needed
-                remaining = max_tokens - total_tokens
-                if remaining > 50:
-                    text = ' '.join(text.split()[:remaining])
-                    context_parts.append(self._format_chunk(text, result, include_scores))
-                break
+        with self.metrics.stage("retrieve.format"):
+            for result in results:
+                text = result["text"]
+                tokens = self._estimate_token_count(text)
+                
+                if total_tokens + tokens > max_tokens:
+                    # Truncate if needed
+                    remaining = max_tokens - total_tokens
+                    if remaining > 50:
+                        text = self._first_words(text, remaining)
+                        context_parts.append(self._format_chunk(text, result, include_scores))
+                    break
+                
+                context_parts.append(self._format_chunk(text, result, include_scores))
+                total_tokens += tokens
             
-            context_parts.append(self._format_chunk(text, result, include_scores))
-            total_tokens += tokens
-        
-        return '\n\n'.join(context_parts)
+            return '\n\n'.join(context_parts)
+    
+    @staticmethod
+    def _first_words(text: str, count: int) -> str:
+        """' '.join(text.split()[:count]), without splitting the rest of the text"""
+        return ' '.join(match.group() for match in itertools.islice(_WORD.finditer(text), count))
     
     def _format_chunk(self, text: str, result: Dict[str, Any], 
                       include_scores: bool) -> str:
@@ -387,7 +4118,7 @@ class RAGMemory:
     
     def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the vector store"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connections.reader()
         cursor = conn.cursor()
         
         cursor.execute("SELECT COUNT(*) FROM chunks")
@@ -402,11 +4133,62 @@ class RAGMemory:
         cursor.execute("SELECT MAX(created_at) FROM chunks")
         last_ingest = cursor.fetchone()[0]
         
-        conn.close()
+        cursor.execute("SELECT COUNT(*), SUM(length) FROM documents")
+        documents, document_bytes = cursor.fetchone()
+        cursor.execute("SELECT SUM(end_offset - start_offset) FROM chunks")
+        span_bytes = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT SUM(LENGTH(body)) FROM document_blocks")
+        compressed_bytes = cursor.fetchone()[0] or 0
+        text_storage = {
+            "documents": documents,
+            "text_bytes": document_bytes or 0,
+            "chunk_span_bytes": span_bytes,
+            "compressed_bytes": compressed_bytes
+        }
+        
+        dedup = {
+            "mode": self.config["dedup_mode"],
+            "skipped": int(self._get_meta(cursor, "dedup_skipped", "0")),
+            "reclaimed_bytes": int(self._get_meta(cursor, "dedup_reclaimed_bytes", "0"))
+        }
+        
+        page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+        free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = cursor.execute("PRAGMA auto_vacuum").fetchone()[0]
+        wal_path = self.db_path.with_name(self.db_path.name + "-wal")
+        reclaimable = {
+            "free_page_bytes": free_pages * page_size,
+            "sidecar_tombstone_bytes": self._sidecar.tombstone_bytes(cursor) if self._sidecar is not None else 0,
+            "wal_bytes": wal_path.stat().st_size if wal_path.exists() else 0,
+            "incremental_vacuum": auto_vacuum == 2
+        }
+        reclaimable["total_bytes"] = (reclaimable["free_page_bytes"] + reclaimable["sidecar_tombstone_bytes"]
+                                      + reclaimable["wal_bytes"])
         
         # Get database size
         db_size = self.db_path.stat().st_size if self.db_path.exists() else 0
         
+        sidecar = {}
+        if self._sidecar is not None:
+            conn = self._connections.reader()
+            shards = self._sidecar.report(conn.cursor())
+            rows = sum(shard["rows"] for shard in shards)
+            sidecar = {
+                "rows": rows,
+                "tombstones": rows - sum(shard["live"] for shard in shards),
+                "quantizer": self._sidecar.quantizer,
+                "compression_ratio": round(self._sidecar.compression_ratio, 2),
+                "size_bytes": sum(shard["size_bytes"] for shard in shards),
+                "shard_by": self._sidecar.shard_by,
+                "shards": len(shards),
+                "frozen_shards": sum(shard["frozen"] for shard in shards)
+            }
+        
+        query_cache = {}
+        if self._query_cache is not None:
+            conn = self._connections.reader()
+            query_cache = self._query_cache.stats(conn.cursor())
+        
         return {
             "total_chunks": total_chunks,
             "total_tokens": total_tokens,
@@ -414,19 +4196,1168 @@ class RAGMemory:
             "last_ingestion": last_ingest,
             "storage_size_bytes": db_size,
             "storage_backend": "sqlite",
-            "embedding_dim": self.config["embedding_dim"]
+            "embedding_dim": self.config["embedding_dim"],
+            "vector_sidecar": sidecar,
+            "query_cache": query_cache,
+            "text_storage": text_storage,
+            "dedup": dedup,
+            "reclaimable": reclaimable,
+            "metrics": self.metrics.snapshot()
         }
     
     def clear(self) -> None:
         """Clear all chunks from the vector store"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM chunks")
-        conn.commit()
-        conn.close()
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM chunks")
+            cursor.execute("DELETE FROM documents")
+            cursor.execute("DELETE FROM document_blocks")
+            cursor.execute("DELETE FROM ann_buckets")
+            cursor.execute("DELETE FROM postings")
+            cursor.execute("DELETE FROM simhash_bands")
+            cursor.execute("DELETE FROM file_manifest")
+            cursor.execute("DELETE FROM query_cache")
+            if self._fts:
+                cursor.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('delete-all')")
+            if self._sidecar is not None:
+                self._sidecar.clear(cursor)
+            self._generation = self._bump_generation(cursor)
+        with self._index_lock:
+            self._index = None
+        if self._query_cache is not None:
+            self._query_cache.clear()
+    
+    def _deletion(self, cursor, source: Optional[str], content_type: Optional[str], before: Optional[str],
+                  source_glob: Optional[str]) -> Tuple[Dict[str, str], List[str]]:
+        """Chunk ids (mapped to their source_file) and manifest keys that delete() removes"""
+        clause, params = self._filter_clause(content_type, {"source": source, "source_glob": source_glob})
+        if before:
+            _, bound = self._time_bound(before, upper=False)
+            clause += " AND created_at < ?"
+            params.append(bound)
+        
+        cursor.execute(f"SELECT id, source_file FROM chunks WHERE {clause}", params)
+        chunks = dict(cursor.fetchall())
+        if content_type or before:
+            return chunks, []
+        
+        # The same clause over the manifest: only the source conditions are left in it.
+        # A file is forgotten only if some of its chunks matched, or it has none
+        cursor.execute(f"SELECT source_file, chunk_ids FROM file_manifest WHERE {clause}", params)
+        keys = []
+        for key, chunk_ids in cursor.fetchall():
+            owned = json.loads(chunk_ids or "[]")
+            if not owned or not chunks.keys().isdisjoint(owned):
+                keys.append(key)
+        unshared = self._unshared_chunks(cursor, keys, set(chunks))
+        return {chunk_id: chunks[chunk_id] for chunk_id in unshared}, keys
+    
+    def delete(self, source: Optional[str] = None, content_type: Optional[str] = None,
+               before: Optional[str] = None, dry_run: bool = False,
+               source_glob: Optional[str] = None) -> Dict[str, Any]:
+        """Delete the chunks matching every given criterion
+        
+        source is a file or directory path and source_glob a GLOB pattern
+        over source_file, as with the search filters; before takes the same
+        values as since/until and matches chunks created earlier. Deleting
+        by source alone also drops the files from the manifest, so a later
+        ingest adds them back, and keeps chunks another file still produces.
+        Otherwise the manifest is left alone, so unchanged files are not
+        re-ingested. The space is reclaimed by compact().
+        
+        Returns the counts of chunks and manifest files removed (or that
+        would be, with dry_run) and the source files of those chunks.
+        """
+        if not (source or source_glob or content_type or before):
+            raise ValueError("Give a source, source_glob, content_type or before (clear() removes everything)")
+        
+        if dry_run:
+            with self._connections.snapshot() as cursor:
+                chunks, keys = self._deletion(cursor, source, content_type, before, source_glob)
+        else:
+            with self._ingest_session() as writer:
+                writer.flush()
+                ConnectionPool.begin(writer.conn)
+                cursor = writer.cursor
+                chunks, keys = self._deletion(cursor, source, content_type, before, source_glob)
+                cursor.executemany("DELETE FROM file_manifest WHERE source_file = ?", [(key,) for key in keys])
+                if chunks:
+                    writer.delete(list(chunks))
+        return {"chunks": len(chunks), "files": len(keys),
+                "sources": sorted({source_file or "" for source_file in chunks.values()})}
+    
+    def apply_retention(self, dry_run: bool = False) -> Dict[str, int]:
+        """Delete chunks older than the retention configured for their content type
+        
+        Returns the chunks removed per content type.
+        """
+        return {content_type: self.delete(content_type=content_type, before=age, dry_run=dry_run)["chunks"]
+                for content_type, age in self.config["retention"].items()}
+    
+    def _disk_bytes(self) -> int:
+        """Size of vectors.db with its WAL plus the vector sidecar files"""
+        # The -shm file only indexes the WAL and comes and goes with connections
+        paths = [path for path in self.storage_path.glob("vectors.*") if not path.name.endswith("-shm")]
+        paths.extend(self.storage_path.glob("shards/*/vectors.*"))
+        return sum(path.stat().st_size for path in paths if path.exists())
+    
+    def compact(self, full: bool = False, step_pages: int = COMPACT_STEP_PAGES) -> Dict[str, Any]:
+        """Apply retention, then reclaim the space deleted chunks leave behind
+        
+        Works in short write transactions, so writers wait only briefly and
+        readers (which WAL never blocks) keep their snapshots: sidecar shards
+        with tombstones are rewritten one at a time (or dropped once empty),
+        the full-text index is merged COMPACT_MERGE_PAGES pages at a time,
+        stale query cache rows are dropped, and free pages are returned to
+        the file system step_pages at a time by incremental vacuum. A store
+        created before auto_vacuum=INCREMENTAL was set needs one full VACUUM
+        first (full=True), which rewrites the file under the write lock.
+        Finally the WAL is truncated unless readers keep it busy.
+        """
+        size_before = self._disk_bytes()
+        report: Dict[str, Any] = {"retention": self.apply_retention(), "sidecar_rows_dropped": 0,
+                                  "fts_merges": 0, "pages_freed": 0, "vacuum": "skipped"}
+        
+        if self._sidecar is not None:
+            conn = self._connections.reader()
+            names = [shard["name"] for shard in self._sidecar.report(conn.cursor()) if shard["rows"] != shard["live"]]
+            for name in names:
+                with self._connections.writer() as conn:
+                    report["sidecar_rows_dropped"] += self._sidecar.compact(conn.cursor(), name)
+        
+        while self._fts:
+            with self._connections.writer() as conn:
+                changes = conn.total_changes
+                conn.execute("INSERT INTO chunks_fts (chunks_fts, rank) VALUES ('merge', ?)",
+                             (-COMPACT_MERGE_PAGES,))
+                merged = conn.total_changes - changes >= 2
+            if not merged:
+                break
+            report["fts_merges"] += 1
+        
+        with self._connections.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM query_cache WHERE generation != ?",
+                           (int(self._get_meta(cursor, "generation", "0")),))
+        
+        with self._connections.writer() as conn:
+            conn.execute("PRAGMA optimize")
+        
+        conn = self._connections.reader()
+        if full:
+            with self._connections.maintenance() as conn:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                _retry_busy(lambda: conn.execute("VACUUM"))
+            report["vacuum"] = "full"
+        elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while True:
+                with self._connections.maintenance() as conn:
+                    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if free:
+                        # execute() would step the pragma once, freeing a single page
+                        _retry_busy(lambda: conn.executescript(f"PRAGMA incremental_vacuum({step_pages})"))
+                report["pages_freed"] += min(free, step_pages)
+                if free <= step_pages:
+                    break
+            report["vacuum"] = "incremental"
+        
+        with self._connections.maintenance() as conn:
+            conn.execute(f"PRAGMA busy_timeout={COMPACT_CHECKPOINT_MS}")
+            busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        report["wal_truncated"] = not busy
+        
+        report["reclaimed_bytes"] = size_before - self._disk_bytes()
+        return report
+
+# Streaming readers
+def _iter_words(blocks: Iterable[str]) -> Iterator[str]:
+    """Split a stream of text blocks into words exactly like str.split()"""
+    carry = ''
+    for block in blocks:
+        if not block:
+            continue
+        block = carry + block
+        words = block.split()
+        carry = words.pop() if words and not block[-1].isspace() else ''
+        yield from words
+    if carry:
+        yield carry
+
+_JSON_WS = re.compile(r'[ \t\n\r]*')
+_JSON_NUMBER = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+_JSON_CONSTANTS = (
+    ("-Infinity", float("-inf")),
+    ("Infinity", float("inf")),
+    ("NaN", float("nan")),
+    ("null", None),
+    ("true", True),
+    ("false", False),
+)
+
+class _JSONTokens:
+    """Buffered JSON tokenizer over a text file"""
+    
+    def __init__(self, f, block_chars: int):
+        self.f = f
+        self.block_chars = block_chars
+        self.buf = ''
+        self.pos = 0
+    
+    def fill(self, size: Optional[int] = None) -> bool:
+        block = self.f.read(size or self.block_chars)
+        if not block:
+            return False
+        self.buf = self.buf[self.pos:] + block
+        self.pos = 0
+        return True
+    
+    def peek(self) -> str:
+        """Next non-whitespace character ('' at end of input)"""
+        while True:
+            self.pos = _JSON_WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+    
+    def take(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expecting '{char}' at offset {self.pos} of buffered JSON")
+        self.pos += 1
+    
+    def string(self) -> str:
+        while True:
+            try:
+                value, self.pos = json.decoder.scanstring(self.buf, self.pos + 1)
+                return value
+            except json.JSONDecodeError:
+                # Possibly cut off mid-string; read a block at least as large as the buffer
+                if not self.fill(max(self.block_chars, len(self.buf))):
+                    raise
+    
+    def scalar(self):
+        while len(self.buf) - self.pos < 16 and self.fill():
+            pass
+        match = _JSON_NUMBER.match(self.buf, self.pos)
+        while match and match.end() == len(self.buf) and self.fill():
+            match = _JSON_NUMBER.match(self.buf, self.pos)
+        
+        if match:
+            self.pos = match.end()
+            integer, frac, exp = match.groups()
+            if frac or exp:
+                return float(integer + (frac or '') + (exp or ''))
+            return int(integer)
+        
+        for name, value in _JSON_CONSTANTS:
+            if self.buf.startswith(name, self.pos):
+                self.pos += len(name)
+                return value
+        
+        raise ValueError(f"Expecting value at offset {self.pos} of buffered JSON")
+
+def _json_pretty_pieces(tokens: _JSONTokens, depth: int) -> Iterator[str]:
+    char = tokens.peek()
+    
+    if char in ('{', '['):
+        close = '}' if char == '{' else ']'
+        tokens.pos += 1
+        if tokens.peek() == close:
+            tokens.pos += 1
+            yield char + close
+            return
+        
+        yield char
+        inner = '\n' + '  ' * (depth + 1)
+        separator = inner
+        while True:
+            yield separator
+            separator = ',' + inner
+            if char == '{':
+                if tokens.peek() != '"':
+                    raise ValueError("Expecting property name enclosed in double quotes")
+                yield json.dumps(tokens.string()) + ': '
+                tokens.take(':')
+            yield from _json_pretty_pieces(tokens, depth + 1)
+            
+            following = tokens.peek()
+            tokens.pos += 1
+            if following == close:
+                break
+            if following != ',':
+                raise ValueError(f"Expecting ',' delimiter in JSON {'object' if char == '{' else 'array'}")
+        yield '\n' + '  ' * depth + close
+    
+    elif char == '"':
+        yield json.dumps(tokens.string())
+    elif char == '':
+        raise ValueError("Expecting value: unexpected end of JSON")
+    else:
+        yield json.dumps(tokens.scalar())
+
+def _iter_json_pretty(f, block_chars: int = STREAM_BLOCK_CHARS) -> Iterator[str]:
+    """Incrementally produce json.dumps(json.load(f), indent=2) in blocks
+    
+    Output matches the non-streaming form except for duplicate object keys,
+    which are all kept instead of collapsing to the last value.
+    """
+    tokens = _JSONTokens(f, block_chars)
+    pieces = []
+    size = 0
+    
+    for piece in _json_pretty_pieces(tokens, 0):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= block_chars:
+            yield ''.join(pieces)
+            pieces = []
+            size = 0
+    
+    if tokens.peek() != '':
+        raise ValueError(f"Extra data after JSON value at offset {tokens.pos}")
+    if pieces:
+        yield ''.join(pieces)
+
+# Daemon
+class _DaemonServer(socketserver.UnixStreamServer):
+    """Serves one request at a time against a single resident RAGMemory"""
+    
+    def __init__(self, socket_path: str, rag: RAGMemory):
+        self.rag = rag
+        super().__init__(socket_path, _DaemonHandler)
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    """JSON-lines protocol: one request object per line, one response per line"""
+    
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = _handle_request(self.server.rag, json.loads(line))
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+def _handle_request(rag: RAGMemory, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Dispatch one daemon request
+    
+    Ops: ping, search, search_many, retrieve, ingest, stats, and cli (run a
+    forwarded command line with optional stdin text, capturing its output). Writes made by other processes are
+    picked up before every request via the store generation.
+    """
+    op = request.get("op")
+    rag._sync_generation()
+    
+    if op == "ping":
+        return {"ok": True, "result": {"pid": os.getpid(), "generation": rag._generation}}
+    
+    if op == "cli":
+        return _run_cli(rag, request.get("argv", []), request.get("cwd"), request.get("stdin"))
+    
+    if op not in ("search", "search_many", "retrieve", "ingest", "stats"):
+        raise ValueError(f"Unknown op: {op!r}")
+    
+    rag.metrics.begin(op)
+    try:
+        if op == "search":
+            result = rag.search(
+                request["query"],
+                top_k=request.get("top_k", 5),
+                threshold=request.get("threshold"),
+                content_type=request.get("content_type"),
+                mode=request.get("mode"),
+                probes=request.get("probes"),
+                filters=request.get("filters"),
+                collapse=request.get("collapse", False)
+            )
+        elif op == "search_many":
+            result = rag.search_many(
+                request["queries"],
+                top_k=request.get("top_k", 5),
+                threshold=request.get("threshold"),
+                content_type=request.get("content_type"),
+                mode=request.get("mode"),
+                probes=request.get("probes"),
+                filters=request.get("filters"),
+                collapse=request.get("collapse", False)
+            )
+        elif op == "retrieve":
+            result = rag.retrieve(
+                request["query"],
+                max_tokens=request.get("max_tokens", 4000),
+                include_scores=request.get("include_scores", False),
+                content_type=request.get("content_type"),
+                filters=request.get("filters"),
+                collapse=request.get("collapse", False)
+            )
+        elif op == "ingest":
+            rag.ingest_report = rag._new_ingest_report()
+            if request.get("text") is not None:
+                chunk_ids = rag.add_text(request["text"], request.get("metadata"))
+            else:
+                source_path = Path(request["source"])
+                if source_path.is_dir():
+                    chunk_ids = rag.add_directory(str(source_path), request.get("pattern", "*.md"),
+                                                  workers=request.get("workers"))
+                else:
+                    chunk_ids = rag.add_file(str(source_path))
+            result = {"chunk_ids": chunk_ids, "report": rag.ingest_report}
+        else:
+            result = rag.get_stats()
+    finally:
+        rag.metrics.end()
+    return {"ok": True, "result": result}
+
+def _run_cli(rag: RAGMemory, argv: List[str], cwd: Optional[str],
+             stdin: Optional[str] = None) -> Dict[str, Any]:
+    """Run a forwarded command line in the daemon, capturing its output"""
+    stdout, stderr = io.StringIO(), io.StringIO()
+    previous_cwd = os.getcwd()
+    previous_stdin = sys.stdin
+    status = 0
+    
+    try:
+        sys.stdin = io.StringIO(stdin or "")
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            if cwd:
+                os.chdir(cwd)
+            args = build_parser().parse_args(argv)
+            if args.command not in DAEMON_COMMANDS:
+                raise ValueError(f"Command not served by the daemon: {args.command}")
+            run_command(rag, args)
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        stderr.write(traceback.format_exc())
+        status = 1
+    finally:
+        sys.stdin = previous_stdin
+        os.chdir(previous_cwd)
+    
+    return {"ok": True, "stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "status": status}
+
+def _socket_alive(socket_path: Path) -> bool:
+    """True if something is accepting connections on socket_path"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def serve(rag: RAGMemory, socket_path: Optional[str] = None) -> None:
+    """Serve rag over a Unix socket until interrupted"""
+    path = Path(os.path.expanduser(socket_path)) if socket_path else rag.socket_path
+    if path.exists():
+        if _socket_alive(path):
+            raise RuntimeError(f"A daemon is already listening on {path}")
+        path.unlink()  # stale socket from a previous run
+    
+    # Load the index up front so the first request is already hot
+    if rag.config["resident_index"]:
+        rag._get_index()
+    
+    # Create the socket owner-only from the start; a chmod after bind leaves a window
+    previous_umask = os.umask(0o177)
+    try:
+        server = _DaemonServer(str(path), rag)
+    finally:
+        os.umask(previous_umask)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"✅ RAG Memory daemon listening on {path}", flush=True)
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        rag.metrics.flush()
+        if rag._query_cache is not None:
+            rag._query_cache.flush()
+        if path.exists():
+            path.unlink()
+
+# Ingest pipeline workers
+_pipeline_rag: Optional[RAGMemory] = None
+
+def _init_pipeline_worker(config: Dict[str, Any]) -> None:
+    global _pipeline_rag
+    _pipeline_rag = RAGMemory._detached(config)
+
+def _pipeline_prepare(file_path: str, known_hash: Optional[str]) -> Dict[str, Any]:
+    """Read, chunk and embed one file in a worker; embeddings are packed float32"""
+    prepared = _pipeline_rag._prepare_file(Path(file_path), known_hash)
+    if prepared["chunks"] is not None:
+        embeddings = prepared["embeddings"]
+        if HAS_NUMPY:
+            prepared["embeddings"] = _pipeline_rag._encode_embedding(embeddings)
+        else:
+            prepared["embeddings"] = b''.join(_pipeline_rag._encode_embedding(e) for e in embeddings)
+    return prepared
+
+# Benchmark
+BENCH_WORDS = (
+    "agent", "memory", "search", "vector", "index", "config", "deploy", "server", "client", "token",
+    "session", "daily", "review", "meeting", "project", "release", "feature", "bug", "patch", "test",
+    "cache", "query", "result", "chunk", "embedding", "storage", "backup", "schedule", "cron", "skill",
+    "workspace", "notes", "summary", "context", "prompt", "model", "latency", "throughput", "error", "retry",
+    "timeout", "socket", "daemon", "thread", "process", "worker", "batch", "stream", "file", "directory",
+    "metadata", "source", "filter", "content", "markdown", "python", "script", "shell", "build", "commit",
+    "branch", "merge", "issue", "ticket", "user", "team", "plan", "goal", "progress", "blocker",
+    "security", "advice", "password", "network", "database", "sqlite", "table", "column", "row", "schema",
+)
+BENCH_SECTIONS = ("Morning", "Afternoon", "Evening", "Decisions", "Follow-ups", "Learnings")
+# (metric path, higher is better) pairs compared against a --baseline report
+BENCH_COMPARED = (
+    ("ingest_chunks_per_s", True),
+    ("search_ms.p50", False), ("search_ms.p95", False), ("search_ms.p99", False),
+    ("retrieve_ms.p50", False), ("retrieve_ms.p95", False), ("retrieve_ms.p99", False),
+    ("cold_start_ms", False),
+    ("peak_rss_bytes", False),
+    ("disk_bytes", False),
+    ("recall", True),
+)
+
+def _bench_sentence(rng: random.Random) -> str:
+    words = [rng.choice(BENCH_WORDS) for _ in range(rng.randint(6, 14))]
+    return ' '.join(words).capitalize() + '.'
+
+def _bench_markdown(rng: random.Random, day, words: int) -> str:
+    """A daily-memory style note of roughly `words` words"""
+    lines = [f"# {day.isoformat()}", ""]
+    written = 2
+    while written < words:
+        lines += [f"## {rng.choice(BENCH_SECTIONS)}", ""]
+        for _ in range(rng.randint(2, 6)):
+            sentence = _bench_sentence(rng)
+            lines.append(f"- {sentence}")
+            written += len(sentence.split()) + 1
+        lines.append("")
+    return "\n".join(lines)
+
+def _bench_code(rng: random.Random, words: int) -> str:
+    """A Python module of roughly `words` words"""
+    lines = [f'"""{_bench_sentence(rng)}"""', ""]
+    written = 0
+    while written < words:
+        name = '_'.join(rng.sample(BENCH_WORDS, 2))
+        params = rng.sample(BENCH_WORDS, rng.randint(1, 3))
+        lines += [
+            f"def {name}({', '.join(params)}):",
+            f'    """{_bench_sentence(rng)}"""',
+            f"    return {' + '.join(params)}",
+            ""
+        ]
+        written += len(' '.join(lines[-4:]).split())
+    return "\n".join(lines)
+
+def write_bench_corpus(root: Path, chunks: int, chunk_size: int, overlap: int, seed: int = 0) -> int:
+    """Write a deterministic corpus expected to ingest as about `chunks` chunks
+    
+    Three in four files are daily memory notes (memory/YYYY/YYYY-MM-DD.md),
+    the rest Python modules under code/, each between half and four times
+    chunk_size words. Returns the number of files written.
+    """
+    rng = random.Random(seed)
+    step = chunk_size - overlap
+    first_day = datetime(2020, 1, 1).date()
+    planned = files = 0
+    
+    while planned < chunks:
+        words = rng.randint(chunk_size // 2, chunk_size * 4)
+        if files % 4 == 3:
+            path = root / "code" / f"module_{files:07d}.py"
+            text = _bench_code(rng, words)
+        else:
+            day = first_day + timedelta(days=files)
+            path = root / "memory" / str(day.year) / f"{day.isoformat()}.md"
+            text = _bench_markdown(rng, day, words)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+        files += 1
+        
+        # Mirror _split_text: short texts stay whole, longer ones are windowed
+        count = len(text.split())
+        if len(text) // 4 <= chunk_size or count <= chunk_size:
+            planned += 1
+        else:
+            planned += math.ceil((count - chunk_size) / step) + 1
+    
+    return files
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p95/p99 of samples"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    return {
+        f"p{p}": round(ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)], 3)
+        for p in (50, 95, 99)
+    }
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+def _peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def bench_queries(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed + 1)
+    return [' '.join(rng.choice(BENCH_WORDS) for _ in range(6)) for _ in range(count)]
+
+def bench_store(size: int, corpus: Path, home: Path, queries: int, seed: int,
+                mode: str = "exact", workers: int = 1, quantizer: str = "none") -> Dict[str, Any]:
+    """Ingest corpus into a fresh store under home and measure it
+    
+    The store lives at home/.openclaw/data/rag-memory so that the CLI
+    cold start can be timed with HOME=home. Runs in its own process so
+    that peak RSS and the NumPy setting belong to this run alone.
+    """
+    storage = home / ".openclaw" / "data" / "rag-memory"
+    storage.mkdir(parents=True, exist_ok=True)
+    config_path = storage / "config.json"
+    with open(config_path, 'w') as f:
+        json.dump({"storage_path": str(storage), "search_mode": mode, "quantizer": quantizer,
+                   "query_cache_size": 0}, f, indent=2)
+    
+    rag = RAGMemory(str(config_path))
+    started = time.perf_counter()
+    rag.add_directory(str(corpus), "*.*", workers=workers)
+    ingest_s = time.perf_counter() - started
+    chunks = rag.get_stats()["total_chunks"]
+    
+    result: Dict[str, Any] = {
+        "size": size,
+        "numpy": HAS_NUMPY,
+        "mode": mode,
+        "quantizer": quantizer,
+        "chunks": chunks,
+        "ingest_s": round(ingest_s, 3),
+        "ingest_chunks_per_s": round(chunks / ingest_s, 1) if ingest_s else 0.0
+    }
+    
+    if mode in ("ann", "sparse"):
+        started = time.perf_counter()
+        if mode == "ann":
+            rag.build_ann_index()
+        else:
+            rag.build_sparse_index()
+        result["index_build_s"] = round(time.perf_counter() - started, 3)
+    
+    texts = bench_queries(queries, seed)
+    search_ms, retrieve_ms = [], []
+    found = []
+    for text in texts:
+        started = time.perf_counter()
+        found.append(rag.search(text, top_k=10))
+        search_ms.append((time.perf_counter() - started) * 1000)
+    for text in texts:
+        started = time.perf_counter()
+        rag.retrieve(text, max_tokens=2000)
+        retrieve_ms.append((time.perf_counter() - started) * 1000)
+    result["search_ms"] = _percentiles(search_ms)
+    result["retrieve_ms"] = _percentiles(retrieve_ms)
+    result["peak_rss_bytes"] = _peak_rss_bytes()
+    result["disk_bytes"] = _dir_size(storage)
+    
+    if mode != "exact" or quantizer != "none":
+        # Reference top-10 from full-precision vectors, loaded after peak RSS was taken
+        reference = rag._get_index().search_many(rag.embed_many(texts), 10, rag.config["search_threshold"])
+        recall = 0.0
+        for exact_hits, hits in zip(reference, found):
+            exact = {chunk_id for chunk_id, _ in exact_hits}
+            recall += len(exact & {r["id"] for r in hits}) / len(exact) if exact else 1.0
+        result["recall"] = round(recall / max(1, len(texts)), 4)
+    
+    # Fresh interpreter per run: import, config, connect, first search
+    env = dict(os.environ, HOME=str(home))
+    cold = []
+    for text in texts[:3]:
+        started = time.perf_counter()
+        subprocess.run([sys.executable, os.path.abspath(__file__), "search", text], env=env,
+                       stdout=subprocess.DEVNULL, check=True)
+        cold.append((time.perf_counter() - started) * 1000)
+    result["cold_start_ms"] = round(sorted(cold)[len(cold) // 2], 3)
+    
+    return result
+
+def _metric(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def compare_bench(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                  tolerance: float) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Metrics that got worse than baseline by more than tolerance (a fraction),
+    and the runs that had nothing to be compared with
+    
+    Runs are matched on (size, numpy, mode, quantizer).
+    """
+    def run_key(r):
+        return r["size"], r["numpy"], r["mode"], r.get("quantizer", "none")
+    
+    previous = {run_key(r): r for r in baseline}
+    regressions = []
+    unmatched = []
+    for result in results:
+        base = previous.get(run_key(result))
+        if base is None:
+            unmatched.append(dict(zip(("size", "numpy", "mode", "quantizer"), run_key(result))))
+            continue
+        for path, higher_is_better in BENCH_COMPARED:
+            now, then = _metric(result, path), _metric(base, path)
+            if not now or not then:
+                continue
+            change = (now - then) / then
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({
+                    "size": result["size"], "numpy": result["numpy"], "mode": result["mode"],
+                    "metric": path, "baseline": then, "current": now, "change": round(change, 4)
+                })
+    return regressions, unmatched
+
+def bench_sizes(value: str) -> List[int]:
+    """Parse comma-separated chunk counts such as 1000,10k,1M"""
+    sizes = []
+    for item in value.split(','):
+        item = item.strip()
+        scale = {"k": 1000, "m": 1000000}.get(item[-1:].lower(), 1)
+        digits = item[:-1] if scale > 1 else item
+        if not digits.isdigit() or int(digits) <= 0:
+            raise ValueError(f"expected chunk counts such as 1000,10k,1M, got {item!r}")
+        sizes.append(int(digits) * scale)
+    return sizes
+
+def run_bench(args) -> int:
+    """Run the benchmark matrix in child processes; returns the exit status"""
+    if args.run:
+        result = bench_store(args.run, Path(args.corpus), Path(args.home), args.queries, args.seed,
+                             args.mode, args.workers, args.quantizer)
+        print(json.dumps(result))
+        return 0
+    
+    numpy_settings = {"both": [True, False], "on": [True], "off": [False]}[args.numpy]
+    if not HAS_NUMPY and True in numpy_settings:
+        print("⚠️  NumPy unavailable; running pure Python only", file=sys.stderr)
+        numpy_settings = [False]
+    
+    work = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="rag-memory-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    chunk_size = DEFAULT_CONFIG["chunk_size"]
+    overlap = DEFAULT_CONFIG["chunk_overlap"]
+    results = []
+    
+    try:
+        for size in args.sizes:
+            corpus = work / f"corpus-{size}"
+            if not corpus.exists():
+                write_bench_corpus(corpus, size, chunk_size, overlap, args.seed)
+            
+            for use_numpy in numpy_settings:
+                home = work / f"{'numpy' if use_numpy else 'python'}-{size}"
+                shutil.rmtree(home, ignore_errors=True)
+                env = dict(os.environ)
+                env.pop("RAG_MEMORY_NO_NUMPY", None)
+                if not use_numpy:
+                    env["RAG_MEMORY_NO_NUMPY"] = "1"
+                
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "bench", "--run", str(size),
+                     "--corpus", str(corpus), "--home", str(home), "--queries", str(args.queries),
+                     "--seed", str(args.seed), "--mode", args.mode, "--workers", str(args.workers),
+                     "--quantizer", args.quantizer],
+                    env=env, stdout=subprocess.PIPE, text=True
+                )
+                if child.returncode != 0:
+                    print(f"❌ Benchmark run failed (size={size}, numpy={use_numpy})", file=sys.stderr)
+                    return 1
+                results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+                if not args.keep:
+                    shutil.rmtree(home, ignore_errors=True)
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work, ignore_errors=True)
+    
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "numpy": np.__version__ if HAS_NUMPY else None,
+        "queries": args.queries,
+        "seed": args.seed,
+        "results": results
+    }
+    
+    regressions = []
+    unmatched = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions, unmatched = compare_bench(results, json.load(f)["results"], args.tolerance)
+        report["baseline"] = args.baseline
+        report["regressions"] = regressions
+        report["unmatched"] = unmatched
+    # Nothing compared is a failed comparison, not a clean one
+    failed = bool(regressions) or (bool(args.baseline) and len(unmatched) == len(results))
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    if args.format == "json":
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"📈 RAG Memory benchmark ({args.queries} queries, mode={args.mode}, quantizer={args.quantizer})")
+        print(f"   {'chunks':>8} {'numpy':>5} {'ingest/s':>9} {'search p50/p95/p99 ms':>24} "
+              f"{'retrieve p50/p95/p99 ms':>24} {'cold ms':>8} {'rss MB':>7} {'disk MB':>8}")
+        for r in results:
+            search = '/'.join(f"{r['search_ms'][p]:.1f}" for p in ("p50", "p95", "p99"))
+            retrieve = '/'.join(f"{r['retrieve_ms'][p]:.1f}" for p in ("p50", "p95", "p99"))
+            rss = f"{r['peak_rss_bytes'] / 2**20:.0f}" if r['peak_rss_bytes'] else "-"
+            print(f"   {r['chunks']:>8} {'yes' if r['numpy'] else 'no':>5} {r['ingest_chunks_per_s']:>9.0f} "
+                  f"{search:>24} {retrieve:>24} {r['cold_start_ms']:>8.0f} {rss:>7} "
+                  f"{r['disk_bytes'] / 2**20:>8.1f}")
+            if "recall" in r:
+                print(f"   {'':>8} recall@10 vs exact full precision: {r['recall']:.3f}")
+        if args.output:
+            print(f"\n   Report written to {args.output}")
+        if args.baseline:
+            if unmatched:
+                print(f"\n⚠️  {len(unmatched)} of {len(results)} run(s) have no counterpart in {args.baseline}:")
+                for r in unmatched:
+                    print(f"   size={r['size']} numpy={r['numpy']} mode={r['mode']} quantizer={r['quantizer']}")
+            if regressions:
+                print(f"\n⚠️  {len(regressions)} regression(s) beyond {args.tolerance:.0%} vs {args.baseline}:")
+                for r in regressions:
+                    print(f"   size={r['size']} numpy={r['numpy']} {r['metric']}: "
+                          f"{r['baseline']} -> {r['current']} ({r['change']:+.1%})")
+            elif len(unmatched) == len(results):
+                print(f"\n❌ No run matched {args.baseline}; nothing was compared")
+            else:
+                print(f"\n✅ No regressions beyond {args.tolerance:.0%} vs {args.baseline}")
+    
+    return 1 if failed else 0
+
+# Concurrency stress test
+def stress_writer(rag: RAGMemory, name: str, deadline: float, seed: int,
+                  kept: List[Tuple[str, List[str]]], deleted: List[str]) -> Dict[str, Any]:
+    """Ingest notes under stress/<name>/ until deadline, deleting every tenth again
+    
+    Each note is appended to kept (source, chunk ids), or to deleted, only
+    once its transaction has committed, so readers can check both.
+    """
+    rng = random.Random(f"{seed}-{name}")
+    errors: List[str] = []
+    chunks = 0
+    number = 0
+    while time.perf_counter() < deadline:
+        number += 1
+        source = f"stress/{name}/{number}.md"
+        text = f"Stress note {name} {number}\n" + _bench_markdown(rng, datetime.now().date(),
+                                                                   rng.randint(50, 1200))
+        try:
+            chunk_ids = rag.add_text(text, {"source_file": source, "content_type": "daily"})
+            chunks += len(chunk_ids)
+            if number % 10:
+                kept.append((source, chunk_ids))
+            else:
+                with rag._ingest_session() as writer:
+                    writer.delete(chunk_ids)
+                deleted.append(source)
+        except Exception as e:
+            errors.append(f"{name} writing {source}: {type(e).__name__}: {e}")
+    return {"chunks": chunks, "notes": number, "errors": errors}
+
+def stress_reader(rag: RAGMemory, name: str, deadline: float, seed: int, mode: str,
+                  kept: List[Tuple[str, List[str]]], deleted: List[str]) -> Dict[str, Any]:
+    """Search until deadline, checking every answer against what has committed
+    
+    A committed note must be found by a search filtered to its source, a
+    deleted one must not, and every hit's text must hash to its id, which
+    fails if text and metadata were read from different commits.
+    """
+    rng = random.Random(f"{seed}-{name}")
+    queries = bench_queries(64, seed)
+    latencies: List[float] = []
+    errors: List[str] = []
+    while time.perf_counter() < deadline:
+        query = rng.choice(queries)
+        roll = rng.random()
+        started = time.perf_counter()
+        try:
+            if kept and roll < 0.4:
+                source, chunk_ids = rng.choice(kept)
+                results = rag.search(query, top_k=5, threshold=-1.0, mode="exact", filters={"source": source})
+                if not results or any(r["id"] not in chunk_ids for r in results):
+                    errors.append(f"{name}: committed {source} answered with {[r['id'] for r in results]}")
+            elif deleted and roll < 0.5:
+                source = rng.choice(deleted)
+                results = rag.search(query, top_k=5, threshold=-1.0, mode="exact", filters={"source": source})
+                if results:
+                    errors.append(f"{name}: deleted {source} still answered with {len(results)} hit(s)")
+            else:
+                results = rag.search(query, top_k=10, mode=mode)
+            latencies.append((time.perf_counter() - started) * 1000)
+            for r in results:
+                if hashlib.sha256(r["text"].encode()).hexdigest()[:16] != r["id"]:
+                    errors.append(f"{name}: chunk {r['id']} came back with another chunk's text")
+        except Exception as e:
+            errors.append(f"{name} searching: {type(e).__name__}: {e}")
+    return {"latencies_ms": latencies, "errors": errors}
+
+def stress_verify(rag: RAGMemory, kept: List[Tuple[str, List[str]]], deleted: List[str]) -> List[str]:
+    """Check the store holds exactly the kept notes and that the sidecar agrees with it"""
+    problems = []
+    expected = {chunk_id for _, chunk_ids in kept for chunk_id in chunk_ids}
+    with rag._connections.snapshot() as cursor:
+        cursor.execute("SELECT id, source_file FROM chunks")
+        stored = dict(cursor.fetchall())
+        if rag._sidecar is not None and rag._sidecar.needs_repair(cursor):
+            problems.append("vector sidecar disagrees with vectors.db")
+    
+    missing = expected - set(stored)
+    if missing:
+        problems.append(f"{len(missing)} committed chunk(s) missing")
+    gone = set(deleted)
+    extra = [chunk_id for chunk_id, source in stored.items() if chunk_id not in expected]
+    if extra:
+        problems.append(f"{len(extra)} unexpected chunk(s), {sum(stored[c] in gone for c in extra)} of them deleted")
+    return problems
+
+def run_stress(args) -> int:
+    """Hammer a scratch store with concurrent writers and readers; returns the exit status"""
+    if args.child:
+        rag = RAGMemory(args.config)
+        kept: List[Tuple[str, List[str]]] = []
+        deleted: List[str] = []
+        result = stress_writer(rag, args.child, time.perf_counter() + args.seconds, args.seed, kept, deleted)
+        print(json.dumps(dict(result, kept=kept, deleted=deleted)))
+        return 0
+    
+    work = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="rag-memory-stress-"))
+    storage = work / "store"
+    shutil.rmtree(storage, ignore_errors=True)
+    storage.mkdir(parents=True)
+    config_path = storage / "config.json"
+    with open(config_path, 'w') as f:
+        json.dump({"storage_path": str(storage), "search_mode": args.mode, "shard_by": args.shard_by,
+                   "resident_index": args.resident}, f, indent=2)
+    
+    try:
+        rag = RAGMemory(str(config_path))
+        kept: List[Tuple[str, List[str]]] = []
+        deleted: List[str] = []
+        children = [
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), "stress", "--child", f"p{n}",
+                              "--config", str(config_path), "--seconds", str(args.seconds),
+                              "--seed", str(args.seed)], stdout=subprocess.PIPE, text=True)
+            for n in range(args.processes)
+        ]
+        
+        started = time.perf_counter()
+        deadline = started + args.seconds
+        with ThreadPoolExecutor(max_workers=args.writers + args.readers) as pool:
+            writers = [pool.submit(stress_writer, rag, f"w{n}", deadline, args.seed, kept, deleted)
+                       for n in range(args.writers)]
+            readers = [pool.submit(stress_reader, rag, f"r{n}", deadline, args.seed, args.mode, kept, deleted)
+                       for n in range(args.readers)]
+            written = [future.result() for future in writers]
+            read = [future.result() for future in readers]
+        
+        for child in children:
+            out, _ = child.communicate()
+            if child.returncode != 0:
+                written.append({"chunks": 0, "notes": 0, "errors": [f"writer process exited with {child.returncode}"]})
+                continue
+            result = json.loads(out.strip().splitlines()[-1])
+            kept.extend((source, chunk_ids) for source, chunk_ids in result.pop("kept"))
+            deleted.extend(result.pop("deleted"))
+            written.append(result)
+        elapsed = time.perf_counter() - started
+        
+        errors = [error for result in written + read for error in result["errors"]]
+        problems = stress_verify(RAGMemory(str(config_path)), kept, deleted)
+        latencies = [ms for result in read for ms in result["latencies_ms"]]
+        chunks = sum(result["chunks"] for result in written)
+        report = {
+            "writers": args.writers,
+            "writer_processes": args.processes,
+            "readers": args.readers,
+            "seconds": round(elapsed, 3),
+            "mode": args.mode,
+            "numpy": HAS_NUMPY,
+            "notes": sum(result["notes"] for result in written),
+            "chunks": chunks,
+            "ingest_chunks_per_s": round(chunks / elapsed, 1),
+            "searches": len(latencies),
+            "searches_per_s": round(len(latencies) / elapsed, 1),
+            "search_ms": _percentiles(latencies),
+            "errors": len(errors),
+            "problems": problems
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(storage if args.work_dir else work, ignore_errors=True)
+    
+    if args.format == "json":
+        print(json.dumps(dict(report, error_samples=errors[:20]), indent=2))
+    else:
+        search = '/'.join(f"{report['search_ms'][p]:.1f}" for p in ("p50", "p95", "p99"))
+        print(f"🔥 RAG Memory stress test ({args.writers} writer thread(s), {args.processes} writer process(es), "
+              f"{args.readers} reader(s), {report['seconds']:.1f}s, mode={args.mode})")
+        print(f"   Ingest: {report['chunks']} chunks in {report['notes']} notes, "
+              f"{report['ingest_chunks_per_s']:.0f} chunks/s")
+        print(f"   Search: {report['searches']} searches, {report['searches_per_s']:.0f}/s, "
+              f"p50/p95/p99 {search} ms")
+        for error in errors[:10]:
+            print(f"   ❌ {error}")
+        if len(errors) > 10:
+            print(f"   ... and {len(errors) - 10} more error(s)")
+        for problem in problems:
+            print(f"   ❌ {problem}")
+        if not errors and not problems:
+            print("✅ No errors; every committed note was found and every deleted one was gone")
+    
+    return 1 if errors or problems else 0
 
 # CLI interface
-def main():
+def add_filter_arguments(parser) -> None:
+    parser.add_argument("--source", dest="source_filter", default=None,
+                        help="Only chunks from this file or from files under this directory")
+    parser.add_argument("--source-glob", default=None, help="Only chunks whose source_file matches this glob")
+    parser.add_argument("--since", default=None, help="Only chunks created at/after this date, timestamp or age (7d)")
+    parser.add_argument("--until", default=None, help="Only chunks created at/before this date or timestamp")
+    parser.add_argument("--where", type=metadata_filter, action="append", default=[], metavar="KEY=VALUE",
+                        help="Metadata equality filter (repeatable); JSON values such as 3 or true are typed")
+
+def metadata_filter(item: str) -> Tuple[str, Any]:
+    """Parse a --where KEY=VALUE argument, decoding JSON values"""
+    key, sep, value = item.partition("=")
+    if not sep or not key:
+        raise ValueError(f"expected KEY=VALUE, got {item!r}")
+    RAGMemory._metadata_expr(key)
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+def add_profile_argument(parser) -> None:
+    parser.add_argument("--profile", action="store_true",
+                        help="Print a per-stage timing breakdown to stderr")
+
+def print_profile(profile: Dict[str, Any], stream) -> None:
+    """Write a --profile stage breakdown"""
+    total = profile["seconds"]
+    print(f"⏱  {profile['command']}: {total * 1000:.2f} ms", file=stream)
+    stages = sorted(profile["stages"].items(), key=lambda item: -item[1]["seconds"])
+    staged = 0.0
+    for name, entry in stages:
+        staged += entry["seconds"]
+        print(f"   {name:<18} {entry['seconds'] * 1000:>10.3f} ms {entry['calls']:>6}x "
+              f"{entry['seconds'] / total if total else 0:>7.1%}", file=stream)
+    other = max(0.0, total - staged)
+    print(f"   {'(other)':<18} {other * 1000:>10.3f} ms {'':>7} {other / total if total else 0:>7.1%}",
+          file=stream)
+    if profile["counters"]:
+        print("   " + ", ".join(f"{name}: {value:,}" for name, value in sorted(profile["counters"].items())),
+              file=stream)
+
+def parse_filters(args) -> Optional[Dict[str, Any]]:
+    """Search filters from parsed CLI arguments, or None if none were given"""
+    filters: Dict[str, Any] = {}
+    if args.source_filter:
+        filters["source"] = args.source_filter
+    if args.source_glob:
+        filters["source_glob"] = args.source_glob
+    if args.since:
+        filters["since"] = args.since
+    if args.until:
+        filters["until"] = args.until
+    
+    if args.where:
+        filters["where"] = dict(args.where)
+    
+    return filters or None
+
+def run_batch_search(rag: RAGMemory, args, stream_in, stream_out) -> None:
+    """Answer JSONL queries from stream_in with JSONL results on stream_out
+    
+    Each line is a JSON string or an object with "query" and optional "id",
+    "top_k", "threshold", "content_type", "mode", "probes", "filters" and
+    "collapse";
+    missing options come from the command line. Up to args.batch_size lines
+    are read and scored together (queries with equal options share one
+    search_many call), then answered in input order.
+    """
+    defaults = {
+        "top_k": args.top_k,
+        "threshold": args.threshold,
+        "content_type": args.content_type,
+        "mode": args.mode,
+        "probes": args.probes,
+        "filters": parse_filters(args),
+        "collapse": args.collapse,
+    }
+    lines = enumerate(stream_in, 1)
+    
+    while True:
+        chunk = list(itertools.islice(lines, max(1, args.batch_size)))
+        if not chunk:
+            break
+        
+        outputs: List[Optional[Dict[str, Any]]] = [None] * len(chunk)
+        groups: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+        for slot, (line_no, line) in enumerate(chunk):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if isinstance(request, str):
+                    request = {"query": request}
+                if not isinstance(request, dict) or not isinstance(request.get("query"), str):
+                    raise ValueError("expected a JSON string or an object with a \"query\" string")
+            except ValueError as e:
+                outputs[slot] = {"line": line_no, "error": str(e)}
+                continue
+            
+            options = {key: request.get(key, default) for key, default in defaults.items()}
+            groups.setdefault(json.dumps(options, sort_keys=True), []).append((slot, request))
+        
+        for key, members in groups.items():
+            options = json.loads(key)
+            try:
+                found = rag.search_many([request["query"] for _, request in members], **options)
+            except ValueError as e:
+                found = [e] * len(members)
+            
+            for (slot, request), results in zip(members, found):
+                output = {"query": request["query"]}
+                if "id" in request:
+                    output["id"] = request["id"]
+                if isinstance(results, Exception):
+                    output["error"] = str(results)
+                else:
+                    output["results"] = results
+                outputs[slot] = output
+        
+        for output in outputs:
+            if output is not None:
+                stream_out.write(json.dumps(output) + "\n")
+        stream_out.flush()
+
+def build_parser():
     import argparse
     
     parser = argparse.ArgumentParser(description="RAG Memory - Vector-based memory for OpenClaw")
@@ -445,14 +5376,28 @@ def main():
     ingest_parser.add_argument("--chunk-size", type=int, default=500)
     ingest_parser.add_argument("--chunk-overlap", type=int, default=50)
     ingest_parser.add_argument("--metadata", help="JSON metadata to attach")
+    ingest_parser.add_argument("--workers", type=int, default=None,
+                               help="Worker processes for directory ingest (default: ingest_workers from config)")
+    add_profile_argument(ingest_parser)
     
     # search command
     search_parser = subparsers.add_parser("search", help="Perform semantic search")
-    search_parser.add_argument("query", help="Search query")
+    search_parser.add_argument("query", nargs="?", help="Search query (omit with --batch)")
     search_parser.add_argument("--top-k", type=int, default=5)
     search_parser.add_argument("--threshold", type=float, default=None)
     search_parser.add_argument("--type", dest="content_type", help="Filter by content type")
     search_parser.add_argument("--format", choices=["json", "text", "markdown"], default="text")
+    search_parser.add_argument("--mode", choices=["exact", "ann", "sparse", "hybrid"], default=None,
+                               help="Scoring mode (default: search_mode from config)")
+    search_parser.add_argument("--probes", type=int, default=None, help="Extra LSH buckets per table (ann mode)")
+    search_parser.add_argument("--collapse", action="store_true",
+                               help="Drop results that are near-duplicates of a better result")
+    search_parser.add_argument("--batch", action="store_true",
+                               help="Read JSONL queries from stdin and write JSONL results to stdout")
+    search_parser.add_argument("--batch-size", type=int, default=64,
+                               help="Queries scored together in --batch mode (1 = answer each line at once)")
+    add_filter_arguments(search_parser)
+    add_profile_argument(search_parser)
     
     # retrieve command
     retrieve_parser = subparsers.add_parser("retrieve", help="Retrieve context for LLM")
@@ -460,27 +5405,136 @@ def main():
     retrieve_parser.add_argument("--max-tokens", type=int, default=4000)
     retrieve_parser.add_argument("--include-scores", action="store_true")
     retrieve_parser.add_argument("--format", choices=["context", "detailed"], default="context")
+    retrieve_parser.add_argument("--type", dest="content_type", help="Filter by content type")
+    retrieve_parser.add_argument("--collapse", action="store_true",
+                                 help="Skip chunks that are near-duplicates of a better one")
+    add_filter_arguments(retrieve_parser)
+    add_profile_argument(retrieve_parser)
+    
+    # ann command
+    ann_parser = subparsers.add_parser("ann", help="Build or evaluate the approximate nearest-neighbour index")
+    ann_parser.add_argument("action", choices=["build", "report"])
+    ann_parser.add_argument("--tables", type=int, default=None, help="Number of LSH tables")
+    ann_parser.add_argument("--bits", type=int, default=None, help="Hyperplanes per table")
+    ann_parser.add_argument("--queries", type=int, default=50, help="Sampled queries for the report")
+    ann_parser.add_argument("--top-k", type=int, default=10)
+    
+    # dedup command
+    dedup_parser = subparsers.add_parser("dedup", help="Build the near-duplicate index or report reclaimed space")
+    dedup_parser.add_argument("action", choices=["build", "report"])
+    
+    # shards command
+    shards_parser = subparsers.add_parser("shards", help="List vector sidecar shards, or freeze/thaw them")
+    shards_parser.add_argument("action", nargs="?", choices=["list", "freeze", "thaw"], default="list")
+    shards_parser.add_argument("names", nargs="*", help="Shards to freeze or thaw (default: all)")
+    shards_parser.add_argument("--before", default=None,
+                               help="Freeze only shards whose newest chunk is older than this "
+                                    "(ISO date or age such as 90d)")
     
     # stats command
     subparsers.add_parser("stats", help="Show statistics")
     
+    # metrics command
+    metrics_parser = subparsers.add_parser("metrics", help="Export rolling hot-path metrics")
+    metrics_parser.add_argument("--format", choices=["json", "prometheus"], default="json")
+    metrics_parser.add_argument("--reset", action="store_true", help="Discard the collected aggregates")
+    
+    # delete command
+    delete_parser = subparsers.add_parser("delete", help="Delete chunks by source file, content type or age")
+    delete_parser.add_argument("--source", default=None,
+                               help="File, or directory whose files, to delete (alone, also forgets the files)")
+    delete_parser.add_argument("--source-glob", default=None,
+                               help="Glob over source_file, such as 'memory/2024-*.md' (alone, also forgets the files)")
+    delete_parser.add_argument("--type", dest="content_type", default=None, help="Content type")
+    delete_parser.add_argument("--before", default=None,
+                               help="Only chunks created before this (ISO date or age such as 90d)")
+    delete_parser.add_argument("--dry-run", action="store_true", help="Count what would be deleted")
+    
+    # compact command
+    compact_parser = subparsers.add_parser("compact", help="Apply retention and reclaim space online")
+    compact_parser.add_argument("--full", action="store_true",
+                                help="Run one full VACUUM (needed once for stores made before incremental vacuum)")
+    compact_parser.add_argument("--step-pages", type=int, default=COMPACT_STEP_PAGES,
+                                help=f"Free pages released per transaction (default: {COMPACT_STEP_PAGES})")
+    
     # clear command
     clear_parser = subparsers.add_parser("clear", help="Clear the vector store")
     clear_parser.add_argument("--confirm", action="store_true", help="Skip confirmation")
     
-    args = parser.parse_args()
+    # serve command
+    serve_parser = subparsers.add_parser("serve", help="Run a daemon that keeps the index resident")
+    serve_parser.add_argument("--socket", default=None,
+                              help="Unix socket path (default: socket_path from config)")
     
-    if not args.command:
-        parser.print_help()
+    # bench command
+    bench_parser = subparsers.add_parser("bench", help="Benchmark ingest, search and cold start on a synthetic corpus")
+    bench_parser.add_argument("--sizes", type=bench_sizes,
+                              default=[1000, 10000], help="Comma-separated chunk counts, e.g. 1k,10k,100k,1M")
+    bench_parser.add_argument("--queries", type=int, default=50, help="Search and retrieve calls per run")
+    bench_parser.add_argument("--numpy", choices=["both", "on", "off"], default="both",
+                              help="Run with NumPy, without it (RAG_MEMORY_NO_NUMPY), or both")
+    bench_parser.add_argument("--mode", choices=["exact", "ann", "sparse", "hybrid"], default="exact",
+                              help="Search mode to measure; non-exact modes also report recall@10")
+    bench_parser.add_argument("--quantizer", choices=list(VectorSidecar.FORMATS), default="none",
+                              help="Sidecar row format; quantized runs also report recall@10")
+    bench_parser.add_argument("--workers", type=int, default=1, help="Ingest worker processes")
+    bench_parser.add_argument("--seed", type=int, default=0, help="Corpus and query generator seed")
+    bench_parser.add_argument("--format", choices=["text", "json"], default="text")
+    bench_parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    bench_parser.add_argument("--baseline", default=None, help="Earlier JSON report to compare against")
+    bench_parser.add_argument("--tolerance", type=float, default=0.25,
+                              help="Relative change counted as a regression (default: 0.25)")
+    bench_parser.add_argument("--work-dir", default=None, help="Keep corpora here instead of a temp directory")
+    bench_parser.add_argument("--keep", action="store_true", help="Keep generated corpora and stores")
+    # Internal: one measured run, executed in a child process
+    bench_parser.add_argument("--run", type=int, default=None, help=argparse.SUPPRESS)
+    bench_parser.add_argument("--corpus", default=None, help=argparse.SUPPRESS)
+    bench_parser.add_argument("--home", default=None, help=argparse.SUPPRESS)
+    
+    stress_parser = subparsers.add_parser("stress", help="Run concurrent ingest and search against a scratch store")
+    stress_parser.add_argument("--writers", type=int, default=2, help="Ingest threads (default: 2)")
+    stress_parser.add_argument("--processes", type=int, default=1,
+                               help="Ingest processes writing alongside the threads (default: 1)")
+    stress_parser.add_argument("--readers", type=int, default=4, help="Search threads (default: 4)")
+    stress_parser.add_argument("--seconds", type=float, default=10.0, help="How long to run (default: 10)")
+    stress_parser.add_argument("--mode", choices=["exact", "ann", "sparse", "hybrid"], default="exact",
+                               help="Search mode of the unchecked load searches")
+    stress_parser.add_argument("--shard-by", choices=list(ShardedSidecar.KEYS), default="none",
+                               help="Sidecar sharding of the scratch store")
+    stress_parser.add_argument("--resident", action="store_true", help="Search a resident in-memory index")
+    stress_parser.add_argument("--seed", type=int, default=0)
+    stress_parser.add_argument("--format", choices=["text", "json"], default="text")
+    stress_parser.add_argument("--work-dir", default=None, help="Create the scratch store here")
+    stress_parser.add_argument("--keep", action="store_true", help="Keep the scratch store")
+    # Internal: one writer process
+    stress_parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    stress_parser.add_argument("--config", default=None, help=argparse.SUPPRESS)
+    
+    return parser
+
+def run_command(rag: RAGMemory, args) -> None:
+    """Execute a parsed CLI command against rag, printing to stdout
+    
+    PROFILED_COMMANDS are timed into rag.metrics; with --profile their
+    stage breakdown is printed to stderr.
+    """
+    if args.command not in PROFILED_COMMANDS:
+        _run_command(rag, args)
         return
     
-    # Initialize RAG memory
+    rag.metrics.begin(args.command)
+    try:
+        _run_command(rag, args)
+    finally:
+        profile = rag.metrics.end()
+    if args.profile:
+        print_profile(profile, sys.stderr)
+
+def _run_command(rag: RAGMemory, args) -> None:
     config = DEFAULT_CONFIG.copy()
     if hasattr(args, 'path') and args.path:
         config["storage_path"] = args.path
     
-    rag = RAGMemory()
-    
     if args.command == "init":
         print(f"✅ RAG Memory initialized")
         print(f"   Backend: {args.backend}")
@@ -494,6 +5548,7 @@ def main():
     
     elif args.command == "ingest":
         all_chunk_ids = []
+        rag.ingest_report = rag._new_ingest_report()
         
         if args.text:
             metadata = {"content_type": args.content_type or "manual"}
@@ -509,26 +5564,45 @@ def main():
             if source_path.is_file():
                 chunk_ids = rag.add_file(str(source_path))
                 all_chunk_ids.extend(chunk_ids)
-                print(f"✅ Added {len(chunk_ids)} chunk(s) from {source_path.name}")
             
             elif source_path.is_dir():
                 pattern = "*.md" if not args.content_type else "*"
                 if args.content_type == "code":
                     pattern = "*.{py,js,ts,sh,bash}"
                 
-                chunk_ids = rag.add_directory(str(source_path), pattern)
+                chunk_ids = rag.add_directory(str(source_path), pattern, workers=args.workers)
                 all_chunk_ids.extend(chunk_ids)
-                print(f"✅ Added {len(chunk_ids)} chunk(s) from {source_path.name}")
+            
+            report = rag.ingest_report
+            print(f"✅ Ingested {source_path.name}: {report['added']} added, {report['updated']} updated, "
+                  f"{report['skipped']} unchanged, {report['removed']} removed")
+        
+        if rag.ingest_report["near_duplicates"]:
+            print(f"   Near-duplicate chunks dropped: {rag.ingest_report['near_duplicates']}")
         
         if all_chunk_ids:
             print(f"   Total chunks: {len(all_chunk_ids)}")
         
+        expired = sum(rag.apply_retention().values())
+        if expired:
+            print(f"   Retention: {expired} expired chunk(s) deleted")
+        
     elif args.command == "search":
+        if args.batch:
+            run_batch_search(rag, args, sys.stdin, sys.stdout)
+            return
+        if args.query is None:
+            raise SystemExit("search: a query is required unless --batch is given")
+        
         results = rag.search(
             args.query, 
             top_k=args.top_k, 
             threshold=args.threshold,
-            content_type=args.content_type
+            content_type=args.content_type,
+            mode=args.mode,
+            probes=args.probes,
+            filters=parse_filters(args),
+            collapse=args.collapse
         )
         
         if args.format == "json":
@@ -536,7 +5610,7 @@ def main():
         else:
             print(f"Found {len(results)} results for: {args.query}\n")
             for i, result in enumerate(results, 1):
-                print(f"{i}. [{result['content_type']}] (score: {result['similarity']:.2f})")
+                print(f"{i}. [{result['content_type']}] (score: {result.get('score', result['similarity']):.2f})")
                 print(f"   {result['text'][:200]}...")
                 print()
     
@@ -545,10 +5619,56 @@ def main():
             args.query,
             max_tokens=args.max_tokens,
             include_scores=args.include_scores,
-            content_type=args.content_type if hasattr(args, 'content_type') else None
+            content_type=args.content_type,
+            filters=parse_filters(args),
+            collapse=args.collapse
         )
         print(context)
     
+    elif args.command == "ann":
+        if args.action == "build":
+            indexed = rag.build_ann_index(tables=args.tables, bits=args.bits)
+            print(f"✅ ANN index built over {indexed} chunk(s)")
+        else:
+            report = rag.ann_recall_report(queries=args.queries, top_k=args.top_k)
+            print(f"ANN recall@{args.top_k} vs exact search")
+            print(f"   {'tables':>6} {'probes':>6} {'recall':>7} {'candidates':>11} {'ms':>8}")
+            for row in report:
+                print(f"   {row['tables']:>6} {row['probes']:>6} {row['recall']:>7.3f} "
+                      f"{row['avg_candidates']:>11.1f} {row['avg_ms']:>8.2f}")
+    
+    elif args.command == "dedup":
+        if args.action == "build":
+            indexed = rag.build_dedup_index()
+            print(f"✅ Near-duplicate index built over {indexed} chunk(s)")
+        else:
+            report = rag.dedup_report()
+            print(f"🧬 Near-duplicates (mode {report['mode']}, similarity >= {report['threshold']}, "
+                  f"<= {report['max_distance']} of 64 bits, {report['bands']} bands)")
+            print(f"   Chunks stored: {report['chunks']}")
+            print(f"   Dropped at ingest: {report['skipped']} chunk(s), {report['reclaimed_bytes']:,} bytes reclaimed")
+            print(f"   Still stored: {report['stored_duplicates']} near-duplicate chunk(s) in "
+                  f"{report['clusters']} cluster(s), ~{report['reclaimable_bytes']:,} bytes reclaimable")
+    
+    elif args.command == "shards":
+        if args.action == "freeze":
+            if not args.names and not args.before:
+                print("❌ Name the shards to freeze or pass --before")
+                return
+            frozen = rag.freeze_shards(args.names, args.before)
+            print(f"🧊 Froze {len(frozen)} shard(s)" + (f": {', '.join(frozen)}" if frozen else ""))
+        elif args.action == "thaw":
+            thawed = rag.thaw_shards(args.names)
+            print(f"✅ Thawed {len(thawed)} shard(s)" + (f": {', '.join(thawed)}" if thawed else ""))
+        else:
+            shards = rag.shard_report()
+            print(f"🗂️  Vector shards (shard_by {rag.config['shard_by']})")
+            print(f"   {'name':<28} {'rows':>8} {'live':>8} {'size':>12}  {'created_at range':<43} frozen")
+            for shard in shards:
+                span = f"{(shard['first_created'] or '-')[:19]} .. {(shard['last_created'] or '-')[:19]}"
+                print(f"   {shard['name'] or '(all)':<28} {shard['rows']:>8} {shard['live']:>8} "
+                      f"{shard['size_bytes']:>12,}  {span:<43} {'yes' if shard['frozen'] else 'no'}")
+    
     elif args.command == "stats":
         stats = rag.get_stats()
         print("📊 RAG Memory Statistics")
@@ -557,6 +5677,33 @@ def main():
         print(f"   Backend: {stats['storage_backend']}")
         print(f"   Embedding dim: {stats['embedding_dim']}")
         print(f"   Storage size: {stats['storage_size_bytes']:,} bytes")
+        if stats['vector_sidecar']:
+            sidecar = stats['vector_sidecar']
+            print(f"   Vector sidecar: {sidecar['size_bytes']:,} bytes "
+                  f"({sidecar['rows']} rows, {sidecar['tombstones']} tombstones)")
+            if sidecar['shard_by'] != "none":
+                print(f"   Shards: {sidecar['shards']} by {sidecar['shard_by']}, {sidecar['frozen_shards']} frozen")
+            if sidecar['quantizer'] != "none":
+                print(f"   Quantizer: {sidecar['quantizer']}, {sidecar['compression_ratio']}x smaller than float32 "
+                      f"(re-ranking {rag.config['quantizer_rerank']}x top-k at full precision)")
+        if stats['query_cache']:
+            cache = stats['query_cache']
+            print(f"   Query cache: {cache['hits']} hits, {cache['misses']} misses "
+                  f"({cache['entries']}/{cache['capacity']} entries)")
+        if stats['text_storage']['documents']:
+            text = stats['text_storage']
+            print(f"   Text: {text['text_bytes']:,} bytes in {text['documents']} document(s), "
+                  f"{text['compressed_bytes']:,} bytes compressed "
+                  f"({text['chunk_span_bytes']:,} bytes as overlapping chunks)")
+        if stats['dedup']['skipped'] or stats['dedup']['mode'] != "off":
+            dedup = stats['dedup']
+            print(f"   Dedup ({dedup['mode']}): {dedup['skipped']} near-duplicate chunk(s) dropped, "
+                  f"{dedup['reclaimed_bytes']:,} bytes reclaimed")
+        reclaimable = stats['reclaimable']
+        print(f"   Reclaimable: {reclaimable['total_bytes']:,} bytes "
+              f"({reclaimable['free_page_bytes']:,} free pages, "
+              f"{reclaimable['sidecar_tombstone_bytes']:,} sidecar tombstones, {reclaimable['wal_bytes']:,} WAL)"
+              + ("" if reclaimable['incremental_vacuum'] else "; run compact --full once"))
         
         if stats['type_counts']:
             print("\n   Content types:")
@@ -565,6 +5712,57 @@ def main():
         
         if stats['last_ingestion']:
             print(f"\n   Last ingestion: {stats['last_ingestion']}")
+        
+        if stats['metrics'].get('commands'):
+            metrics = stats['metrics']
+            print(f"\n   Metrics since {metrics['since']}:")
+            for name, entry in metrics['commands'].items():
+                print(f"      {name}: {entry['count']} call(s), p50 {entry['p50_ms']:.1f} ms, "
+                      f"p95 {entry['p95_ms']:.1f} ms, p99 {entry['p99_ms']:.1f} ms")
+            if metrics['counters']:
+                print("      " + ", ".join(f"{name}: {value:,}" for name, value in metrics['counters'].items()))
+    
+    elif args.command == "metrics":
+        if args.reset:
+            rag.metrics.reset()
+            print("✅ Metrics reset")
+        elif args.format == "prometheus":
+            sys.stdout.write(Metrics.prometheus(rag.metrics.snapshot()))
+        else:
+            print(json.dumps(rag.metrics.snapshot(), indent=2))
+    
+    elif args.command == "delete":
+        if not (args.source or args.source_glob or args.content_type or args.before):
+            print("❌ Pass --source, --source-glob, --type and/or --before (use clear to remove everything)")
+            return
+        removed = rag.delete(args.source, args.content_type, args.before, dry_run=args.dry_run,
+                             source_glob=args.source_glob)
+        verbs = ("Would delete", "forget") if args.dry_run else ("Deleted", "forgot")
+        print(f"🗑️  {verbs[0]} {removed['chunks']} chunk(s)"
+              + (f", {verbs[1]} {removed['files']} file(s)" if removed['files'] else ""))
+        if args.dry_run:
+            for source_file in removed['sources']:
+                print(f"   {source_file or '(no source file)'}")
+        if removed['chunks'] and not args.dry_run:
+            print("   Run compact to reclaim the space")
+    
+    elif args.command == "compact":
+        report = rag.compact(full=args.full, step_pages=args.step_pages)
+        expired = sum(report['retention'].values())
+        print(f"✅ Compacted: {report['reclaimed_bytes']:,} bytes reclaimed")
+        if expired:
+            print(f"   Retention: {expired} expired chunk(s) deleted "
+                  f"({', '.join(f'{ct}: {n}' for ct, n in report['retention'].items() if n)})")
+        print(f"   Vector sidecar: {report['sidecar_rows_dropped']} tombstoned row(s) dropped")
+        print(f"   Full-text index: {report['fts_merges']} merge step(s)")
+        if report['vacuum'] == "skipped":
+            print("   Vacuum: skipped, the store predates incremental vacuum; run compact --full once")
+        elif report['vacuum'] == "full":
+            print("   Vacuum: full")
+        else:
+            print(f"   Vacuum: {report['pages_freed']} free page(s) released")
+        if not report['wal_truncated']:
+            print("   WAL: readers kept it busy; it is truncated at a later checkpoint")
     
     elif args.command == "clear":
         if args.confirm:
@@ -573,5 +5771,30 @@ def main():
         else:
             print("⚠️  Use --confirm to clear the vector store")
 
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    
+    if not args.command:
+        parser.print_help()
+        return
+    
+    if args.command == "bench":
+        sys.exit(run_bench(args))
+    if args.command == "stress":
+        sys.exit(run_stress(args))
+    
+    rag = RAGMemory()
+    
+    if args.command == "serve":
+        rag.config["resident_index"] = True
+        serve(rag, args.socket)
+        return
+    
+    run_command(rag, args)
+    rag.metrics.flush()
+    if rag._query_cache is not None:
+        rag._query_cache.flush()
+
 if __name__ == "__main__":
     main()
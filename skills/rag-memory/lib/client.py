@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+RAG Memory - Thin CLI client
+Forwards commands to a running `rag-memory serve` daemon, falling back to
+in-process execution when none is listening. Imports only the standard
+library so that talking to the daemon stays cheap.
+"""
+
+import io
+import json
+import os
+import runpy
+import socket
+import sys
+from typing import Any, Dict, List, Optional
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.expanduser("~/.openclaw/data/rag-memory/config.json")
+DEFAULT_STORAGE_PATH = os.path.expanduser("~/.openclaw/data/rag-memory/")
+
+# Keep in sync with DAEMON_COMMANDS in __init__.py
+DAEMON_COMMANDS = ("search", "retrieve", "ingest", "stats", "metrics")
+CONNECT_TIMEOUT = 1.0
+
+def socket_path() -> str:
+    """Daemon socket path, resolved from config like RAGMemory does"""
+    config = {}
+    if os.path.exists(CONFIG_PATH):
+        try:
+            with open(CONFIG_PATH, 'r') as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    if config.get("socket_path"):
+        return os.path.expanduser(config["socket_path"])
+    storage_path = config.get("storage_path") or DEFAULT_STORAGE_PATH
+    return os.path.join(os.path.expanduser(storage_path), "rag-memory.sock")
+
+def connect(path: Optional[str] = None) -> Optional[socket.socket]:
+    """Connected socket to the daemon, or None if none is listening"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(path or socket_path())
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+def exchange(sock: socket.socket, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Send one request line and read one response line"""
+    sock.sendall(json.dumps(payload).encode() + b"\n")
+    with sock.makefile('rb') as reader:
+        line = reader.readline()
+    return json.loads(line) if line else None
+
+def request(payload: Dict[str, Any], path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Send one request to the daemon; None if no daemon is reachable"""
+    sock = connect(path)
+    if sock is None:
+        return None
+    try:
+        return exchange(sock, payload)
+    finally:
+        sock.close()
+
+def run_in_process(argv: List[str]) -> None:
+    """Run the full CLI in this process"""
+    sys.argv = [os.path.join(LIB_DIR, "__init__.py")] + argv
+    runpy.run_path(sys.argv[0], run_name="__main__")
+
+def main(argv: List[str]) -> int:
+    if argv and argv[0] in DAEMON_COMMANDS and not os.environ.get("RAG_MEMORY_NO_DAEMON"):
+        sock = connect()
+        if sock is not None:
+            payload = {"op": "cli", "argv": argv, "cwd": os.getcwd()}
+            if "--batch" in argv:
+                # The daemon cannot read our stdin, so it travels with the request
+                payload["stdin"] = sys.stdin.read()
+            try:
+                response = exchange(sock, payload)
+            finally:
+                sock.close()
+
+            if response is not None and response.get("ok"):
+                sys.stdout.write(response["stdout"])
+                sys.stderr.write(response["stderr"])
+                return response["status"]
+            if "stdin" in payload:
+                sys.stdin = io.StringIO(payload["stdin"])
+
+    run_in_process(argv)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
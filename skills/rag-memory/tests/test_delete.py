@@ -0,0 +1,75 @@
+"""Regression tests for deleting by source path
+
+Run with: python3 -m unittest discover skills/rag-memory/tests
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lib import RAGMemory
+
+
+class DeleteBySourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = Path(tempfile.mkdtemp(prefix="rag-memory-test-"))
+        self.addCleanup(shutil.rmtree, self.work, ignore_errors=True)
+        self.config_path = self.work / "config.json"
+        self.config_path.write_text(json.dumps({"storage_path": str(self.work / "store")}))
+        (self.work / "memory").mkdir()
+        for day in ("2025-01-01", "2025-01-02"):
+            (self.work / "memory" / f"{day}.md").write_text(f"# {day}\n\nNotes about the deploy on {day}.\n")
+        self.cwd = os.getcwd()
+        os.chdir(self.work)
+        self.addCleanup(os.chdir, self.cwd)
+    
+    def open(self) -> RAGMemory:
+        return RAGMemory(str(self.config_path))
+    
+    def test_relative_ingest_absolute_delete(self):
+        rag = self.open()
+        rag.add_file("memory/2025-01-01.md")
+        rag.add_file("memory/2025-01-02.md")
+        target = str((self.work / "memory" / "2025-01-01.md").resolve())
+        
+        self.assertTrue(rag.search("deploy", top_k=5, threshold=-1.0, filters={"source": target}))
+        removed = rag.delete(source=target)
+        self.assertGreater(removed["chunks"], 0)
+        self.assertEqual(removed["files"], 1)
+        self.assertEqual(removed["sources"], [target])
+        self.assertFalse(rag.search("deploy", top_k=5, threshold=-1.0, filters={"source": target}))
+        self.assertTrue(rag.search("deploy", top_k=5, threshold=-1.0, filters={"source": "memory/2025-01-02.md"}))
+    
+    def test_manifest_kept_when_no_chunk_matches(self):
+        rag = self.open()
+        rag.add_file("memory/2025-01-01.md")
+        with rag._connections.writer() as conn:
+            conn.execute("UPDATE chunks SET source_file = 'elsewhere.md'")
+        
+        removed = rag.delete(source="memory/2025-01-01.md")
+        self.assertEqual((removed["chunks"], removed["files"]), (0, 0))
+    
+    def test_relative_source_files_migrated(self):
+        rag = self.open()
+        rag.add_file("memory/2025-01-01.md")
+        with rag._connections.writer() as conn:
+            conn.execute("UPDATE chunks SET source_file = 'memory/2025-01-01.md'")
+            conn.execute("DELETE FROM store_meta WHERE key = 'source_files_resolved'")
+        
+        rag = self.open()
+        target = str((self.work / "memory" / "2025-01-01.md").resolve())
+        with rag._connections.snapshot() as cursor:
+            cursor.execute("SELECT DISTINCT source_file, json_extract(metadata, '$.source_file') FROM chunks")
+            self.assertEqual(cursor.fetchall(), [(target, target)])
+        self.assertGreater(rag.delete(source=target)["chunks"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()